@@ -4,6 +4,54 @@ const fs = require('fs')
 const FormData = require('form-data')
 const Analysis = require('../models/Analysis')
 
+const ML_TIMEOUT = 120000 // 120 seconds (for cold starts on free tier)
+
+// Scheduling identity at the ML service: its fair scheduler queues requests
+// per client, so name this deployment (list ML_CLIENT_ID in the service's
+// SCHEDULER_TRUSTED_CLIENTS or SCHEDULER_CLIENT_WEIGHTS) and/or send its key
+const mlIdentityHeaders = () => {
+  const headers = {}
+  if (process.env.ML_CLIENT_ID) headers['X-Client-ID'] = process.env.ML_CLIENT_ID
+  if (process.env.ML_API_KEY) headers['X-API-Key'] = process.env.ML_API_KEY
+  return headers
+}
+
+// Upload the file to the ML service as multipart form data
+const predictUpload = (mlServiceUrl, filePath) => {
+  const formData = new FormData()
+  formData.append('file', fs.createReadStream(filePath))
+
+  return axios.post(`${mlServiceUrl}/predict`, formData, {
+    headers: { ...formData.getHeaders(), ...mlIdentityHeaders() },
+    timeout: ML_TIMEOUT,
+    maxContentLength: Infinity,
+    maxBodyLength: Infinity
+  })
+}
+
+// /predict-local answers the shared volume cannot serve (400 rejected path or
+// type, 403 outside the shared root, 404 disabled or missing) with these
+const SHARED_FALLBACK_STATUSES = [400, 403, 404]
+
+// Let the ML service read the file from the shared uploads volume
+// (ML_SHARED_VOLUME=true, with SHARED_VOLUME_ROOT pointing at uploads/ there)
+const predictShared = async (mlServiceUrl, fileId, filePath) => {
+  try {
+    return await axios.post(`${mlServiceUrl}/predict-local`, new URLSearchParams({ path: fileId }), {
+      headers: mlIdentityHeaders(),
+      timeout: ML_TIMEOUT
+    })
+  } catch (error) {
+    // Endpoint disabled, file not visible to the ML service, outside its shared
+    // root or rejected by its path checks: upload it instead
+    if (SHARED_FALLBACK_STATUSES.includes(error.response?.status)) {
+      console.warn('Shared volume analysis unavailable, uploading file:', error.response.data?.detail)
+      return predictUpload(mlServiceUrl, filePath)
+    }
+    throw error
+  }
+}
+
 exports.analyzeAudio = async (req, res) => {
   try {
     const { fileId } = req.body
@@ -30,18 +78,11 @@ exports.analyzeAudio = async (req, res) => {
     // Call ML service
     const mlServiceUrl = process.env.ML_SERVICE_URL || 'http://localhost:8000'
     
-    // Create form data for ML service
-    const formData = new FormData()
-    formData.append('file', fs.createReadStream(filePath))
-
     let mlResponse
     try {
-      mlResponse = await axios.post(`${mlServiceUrl}/predict`, formData, {
-        headers: formData.getHeaders(),
-        timeout: 120000, // 120 seconds (for cold starts on free tier)
-        maxContentLength: Infinity,
-        maxBodyLength: Infinity
-      })
+      mlResponse = process.env.ML_SHARED_VOLUME === 'true'
+        ? await predictShared(mlServiceUrl, fileId, filePath)
+        : await predictUpload(mlServiceUrl, filePath)
     } catch (mlError) {
       console.error('ML Service error:', mlError.message)
       console.error('ML Service full error:', mlError.response?.data || mlError)
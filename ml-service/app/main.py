@@ -1,20 +1,66 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Form, Header, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+from typing import Optional, List
 import uvicorn
 import os
+import json
+import time
+import asyncio
+import functools
+import uuid
+import hashlib
+import hmac
 import tempfile
+import mmap
 from dotenv import load_dotenv
-from app.services.prediction_service import predict_emotion
-from app.services.audio_processor import extract_features
 
+# Load .env before the services read their configuration at import time
 load_dotenv()
 
+# Size thread pools before NumPy / TensorFlow create them
+from app.services.autotune import apply_profile, active_profile
+apply_profile()
+
+from app.services.prediction_service import predict_emotion
+from app.services.audio_processor import extract_features, FEATURE_FIELDS
+from app.services.similarity_index import get_similarity_index
+from app.services.decoder import AUDIO_EXTENSIONS
+from app.services.job_queue import (get_job_queue, callback_allowed, JOB_MAX_PRIORITY, JOB_MAX_FILES,
+                                    JOB_MAX_UPLOAD_MB)
+from app.services.scheduler import get_scheduler, trusted_clients, QueueFull
+from app.services import metrics, profiling, streaming, backends, watchdog
+
+# Store CNN embeddings of every analysed track in the similarity index
+SIMILARITY_INDEX_ENABLED = os.getenv("SIMILARITY_INDEX_ENABLED", "false").lower() == "true"
+
+# Default per-request latency budget for /predict (0 = no deadline)
+DEFAULT_DEADLINE_MS = int(os.getenv("DEFAULT_DEADLINE_MS", 0))
+
+# Token required by the /admin endpoints (admin endpoints are disabled when unset)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Directory shared with co-located callers; /predict-local analyses files
+# under it in place (the endpoint is disabled when unset)
+SHARED_VOLUME_ROOT = os.getenv("SHARED_VOLUME_ROOT", "")
+
 app = FastAPI(
     title="Navarasa Music Emotion Analyzer - ML Service",
     description="Machine Learning API for music emotion recognition",
     version="1.0.0"
 )
 
+@app.on_event("startup")
+async def preload_backends():
+    """
+    Load and warm up PRELOAD_BACKENDS now instead of on their first
+    request, then start the memory watchdog (which tells a supervisor the
+    worker is ready)
+    """
+    await run_in_threadpool(backends.preload)
+    watchdog.start()
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -24,12 +70,134 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def stage_timing(request: Request, call_next):
+    """Collect per-stage timings and report them in a Server-Timing header"""
+    stages = metrics.start_request()
+    start = time.perf_counter()
+    response = await call_next(request)
+    total_ms = (time.perf_counter() - start) * 1000
+    
+    # Key by route template so path parameters and unknown URLs cannot grow /metrics
+    route = request.scope.get("route")
+    metrics.record(f"request.{route.path if route is not None else 'unmatched'}", total_ms)
+    response.headers["Server-Timing"] = metrics.server_timing_header({**stages, "total": total_ms})
+    return response
+
+@app.middleware("http")
+async def memory_tracking(request: Request, call_next):
+    """Count served requests and the RSS each one added (see watchdog.py)"""
+    rss_before = backends.rss_mb()
+    response = await call_next(request)
+    watchdog.request_finished(request.url.path, backends.rss_mb() - rss_before)
+    return response
+
+@app.middleware("http")
+async def request_profiling(request: Request, call_next):
+    """Tag every request with an ID and profile it when asked to (see profiling.py)"""
+    request_id = request.headers.get("X-Request-ID")
+    if not profiling.valid_request_id(request_id):
+        request_id = uuid.uuid4().hex
+    
+    if profiling.should_profile(request.headers.get("X-Profile")):
+        with profiling.RequestProfile(request_id) as profile:
+            response = await call_next(request)
+        response.headers["X-Profile-Id"] = profile.profile_id
+    else:
+        response = await call_next(request)
+    
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+def require_admin(token):
+    if not ADMIN_TOKEN or not token or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+# X-Client-ID values callers may claim (SCHEDULER_CLIENT_WEIGHTS / SCHEDULER_TRUSTED_CLIENTS)
+TRUSTED_CLIENT_IDS = trusted_clients()
+
+def client_id(request: Request):
+    """
+    Scheduling identity: X-Client-ID if it names a configured client, else
+    a digest of X-API-Key, else the peer address. Unknown X-Client-ID values
+    are ignored so a caller cannot get a fresh queue per request by
+    rotating them.
+    """
+    client = request.headers.get("X-Client-ID")
+    if client and client in TRUSTED_CLIENT_IDS:
+        return client
+    api_key = request.headers.get("X-API-Key")
+    if api_key:
+        return "key-" + hashlib.sha256(api_key.encode()).hexdigest()[:12]
+    return request.client.host if request.client else "anonymous"
+
+def resolve_shared_path(relative_path):
+    """Resolve a caller-supplied path, refusing anything outside SHARED_VOLUME_ROOT"""
+    if not SHARED_VOLUME_ROOT:
+        raise HTTPException(status_code=404, detail="Local analysis is disabled (SHARED_VOLUME_ROOT is not set)")
+    if not relative_path or "\x00" in relative_path or os.path.isabs(relative_path):
+        raise HTTPException(status_code=400, detail="path must be relative to the shared volume root")
+    
+    # realpath resolves '..' and symlinks, so neither can lead out of the root
+    root = os.path.realpath(SHARED_VOLUME_ROOT)
+    resolved = os.path.realpath(os.path.join(root, relative_path))
+    if resolved == root or os.path.commonpath([root, resolved]) != root:
+        raise HTTPException(status_code=403, detail="path is outside the shared volume")
+    if not os.path.isfile(resolved):
+        raise HTTPException(status_code=404, detail="File not found on the shared volume")
+    
+    if os.path.splitext(resolved)[1].lower().lstrip('.') not in AUDIO_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="File must be an audio file")
+    return resolved
+
+def file_sha1(path):
+    """SHA-1 of a file's bytes, read through a memory map instead of into memory"""
+    if os.path.getsize(path) == 0:
+        return hashlib.sha1(b"").hexdigest()
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return hashlib.sha1(mapped).hexdigest()
+
+async def analyze_file(request: Request, path, filename, track_id, digest, index, deadline, progressive, backend):
+    """
+    Run the prediction for an audio file on disk and index its embedding
+    
+    Args:
+        digest: Callable returning the file's SHA-1, the default track ID
+    """
+    print("🚀 Starting emotion prediction...")
+    store_embedding = SIMILARITY_INDEX_ENABLED if index is None else index
+    result = await run_scheduled(request, predict_emotion, path,
+                                 return_embedding=store_embedding, deadline=deadline,
+                                 progressive=progressive, backend=backend)
+    print("✅ Prediction completed successfully!")
+    
+    embedding = result.pop('embedding', None)
+    if embedding is not None:
+        track_id = track_id or digest()
+        get_similarity_index().add(track_id, embedding, {
+            'filename': filename,
+            'primaryEmotion': result['primaryEmotion'],
+            'confidence': result['confidence'],
+        })
+        result['trackId'] = track_id
+        print(f"🔖 Embedding indexed as {track_id}")
+    return result
+
+async def run_scheduled(request: Request, fn, *args, **kwargs):
+    """Run blocking analysis work through the fair per-client scheduler"""
+    try:
+        future = get_scheduler().submit(client_id(request),
+                                        functools.partial(profiling.in_request_profile, fn, *args, **kwargs))
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return await asyncio.wrap_future(future)
+
 @app.get("/")
 async def root():
     return {
         "message": "Navarasa ML Service is running",
         "version": "1.0.0",
-        "endpoints": ["/predict", "/extract-features", "/health"]
+        "endpoints": ["/predict", "/predict-local", "/extract-features", "/similar", "/jobs", "/ws/analyze", "/backends", "/metrics", "/health"]
     }
 
 @app.get("/health")
@@ -39,8 +207,55 @@ async def health_check():
         "service": "Navarasa ML Service"
     }
 
+@app.get("/backends")
+async def list_backends():
+    """
+    Prediction backends of this deployment: which are enabled, available
+    and loaded, how long each took to load and the memory it added, plus
+    the process RSS and the default backend
+    """
+    return backends.backend_report()
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Rolling request and stage latency percentiles (milliseconds), including
+    per-client scheduler queue waits (queue_wait.<client>), plus the
+    scheduler's current per-client queue state, the applied runtime
+    tuning profile and this worker's memory watchdog counters
+    """
+    return {**metrics.snapshot(), "scheduler": get_scheduler().stats(), "tuning": active_profile(),
+            "worker": watchdog.stats()}
+
+@app.get("/admin/profiles")
+async def get_profiles(x_admin_token: Optional[str] = Header(None)):
+    """List stored request profiles, newest first"""
+    require_admin(x_admin_token)
+    return {"profiles": profiling.list_profiles()}
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, x_admin_token: Optional[str] = Header(None)):
+    """
+    Download the profile of one request by the X-Profile-Id it was returned
+    with: collapsed stacks (flamegraph.pl / speedscope) or a cProfile .prof file
+    """
+    require_admin(x_admin_token)
+    path = profiling.profile_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"No profile stored with ID {profile_id}")
+    return FileResponse(path, filename=os.path.basename(path))
+
 @app.post("/predict")
-async def predict(file: UploadFile = File(...)):
+async def predict(
+    request: Request,
+    file: UploadFile = File(...),
+    track_id: Optional[str] = Form(None),
+    index: Optional[bool] = Query(None, description="Store the CNN embedding in the similarity index"),
+    deadline_ms: Optional[int] = Query(None, ge=0, description="Latency budget in milliseconds"),
+    x_deadline_ms: Optional[int] = Header(None, ge=0),
+    progressive: Optional[bool] = Query(None, description="Stop analysing once the answer is clear"),
+    backend: Optional[str] = Query(None, description="Prediction backend, e.g. rules (see /backends)"),
+):
     """
     Predict the emotion of an uploaded audio file
     
@@ -49,7 +264,20 @@ async def predict(file: UploadFile = File(...)):
         - primaryEmotion: The dominant emotion
         - confidence: Confidence score of primary emotion
         - features: Audio features extracted
+        - trackId: Similarity index ID (only when the embedding was indexed)
+        - tier: Backend that answered; degraded=True when the latency budget
+          (deadline_ms / X-Deadline-Ms / DEFAULT_DEADLINE_MS) forced the
+          rule-based tier
+        - secondsConsumed / earlyExit: Seconds of audio analysed in
+          progressive mode (progressive=true or PROGRESSIVE_INFERENCE)
     """
+    request_start = time.perf_counter()
+    if backend is not None and not backends.is_available(backend):
+        raise HTTPException(status_code=400, detail=f"Backend '{backend}' is not available "
+                                                    f"(see /backends)")
+    budget_ms = next((v for v in (deadline_ms, x_deadline_ms) if v is not None), DEFAULT_DEADLINE_MS)
+    deadline = request_start + budget_ms / 1000 if budget_ms else None
+    
     temp_path = None
     try:
         print(f"\n🎵 Received file: {file.filename}, type: {file.content_type}")
@@ -65,7 +293,7 @@ async def predict(file: UploadFile = File(...)):
         
         # Save temporarily using system temp directory (Windows/Linux/Mac compatible)
         temp_dir = tempfile.gettempdir()
-        temp_path = os.path.join(temp_dir, f"navarasa_{file.filename}")
+        temp_path = os.path.join(temp_dir, f"navarasa_{uuid.uuid4().hex}_{os.path.basename(file.filename or 'upload')}")
         print(f"💾 Saving to: {temp_path}")
         
         with open(temp_path, "wb") as f:
@@ -75,10 +303,9 @@ async def predict(file: UploadFile = File(...)):
         
         try:
             # Predict emotion
-            print("🚀 Starting emotion prediction...")
-            result = predict_emotion(temp_path)
-            print("✅ Prediction completed successfully!")
-            return result
+            return await analyze_file(request, temp_path, file.filename, track_id,
+                                      lambda: hashlib.sha1(content).hexdigest(),
+                                      index, deadline, progressive, backend)
         except Exception as pred_error:
             print(f"❌ Prediction error: {pred_error}")
             import traceback
@@ -92,6 +319,50 @@ async def predict(file: UploadFile = File(...)):
                 
     except HTTPException:
         raise
+    except backends.BackendUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        print(f"❌ Server error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+
+@app.post("/predict-local")
+async def predict_local(
+    request: Request,
+    path: str = Form(..., description="File path relative to SHARED_VOLUME_ROOT"),
+    track_id: Optional[str] = Form(None),
+    index: Optional[bool] = Query(None, description="Store the CNN embedding in the similarity index"),
+    deadline_ms: Optional[int] = Query(None, ge=0, description="Latency budget in milliseconds"),
+    x_deadline_ms: Optional[int] = Header(None, ge=0),
+    progressive: Optional[bool] = Query(None, description="Stop analysing once the answer is clear"),
+    backend: Optional[str] = Query(None, description="Prediction backend, e.g. rules (see /backends)"),
+):
+    """
+    Predict the emotion of a file the caller already stored on the shared
+    volume (e.g. the Node backend's uploads directory mounted as
+    SHARED_VOLUME_ROOT). The file is decoded in place: no multipart upload,
+    no buffered copy and no temp file. Same response as /predict.
+    
+    Returns 404 when SHARED_VOLUME_ROOT is not set or the file does not
+    exist, 403 for paths that resolve outside the root.
+    """
+    request_start = time.perf_counter()
+    local_path = resolve_shared_path(path)
+    if backend is not None and not backends.is_available(backend):
+        raise HTTPException(status_code=400, detail=f"Backend '{backend}' is not available "
+                                                    f"(see /backends)")
+    budget_ms = next((v for v in (deadline_ms, x_deadline_ms) if v is not None), DEFAULT_DEADLINE_MS)
+    deadline = request_start + budget_ms / 1000 if budget_ms else None
+    
+    print(f"\n🎵 Received shared file: {path}")
+    try:
+        return await analyze_file(request, local_path, os.path.basename(local_path), track_id,
+                                  lambda: file_sha1(local_path), index, deadline, progressive, backend)
+    except HTTPException:
+        raise
+    except backends.BackendUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         print(f"❌ Server error: {str(e)}")
         import traceback
@@ -99,30 +370,259 @@ async def predict(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
 @app.post("/extract-features")
-async def extract_audio_features(file: UploadFile = File(...)):
+async def extract_audio_features(
+    request: Request,
+    file: UploadFile = File(...),
+    fields: Optional[str] = Query(None, description="Comma-separated feature names (default: all)"),
+):
     """
     Extract audio features from uploaded file without prediction
+    
+    Only the requested fields (and the intermediate representations they
+    depend on) are computed, e.g. ?fields=tempo,rms_mean
     """
+    requested = None
+    if fields:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = sorted(set(requested) - set(FEATURE_FIELDS))
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown feature fields: {', '.join(unknown)}")
+    
     try:
         content = await file.read()
         
         # Save temporarily using system temp directory (Windows/Linux/Mac compatible)
         temp_dir = tempfile.gettempdir()
-        temp_path = os.path.join(temp_dir, f"navarasa_{file.filename}")
+        temp_path = os.path.join(temp_dir, f"navarasa_{uuid.uuid4().hex}_{os.path.basename(file.filename or 'upload')}")
         
         with open(temp_path, "wb") as f:
             f.write(content)
         
         try:
-            features = extract_features(temp_path)
+            features = await run_scheduled(request, extract_features, temp_path, fields=requested)
             return {"features": features}
         finally:
             if os.path.exists(temp_path):
                 os.remove(temp_path)
                 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Feature extraction failed: {str(e)}")
 
+@app.get("/similar")
+async def similar_tracks(
+    track_id: str = Query(..., description="ID of an already indexed track"),
+    k: int = Query(10, ge=1, le=100),
+):
+    """
+    Return the k indexed tracks whose CNN embeddings are closest to an
+    already analysed track (no inference is run)
+    """
+    index = get_similarity_index()
+    query = index.get_vector(track_id)
+    if query is None:
+        raise HTTPException(status_code=404, detail=f"Track {track_id} is not in the similarity index")
+    
+    start = time.perf_counter()
+    results = index.search(query, k=k, exclude_id=track_id)
+    return {
+        "trackId": track_id,
+        "results": results,
+        "searchMs": round((time.perf_counter() - start) * 1000, 3),
+    }
+
+@app.post("/similar")
+async def similar_to_upload(request: Request, file: UploadFile = File(...), k: int = Query(10, ge=1, le=100)):
+    """
+    Embed an uploaded audio file with the CNN (one inference on the query
+    only) and return the k most similar indexed tracks
+    """
+    content = await file.read()
+    temp_path = os.path.join(tempfile.gettempdir(), f"navarasa_{uuid.uuid4().hex}_{os.path.basename(file.filename or 'upload')}")
+    with open(temp_path, "wb") as f:
+        f.write(content)
+    
+    try:
+        result = await run_scheduled(request, predict_emotion, temp_path, return_embedding=True, backend='cnn')
+    except HTTPException:
+        raise
+    except backends.BackendUnavailable:
+        raise HTTPException(status_code=503, detail="Similarity search requires the trained CNN model")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    
+    embedding = result.pop('embedding', None)
+    if embedding is None:
+        raise HTTPException(status_code=503, detail="Similarity search requires the trained CNN model")
+    
+    start = time.perf_counter()
+    results = get_similarity_index().search(embedding, k=k, exclude_id=hashlib.sha1(content).hexdigest())
+    return {
+        "primaryEmotion": result['primaryEmotion'],
+        "results": results,
+        "searchMs": round((time.perf_counter() - start) * 1000, 3),
+    }
+
+@app.post("/jobs", status_code=202)
+async def create_job(
+    files: List[UploadFile] = File(...),
+    priority: int = Form(0),
+    callback_url: Optional[str] = Form(None),
+    x_admin_token: Optional[str] = Header(None),
+):
+    """
+    Queue a long or bulk analysis (e.g. a full album) for the job workers
+    (python job_worker.py). Poll GET /jobs/{jobId} for progress and
+    results, or pass callback_url (a host in JOB_CALLBACK_HOSTS) to
+    receive the finished job as a POST. Priorities are clamped to
+    +-JOB_MAX_PRIORITY; raising one above 0 needs the admin token.
+    """
+    if callback_url and not callback_allowed(callback_url):
+        raise HTTPException(status_code=400, detail="callback_url must be JOB_CALLBACK_URL or on a host in JOB_CALLBACK_HOSTS")
+    if priority > 0:
+        require_admin(x_admin_token)
+    priority = max(-JOB_MAX_PRIORITY, min(priority, JOB_MAX_PRIORITY))
+    if len(files) > JOB_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"A job takes at most {JOB_MAX_FILES} files")
+    
+    uploads = []
+    remaining = int(JOB_MAX_UPLOAD_MB * 1024 * 1024)
+    for file in files:
+        if not file.content_type or not file.content_type.startswith('audio/'):
+            raise HTTPException(status_code=400, detail=f"{file.filename} is not an audio file")
+        # Read in chunks so an oversized job is refused before it is all in memory
+        chunks = []
+        while chunk := await file.read(1024 * 1024):
+            remaining -= len(chunk)
+            if remaining < 0:
+                raise HTTPException(status_code=413, detail=f"A job's uploads may total at most {JOB_MAX_UPLOAD_MB:g} MB")
+            chunks.append(chunk)
+        uploads.append((file.filename, b"".join(chunks)))
+    
+    job_id = get_job_queue().create_job(uploads, priority=priority, callback_url=callback_url)
+    print(f"📥 Queued job {job_id} with {len(uploads)} file(s), priority {priority}")
+    return {"jobId": job_id, "status": "queued", "total": len(uploads)}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status, progress and per-file results of a queued job"""
+    job = get_job_queue().get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    
+    # Internal details: storage paths and where the result gets POSTed
+    job.pop('callbackUrl', None)
+    for item in job['items']:
+        item.pop('path', None)
+    return job
+
+@app.websocket("/ws/analyze")
+async def analyze_stream(websocket: WebSocket):
+    """
+    Live analysis of streamed PCM audio
+    
+    Protocol:
+        client -> {"sampleRate": 44100, "channels": 2, "format": "s16le"}
+                  (optional; default 22050 Hz mono f32le)
+        client -> binary PCM chunks (at most STREAM_MAX_CHUNK_SECONDS each)
+        server -> {"type": "estimate", "seconds", "emotions", "primaryEmotion",
+                   "confidence"} every STREAM_UPDATE_SECONDS of audio, scored
+                  by the CNN on the latest 30 s
+        client -> {"type": "end"} to get a final estimate and close
+    """
+    await websocket.accept()
+    if not backends.is_available('cnn'):
+        await websocket.send_json({"type": "error", "detail": "Streaming analysis requires the CNN model"})
+        await websocket.close(code=1011)
+        return
+    if not streaming.acquire_stream():
+        await websocket.send_json({"type": "error", "detail": "Too many concurrent streams"})
+        await websocket.close(code=1013)
+        return
+    
+    from app.services.cnn_classifier import classify_spectrogram, spectrogram_input_supported
+    
+    try:
+        await run_in_threadpool(backends.get_backend, 'cnn')
+        if not await run_in_threadpool(spectrogram_input_supported):
+            raise backends.BackendUnavailable(
+                "Streaming analysis needs spectrogram input, but the inference server expects waveforms")
+    except backends.BackendUnavailable as e:
+        streaming.release_stream()
+        await websocket.send_json({"type": "error", "detail": str(e)})
+        await websocket.close(code=1011)
+        return
+    
+    async def send_estimate(state):
+        emotions = await run_in_threadpool(classify_spectrogram, state.spectrogram())
+        primary_emotion = max(emotions, key=emotions.get)
+        await websocket.send_json({
+            "type": "estimate",
+            "seconds": round(state.seconds, 2),
+            "emotions": emotions,
+            "primaryEmotion": primary_emotion,
+            "confidence": emotions[primary_emotion],
+        })
+    
+    state = streaming.IncrementalMel()
+    next_update = streaming.STREAM_UPDATE_SECONDS
+    print(f"🎙️ Stream opened ({streaming.active_streams()} active)")
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            
+            if message.get("text") is not None:
+                control = json.loads(message["text"])
+                if not isinstance(control, dict):
+                    raise ValueError("Control messages must be JSON objects")
+                if control.get("type") == "end":
+                    if state.frames:
+                        await send_estimate(state)
+                    await websocket.close()
+                    break
+                if state.samples:
+                    raise ValueError("Stream format must be sent before any audio")
+                try:
+                    sample_rate = int(control.get("sampleRate", streaming.SAMPLE_RATE))
+                    channels = int(control.get("channels", 1))
+                except (TypeError, ValueError, OverflowError):
+                    raise ValueError("sampleRate and channels must be integers")
+                state = streaming.IncrementalMel(
+                    sample_rate=sample_rate,
+                    channels=channels,
+                    sample_format=control.get("format", "f32le"),
+                )
+                await websocket.send_json({
+                    "type": "ready",
+                    "updateSeconds": streaming.STREAM_UPDATE_SECONDS,
+                    "windowSeconds": streaming.DURATION,
+                })
+                continue
+            
+            state.push(message["bytes"])
+            if state.seconds >= next_update:
+                await send_estimate(state)
+                next_update = state.seconds + streaming.STREAM_UPDATE_SECONDS
+    except WebSocketDisconnect:
+        pass
+    except (ValueError, json.JSONDecodeError) as e:
+        await websocket.send_json({"type": "error", "detail": str(e)})
+        await websocket.close(code=1003)
+    except RuntimeError as e:
+        # Scoring failed (e.g. the inference server errored): report it instead of dropping the socket
+        print(f"❌ Stream analysis failed: {e}")
+        await websocket.send_json({"type": "error", "detail": str(e)})
+        await websocket.close(code=1011)
+    finally:
+        streaming.release_stream()
+        print(f"🎙️ Stream closed after {state.seconds:.1f}s of audio")
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8000))
     uvicorn.run("app.main:app", host="0.0.0.0", port=port, reload=True)
@@ -1,71 +1,168 @@
 import librosa
 import numpy as np
+from app.services.metrics import stage
+from app.services.decoder import decode, iter_decode
+from app.services.frame_kernel import frame_signal, stft_magnitude, frame_features
 
-def extract_features(audio_path):
+# Analysis parameters shared by every backend
+SAMPLE_RATE = 22050
+DURATION = 30
+
+def load_audio(audio_path, sr=SAMPLE_RATE, duration=DURATION):
+    """
+    Decode an audio file once so the waveform can be shared between
+    feature extraction and the classifiers
+    
+    Returns:
+        (y, sr) - mono float32 waveform and its sample rate
+    """
+    with stage('decode'):
+        return decode(audio_path, sr=sr, duration=duration)
+
+def load_audio_segments(audio_path, seconds, sr=SAMPLE_RATE):
+    """
+    Decode growing prefixes of an audio file (e.g. the first 5, 10, 20 and
+    30 seconds), reading every sample only once
+    
+    Yields:
+        (y, sr) per prefix; stops early when the file is shorter
+    """
+    segments = iter_decode(audio_path, sr, seconds)
+    while True:
+        with stage('decode'):
+            y = next(segments, None)
+        if y is None:
+            return
+        yield y, sr
+
+# Output fields of extract_features, in response order
+FEATURE_FIELDS = [
+    'mfccs_mean', 'mfccs_std',
+    'spectral_centroid_mean', 'spectral_centroid_std',
+    'spectral_rolloff_mean', 'spectral_rolloff_std',
+    'zcr_mean', 'zcr_std',
+    'tempo',
+    'chroma_mean', 'chroma_std',
+    'rms_mean', 'rms_std',
+]
+
+# Frame-level features reduced by the fused kernel (frame_kernel.frame_features)
+TIME_FEATURES = ('rms', 'zcr')
+SPECTRAL_FEATURES = ('spectral_centroid', 'spectral_rolloff', 'chroma')
+
+class LazyFeatures:
+    """
+    Lazily evaluated feature set over one decoded waveform
+    
+    Each output field is computed on first access and intermediate
+    representations are computed at most once and shared:
+        frames -> stft (magnitude) -> mel -> mfcc, onset_envelope -> tempo
+        frames + stft -> frame_stats (centroid, rolloff, chroma, zcr, rms)
+        frames -> time_stats (zcr, rms only, when no spectral field is asked for)
+    so asking for only tempo and RMS never builds the chroma or MFCCs.
+    Results match the individual librosa.feature calls on y.
+    """
+    
+    def __init__(self, y, sr=SAMPLE_RATE):
+        self.y = y
+        self.sr = sr
+        self._nodes = {}
+    
+    def node(self, name):
+        """Return an intermediate representation, computing it (and its inputs) once"""
+        if name not in self._nodes:
+            self._nodes[name] = getattr(self, f'_compute_{name}')()
+        return self._nodes[name]
+    
+    def _compute_frames(self):
+        return frame_signal(self.y)
+    
+    def _compute_stft(self):
+        return stft_magnitude(self.node('frames'))
+    
+    def _compute_mel(self):
+        return librosa.power_to_db(librosa.feature.melspectrogram(S=self.node('stft') ** 2, sr=self.sr))
+    
+    def _compute_mfcc(self):
+        return librosa.feature.mfcc(S=self.node('mel'), sr=self.sr, n_mfcc=20)
+    
+    def _compute_frame_stats(self):
+        # Fused pass: every frame-level feature and its mean/std at once
+        return frame_features(self.node('frames'), self.node('stft'), sr=self.sr)
+    
+    def _compute_time_stats(self):
+        return frame_features(self.node('frames'), sr=self.sr)
+    
+    def _compute_onset_envelope(self):
+        # beat_track aggregates the onset envelope with a median
+        return librosa.onset.onset_strength(S=self.node('mel'), sr=self.sr, aggregate=np.median)
+    
+    def _compute_tempo(self):
+        tempo, _ = librosa.beat.beat_track(onset_envelope=self.node('onset_envelope'), sr=self.sr)
+        return tempo
+    
+    def __getitem__(self, field):
+        if field == 'tempo':
+            return float(self.node('tempo'))
+        
+        base, _, stat = field.rpartition('_')
+        node = {'mfccs': 'mfcc', 'chroma': 'chroma'}.get(base, base)
+        if field not in FEATURE_FIELDS:
+            raise KeyError(field)
+        
+        if node == 'mfcc':
+            # Per-coefficient statistics
+            reduce = np.mean if stat == 'mean' else np.std
+            return reduce(self.node(node), axis=1).tolist()
+        
+        # rms / zcr come from the fused pass if it has run (or will run) anyway
+        if node in TIME_FEATURES and 'frame_stats' not in self._nodes:
+            stats = self.node('time_stats')[node]
+        else:
+            stats = self.node('frame_stats')[node]
+        value = stats[0] if stat == 'mean' else stats[1]
+        return value.tolist() if node == 'chroma' else value
+    
+    def get(self, fields=None):
+        """Compute the requested output fields (all of them by default)"""
+        fields = FEATURE_FIELDS if fields is None else fields
+        with stage('features'):
+            if any(f.rpartition('_')[0] in SPECTRAL_FEATURES for f in fields):
+                self.node('frame_stats')
+            return {field: self[field] for field in fields}
+
+def extract_features(audio_path, y=None, sr=SAMPLE_RATE, fields=None, lazy=None):
     """
     Extract audio features for emotion prediction
     
     Args:
         audio_path: Path to audio file
+        y: Already decoded waveform (skips loading audio_path)
+        sr: Sample rate of y
+        fields: Names from FEATURE_FIELDS to compute (default: all);
+            only the intermediate representations they need are built
+        lazy: LazyFeatures already built over the same audio (reuses the
+            representations it has computed, e.g. the STFT of a fingerprint)
         
     Returns:
         Dictionary of extracted features
     """
+    unknown = set(fields or []) - set(FEATURE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown feature fields: {', '.join(sorted(unknown))}")
+    
     try:
         # Load audio file - OPTIMIZED: Only analyze first 30 seconds at lower sample rate
-        y, sr = librosa.load(audio_path, sr=22050, duration=30, mono=True)
-        
-        # Extract MFCCs (Mel-Frequency Cepstral Coefficients)
-        mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=20)
-        mfccs_mean = np.mean(mfccs, axis=1)
-        mfccs_std = np.std(mfccs, axis=1)
-        
-        # Extract Spectral Centroid
-        spectral_centroid = librosa.feature.spectral_centroid(y=y, sr=sr)
-        spectral_centroid_mean = np.mean(spectral_centroid)
-        spectral_centroid_std = np.std(spectral_centroid)
-        
-        # Extract Spectral Rolloff
-        spectral_rolloff = librosa.feature.spectral_rolloff(y=y, sr=sr)
-        spectral_rolloff_mean = np.mean(spectral_rolloff)
-        spectral_rolloff_std = np.std(spectral_rolloff)
-        
-        # Extract Zero Crossing Rate
-        zcr = librosa.feature.zero_crossing_rate(y)
-        zcr_mean = np.mean(zcr)
-        zcr_std = np.std(zcr)
-        
-        # Extract Tempo
-        tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-        
-        # Extract Chroma features
-        chroma = librosa.feature.chroma_stft(y=y, sr=sr)
-        chroma_mean = np.mean(chroma, axis=1)
-        chroma_std = np.std(chroma, axis=1)
-        
-        # Extract RMS Energy
-        rms = librosa.feature.rms(y=y)
-        rms_mean = np.mean(rms)
-        rms_std = np.std(rms)
+        if lazy is None:
+            if y is None:
+                y, sr = load_audio(audio_path)
+            lazy = LazyFeatures(y, sr)
         
-        # Compile all features
-        features = {
-            'mfccs_mean': mfccs_mean.tolist(),
-            'mfccs_std': mfccs_std.tolist(),
-            'spectral_centroid_mean': float(spectral_centroid_mean),
-            'spectral_centroid_std': float(spectral_centroid_std),
-            'spectral_rolloff_mean': float(spectral_rolloff_mean),
-            'spectral_rolloff_std': float(spectral_rolloff_std),
-            'zcr_mean': float(zcr_mean),
-            'zcr_std': float(zcr_std),
-            'tempo': float(tempo),
-            'chroma_mean': chroma_mean.tolist(),
-            'chroma_std': chroma_std.tolist(),
-            'rms_mean': float(rms_mean),
-            'rms_std': float(rms_std),
-        }
+        # Keep the response in FEATURE_FIELDS order whatever order was asked for
+        if fields is not None:
+            fields = [f for f in FEATURE_FIELDS if f in fields]
         
-        return features
+        return lazy.get(fields)
         
     except Exception as e:
         raise Exception(f"Feature extraction failed: {str(e)}")
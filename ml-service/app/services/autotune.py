@@ -0,0 +1,366 @@
+"""
+CPU topology-aware runtime tuning
+Left at their defaults, every uvicorn worker starts TensorFlow intra/inter-op
+pools and BLAS/OpenMP/numba pools sized to the whole machine (or the whole
+host, inside a container), so a multi-worker deployment oversubscribes the
+CPU. This module detects the CPUs actually available (affinity mask and
+cgroup v1/v2 CPU quota) and sizes:
+
+    workers     uvicorn worker processes (serve.py)
+    threads     per-process math threads: OMP/OpenBLAS/MKL/numba and
+                TensorFlow intra-op
+    batch_size  clips per CNN forward pass (shared inference server,
+                bulk_analyze.py)
+
+Calibration runs the service's own decode -> features -> inference path
+(backends.batch_input / predict_batch) for each workers x threads x batch
+combination that fits on the CPUs and keeps the highest throughput whose
+p99 latency meets the target:
+
+    python -m app.services.autotune calibrate --audio sample.wav --target-p99-ms 2000
+
+The profile is saved to TUNING_PROFILE_PATH and applied at startup by
+apply_profile() (app.main, serve.py) before NumPy or TensorFlow create
+their thread pools. Variables already set in the environment always win;
+without a profile, threads default to CPUs // workers.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import subprocess
+from datetime import datetime, timezone
+
+TUNING_PROFILE_PATH = os.getenv('TUNING_PROFILE_PATH', 'models/tuning_profile.json')
+# 'off' leaves every pool at the library defaults
+TUNING_ENABLED = os.getenv('TUNING_ENABLED', 'true').lower() == 'true'
+TUNING_TARGET_P99_MS = float(os.getenv('TUNING_TARGET_P99_MS', 2000))
+
+# Per-process thread pools sized by the profile
+THREAD_ENV_VARS = (
+    'OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+    'NUMEXPR_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMBA_NUM_THREADS',
+    'TF_NUM_INTRAOP_THREADS',
+)
+
+# Profile applied in this process (reported on /metrics)
+_active = None
+
+
+def _cgroup_quota():
+    """CPU quota of this process's cgroup in CPUs, or None when unlimited"""
+    try:
+        with open('/proc/self/cgroup') as f:
+            entries = [line.strip().split(':', 2) for line in f if line.strip()]
+    except OSError:
+        return None
+
+    limits = []
+    for _, controllers, path in entries:
+        if controllers == '':
+            # cgroup v2: "<quota|max> <period>" in cpu.max, limits apply on every level
+            path = path.strip('/')
+            while True:
+                try:
+                    with open(os.path.join('/sys/fs/cgroup', path, 'cpu.max')) as f:
+                        quota, period = f.read().split()
+                    if quota != 'max':
+                        limits.append(int(quota) / int(period))
+                except (OSError, ValueError):
+                    pass
+                if not path:
+                    break
+                path = os.path.dirname(path)
+        elif 'cpu' in controllers.split(','):
+            # cgroup v1: cfs_quota_us is -1 when unlimited; inside a container
+            # the hierarchy is usually mounted at its own root
+            for base in (os.path.join('/sys/fs/cgroup/cpu', path.strip('/')), '/sys/fs/cgroup/cpu'):
+                try:
+                    with open(os.path.join(base, 'cpu.cfs_quota_us')) as f:
+                        quota = int(f.read())
+                    with open(os.path.join(base, 'cpu.cfs_period_us')) as f:
+                        period = int(f.read())
+                except (OSError, ValueError):
+                    continue
+                if quota > 0 and period > 0:
+                    limits.append(quota / period)
+                break
+    return min(limits) if limits else None
+
+
+def available_cpus():
+    """CPUs this process may use: affinity mask capped by the cgroup quota (rounded up)"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_quota()
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return max(1, cpus)
+
+
+def load_profile(path=TUNING_PROFILE_PATH):
+    """Saved calibration profile, or None"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def default_profile(cpus=None, workers=None):
+    """Oversubscription-free settings without calibration: CPUs split evenly over the workers"""
+    cpus = cpus or available_cpus()
+    workers = workers or int(os.getenv('WEB_CONCURRENCY', 1))
+    return {
+        'cpus': cpus,
+        'workers': workers,
+        'threads': max(1, cpus // workers),
+        'batch_size': None,
+        'source': 'default',
+    }
+
+
+def resolve_profile():
+    """Calibrated profile when it matches this machine's CPU count, else the default"""
+    cpus = available_cpus()
+    profile = load_profile()
+    if profile is None:
+        return default_profile(cpus)
+    if profile.get('cpus') != cpus:
+        print(f"⚠️ Tuning profile was calibrated for {profile.get('cpus')} CPUs, "
+              f"{cpus} available now - using defaults (recalibrate with python -m app.services.autotune calibrate)")
+        return default_profile(cpus)
+    return {**profile, 'source': TUNING_PROFILE_PATH}
+
+
+def apply_profile(profile=None):
+    """
+    Size this process's thread pools (and expose workers / batch size) from
+    the profile. Must run before NumPy / TensorFlow are imported for the
+    environment variables to take effect; pools that already exist are
+    limited through threadpoolctl when it is installed.
+
+    Returns:
+        The applied settings ({} when TUNING_ENABLED is false)
+    """
+    global _active
+    if not TUNING_ENABLED:
+        _active = {}
+        return _active
+
+    profile = profile or resolve_profile()
+    threads = str(profile['threads'])
+    settings = {name: threads for name in THREAD_ENV_VARS}
+    # Requests already run concurrently; a second inter-op pool only adds contention
+    settings['TF_NUM_INTEROP_THREADS'] = '1' if profile['threads'] < 4 else '2'
+    settings['WEB_CONCURRENCY'] = str(profile['workers'])
+    if profile.get('batch_size'):
+        settings['INFERENCE_MAX_BATCH'] = str(profile['batch_size'])
+
+    applied = {}
+    for name, value in settings.items():
+        # Explicit configuration wins over the profile
+        if name not in os.environ:
+            os.environ[name] = value
+        applied[name] = os.environ[name]
+
+    if 'numpy' in sys.modules:
+        try:
+            from threadpoolctl import threadpool_limits
+            threadpool_limits(int(applied['OMP_NUM_THREADS']))
+        except ImportError:
+            pass
+
+    _active = {
+        'source': profile.get('source'),
+        'cpus': profile['cpus'],
+        'workers': int(applied['WEB_CONCURRENCY']),
+        'threads': int(applied['OMP_NUM_THREADS']),
+        'batchSize': int(applied['INFERENCE_MAX_BATCH']) if 'INFERENCE_MAX_BATCH' in applied else None,
+    }
+    return _active
+
+
+def active_profile():
+    """Settings applied by apply_profile() in this process"""
+    return _active
+
+
+def candidate_grid(cpus, batch_sizes):
+    """(workers, threads, batch) combinations with workers x threads <= cpus"""
+    worker_counts = sorted({2 ** i for i in range(cpus.bit_length()) if 2 ** i <= cpus} | {cpus})
+    grid = []
+    for workers in worker_counts:
+        for threads in sorted({1, cpus // workers}):
+            for batch in batch_sizes:
+                grid.append((workers, threads, batch))
+    return grid
+
+
+def calibration_worker(audio_path, backend_name, batch_size, seconds):
+    """
+    Closed-loop benchmark in one process: decode, features and model input
+    for batch_size clips, then one scoring call. Prints 'ready' after the
+    warm-up, starts measuring on a line from stdin (so all workers of a run
+    overlap) and returns the per-batch latencies.
+    """
+    from app.services import backends
+    from app.services.audio_processor import load_audio, extract_features
+
+    backend = backends.get_backend(backend_name)
+
+    def one_batch():
+        inputs, features = [], []
+        for _ in range(batch_size):
+            y, sr = load_audio(audio_path)
+            features.append(extract_features(audio_path, y=y, sr=sr, fields=backend.feature_fields()))
+            inputs.append(backend.batch_input(audio_path, y))
+        if backend.supports_batch:
+            backend.predict_batch(inputs, features)
+        else:
+            for f in features:
+                backend.predict(audio_path, audio_features=f)
+
+    one_batch()
+    sys.__stdout__.write('ready\n')
+    sys.__stdout__.flush()
+    sys.stdin.readline()
+
+    latencies = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        batch_start = time.perf_counter()
+        one_batch()
+        latencies.append((time.perf_counter() - batch_start) * 1000)
+    return {'clips': len(latencies) * batch_size, 'elapsed': time.perf_counter() - start,
+            'latenciesMs': latencies}
+
+
+_WORKER_SCRIPT = """
+import sys, json, contextlib
+from app.services.autotune import calibration_worker
+with contextlib.redirect_stdout(sys.stderr):
+    result = calibration_worker(sys.argv[1], sys.argv[2], int(sys.argv[3]), float(sys.argv[4]))
+sys.__stdout__.write(json.dumps(result) + '\\n')
+"""
+
+
+def measure(workers, threads, batch_size, audio_path, backend_name, seconds):
+    """Throughput (clips/s) and p99 batch latency of one configuration, in fresh processes"""
+    import numpy as np
+
+    env = {**os.environ, 'TUNING_ENABLED': 'false', 'TF_CPP_MIN_LOG_LEVEL': '2',
+           'TF_NUM_INTEROP_THREADS': '1' if threads < 4 else '2',
+           **{name: str(threads) for name in THREAD_ENV_VARS}}
+    procs = [subprocess.Popen([sys.executable, '-c', _WORKER_SCRIPT, audio_path, backend_name,
+                               str(batch_size), str(seconds)],
+                              env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, text=True)
+             for _ in range(workers)]
+    try:
+        if any(p.stdout.readline().strip() != 'ready' for p in procs):
+            return {'error': 'calibration worker failed to start'}
+        for p in procs:
+            p.stdin.write('go\n')
+            p.stdin.flush()
+        results = [json.loads(p.stdout.readline()) for p in procs]
+    except (json.JSONDecodeError, BrokenPipeError):
+        return {'error': 'calibration worker failed'}
+    finally:
+        for p in procs:
+            p.kill()
+            p.wait()
+
+    latencies = [ms for r in results for ms in r['latenciesMs']]
+    if not latencies:
+        return {'error': 'no batch completed; increase --seconds'}
+    return {
+        'throughput': round(sum(r['clips'] for r in results) / max(r['elapsed'] for r in results), 3),
+        'p99Ms': round(float(np.percentile(latencies, 99)), 1),
+        'p50Ms': round(float(np.percentile(latencies, 50)), 1),
+    }
+
+
+def calibrate(audio_path, backend_name=None, target_p99_ms=TUNING_TARGET_P99_MS,
+              batch_sizes=(1, 4, 8), seconds=10, output=TUNING_PROFILE_PATH):
+    """Measure every candidate configuration, pick and save the profile"""
+    from app.services import backends
+
+    backend_name = backend_name or backends.default_backend()
+    if not backends.create_backend(backend_name).supports_batch:
+        batch_sizes = (1,)
+    cpus = available_cpus()
+    grid = candidate_grid(cpus, batch_sizes)
+    print(f"🖥️ {cpus} CPUs available - calibrating {len(grid)} configurations "
+          f"with the {backend_name} backend ({seconds:g}s each)")
+
+    results = []
+    print(f"   {'workers':>7} {'threads':>7} {'batch':>5} {'clips/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for workers, threads, batch in grid:
+        r = measure(workers, threads, batch, audio_path, backend_name, seconds)
+        results.append({'workers': workers, 'threads': threads, 'batch_size': batch, **r})
+        if 'error' in r:
+            print(f"   {workers:>7} {threads:>7} {batch:>5} ❌ {r['error']}")
+        else:
+            print(f"   {workers:>7} {threads:>7} {batch:>5} {r['throughput']:>8.2f} "
+                  f"{r['p50Ms']:>8.0f} {r['p99Ms']:>8.0f}")
+
+    measured = [r for r in results if 'error' not in r]
+    if not measured:
+        raise SystemExit("❌ No configuration could be measured")
+    within = [r for r in measured if r['p99Ms'] <= target_p99_ms]
+    if within:
+        best = max(within, key=lambda r: r['throughput'])
+    else:
+        best = min(measured, key=lambda r: r['p99Ms'])
+        print(f"⚠️ No configuration meets p99 <= {target_p99_ms:g} ms; using the lowest p99")
+
+    profile = {
+        'cpus': cpus,
+        'workers': best['workers'],
+        'threads': best['threads'],
+        'batch_size': best['batch_size'],
+        'throughput': best['throughput'],
+        'p99Ms': best['p99Ms'],
+        'targetP99Ms': target_p99_ms,
+        'backend': backend_name,
+        'calibratedAt': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'results': results,
+    }
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(profile, f, indent=2)
+    print(f"✅ {best['workers']} workers x {best['threads']} threads, batch {best['batch_size']}: "
+          f"{best['throughput']:.2f} clips/s, p99 {best['p99Ms']:.0f} ms")
+    print(f"💾 Profile saved to: {output}")
+    return profile
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='CPU topology-aware runtime tuning')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('show', help='Detected CPUs and the settings startup would apply')
+    cal = sub.add_parser('calibrate', help='Benchmark configurations and save the best profile')
+    cal.add_argument('--audio', required=True, help='Representative audio clip')
+    cal.add_argument('--backend', help='Backend to calibrate (default: the service default)')
+    cal.add_argument('--target-p99-ms', type=float, default=TUNING_TARGET_P99_MS,
+                     help='Latency target for one batch at p99')
+    cal.add_argument('--batch-sizes', default='1,4,8', help='Comma-separated batch sizes to try')
+    cal.add_argument('--seconds', type=float, default=10, help='Measurement time per configuration')
+    cal.add_argument('--output', default=TUNING_PROFILE_PATH, help='Where to save the profile')
+    args = parser.parse_args()
+
+    if args.command == 'show':
+        print(json.dumps({'cpus': available_cpus(), 'cgroupQuota': _cgroup_quota(),
+                          'profile': resolve_profile()}, indent=2))
+    else:
+        calibrate(args.audio, args.backend, args.target_p99_ms,
+                  tuple(int(b) for b in args.batch_sizes.split(',')), args.seconds, args.output)
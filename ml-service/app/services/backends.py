@@ -0,0 +1,436 @@
+"""
+Prediction backend registry
+Backends (CNN, YAMNet, summary-feature model, rule-based and any plugin) are registered by name
+and only imported / loaded on first use, so a rules-only deployment never
+imports TensorFlow. Each backend has a cheap availability check (model
+file present, package installed) and a load step that pulls in its heavy
+dependencies; load time and the RSS it added are kept for /backends.
+
+ENABLED_BACKENDS lists the backends a deployment offers, in priority
+order; the first available one is the default and /predict?backend=
+selects another per request. PRELOAD_BACKENDS are loaded at startup.
+Extra backends can be added without touching this module:
+
+    BACKEND_PLUGINS="fast=mypackage.fast_backend:FastBackend"
+
+where the class follows the Backend interface below.
+
+Deployment profile figures (import + load time, RSS):
+    python -m app.services.backends
+"""
+
+import os
+import sys
+import time
+import json
+import hashlib
+import importlib
+import importlib.util
+import threading
+import subprocess
+
+ENABLED_BACKENDS = [b.strip() for b in os.getenv('ENABLED_BACKENDS', 'cnn,yamnet,summary,rules').split(',') if b.strip()]
+PRELOAD_BACKENDS = [b.strip() for b in os.getenv('PRELOAD_BACKENDS', '').split(',') if b.strip()]
+BACKEND_PLUGINS = os.getenv('BACKEND_PLUGINS', '')
+
+
+class BackendUnavailable(Exception):
+    """The requested backend is unknown, disabled or cannot run here"""
+
+
+def file_digest(path, length=12):
+    """Short SHA-256 of a model file, used to version its results"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:length]
+
+
+def rss_mb():
+    """Resident set size of this process in MB"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    # ru_maxrss is the peak, in KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+class Backend:
+    """
+    Interface of a prediction backend
+
+    Class attributes:
+        tier: Name reported as 'tier' in responses
+        accepts_waveform: predict() can score a decoded waveform y
+            (needed for progressive inference and decode sharing)
+        supports_embedding: predict() can return the CNN embedding
+        supports_batch: batch_input() / predict_batch() score many clips
+            in one vectorized call (bulk_analyze.py)
+    """
+
+    tier = None
+    accepts_waveform = False
+    supports_embedding = False
+    supports_batch = False
+
+    def available(self):
+        """Cheap check (no heavy imports) that the backend can run here"""
+        return True
+
+    def load(self):
+        """Import heavy dependencies and load models"""
+
+    def predict(self, audio_path, return_embedding=False, y=None, audio_features=None, summary=True):
+        """Standard prediction response (emotions, primaryEmotion, confidence, features)"""
+        raise NotImplementedError
+
+    def warm_up(self):
+        """Throwaway prediction after load, so the first request does not pay for tracing"""
+
+    def model_version(self):
+        """Identifier of the model behind the results (tier plus model file digest)"""
+        return self.tier
+
+    def feature_fields(self):
+        """extract_features fields the backend needs (None = all)"""
+        return ['tempo', 'rms_mean', 'spectral_centroid_mean']
+
+    def batch_input(self, audio_path, y):
+        """Per-clip model input for predict_batch; light imports only (runs in worker processes)"""
+        return None
+
+    def predict_batch(self, inputs, audio_features):
+        """[{emotion: probability}] for parallel lists of batch_input() results and features"""
+        raise NotImplementedError
+
+
+class CNNBackend(Backend):
+    accepts_waveform = True
+    supports_embedding = True
+    supports_batch = True
+
+    def __init__(self):
+        from app.services import cnn_classifier
+        self.cnn = cnn_classifier
+        self.tier = cnn_classifier.CNN_TIER
+
+    def available(self):
+        return self.cnn.CNN_INFERENCE_MODE == 'server' or os.path.exists(self.cnn.MODEL_PATH)
+
+    def load(self):
+        if self.cnn.CNN_INFERENCE_MODE == 'server':
+            from app.services.inference_server import get_inference_client
+            get_inference_client()
+        else:
+            self.cnn.load_trained_model()
+
+    def predict(self, audio_path, return_embedding=False, y=None, audio_features=None, summary=True):
+        return self.cnn.predict_with_cnn(audio_path, return_embedding=return_embedding, y=y,
+                                         audio_features=audio_features, summary=summary)
+
+    def warm_up(self):
+        if self.cnn.CNN_INFERENCE_MODE == 'local':
+            import numpy as np
+            noise = np.random.default_rng(0).standard_normal(self.cnn.SAMPLE_RATE).astype(np.float32) * 1e-3
+            self.cnn.classify_batch([self.cnn.model_input(None, y=noise)])
+
+    def model_version(self):
+        return f"{self.tier}-{file_digest(self.cnn.MODEL_PATH)}"
+
+    def batch_input(self, audio_path, y):
+        return self.cnn.model_input(audio_path, y)
+
+    def predict_batch(self, inputs, audio_features):
+        return self.cnn.classify_batch(inputs)
+
+
+class YAMNetBackend(Backend):
+    tier = 'yamnet'
+
+    def available(self):
+        return all(importlib.util.find_spec(m) is not None for m in ('tensorflow', 'tensorflow_hub'))
+
+    def load(self):
+        from app.services import yamnet_classifier
+        yamnet_classifier.get_yamnet_model()
+
+    def feature_fields(self):
+        # yamnet_classifier.AUDIO_FEATURE_FIELDS (importing it pulls in TensorFlow)
+        return ['tempo', 'rms_mean', 'spectral_centroid_mean', 'zcr_mean']
+
+    def predict(self, audio_path, return_embedding=False, y=None, audio_features=None, summary=True):
+        from app.services.yamnet_classifier import predict_with_yamnet_and_audio_features
+        return predict_with_yamnet_and_audio_features(audio_path, audio_features=audio_features)
+
+
+class SummaryBackend(Backend):
+    tier = 'summary_model'
+    accepts_waveform = True
+    supports_batch = True
+
+    def available(self):
+        from app.services.prediction_service import SUMMARY_MODEL_PATH
+        return os.path.exists(SUMMARY_MODEL_PATH) and importlib.util.find_spec('sklearn') is not None
+
+    def load(self):
+        from app.services.prediction_service import load_model
+        load_model()
+
+    def predict(self, audio_path, return_embedding=False, y=None, audio_features=None, summary=True):
+        from app.services.audio_processor import extract_features
+        from app.services.prediction_service import predict_with_summary_model
+        if audio_features is None:
+            audio_features = extract_features(audio_path, y=y)
+        return predict_with_summary_model(audio_features)
+
+    def model_version(self):
+        from app.services.prediction_service import SUMMARY_MODEL_PATH
+        return f"{self.tier}-{file_digest(SUMMARY_MODEL_PATH)}"
+
+    def feature_fields(self):
+        return None
+
+    def predict_batch(self, inputs, audio_features):
+        from app.services.prediction_service import load_model, predict_with_model
+        return predict_with_model(load_model(), audio_features)
+
+
+class RulesBackend(Backend):
+    tier = 'rule_based'
+    accepts_waveform = True
+    supports_batch = True
+
+    def predict(self, audio_path, return_embedding=False, y=None, audio_features=None, summary=True):
+        from app.services.audio_processor import extract_features
+        from app.services.prediction_service import predict_with_rules, RULE_BASED_FIELDS
+        if audio_features is None:
+            audio_features = extract_features(audio_path, y=y, fields=RULE_BASED_FIELDS)
+        return predict_with_rules(audio_features)
+
+    def feature_fields(self):
+        from app.services.prediction_service import RULE_BASED_FIELDS
+        return RULE_BASED_FIELDS
+
+    def predict_batch(self, inputs, audio_features):
+        from app.services.prediction_service import classify_emotion_rule_based
+        return [classify_emotion_rule_based(f) for f in audio_features]
+
+
+# name -> Backend subclass or "module:Class" (imported on first use)
+_registry = {
+    'cnn': CNNBackend,
+    'yamnet': YAMNetBackend,
+    'summary': SummaryBackend,
+    'rules': RulesBackend,
+}
+_instances = {}
+_loaded = {}        # name -> {'loadSeconds', 'rssDeltaMb'}
+_errors = {}
+_failed = set()
+_lock = threading.Lock()        # construction
+_load_locks = {}                # name -> Lock held while loading
+
+
+def register_backend(name, backend):
+    """Register a Backend subclass, or a "module:Class" path imported on first use"""
+    _registry[name] = backend
+
+
+def _register_plugins(spec):
+    for entry in filter(None, (e.strip() for e in spec.split(','))):
+        name, _, target = entry.partition('=')
+        if not name or ':' not in target:
+            raise ValueError(f"Invalid BACKEND_PLUGINS entry: {entry} (use name=module:Class)")
+        register_backend(name.strip(), target.strip())
+
+
+_register_plugins(BACKEND_PLUGINS)
+
+
+def _instance(name):
+    """Construct a backend (importing only its light module)"""
+    if name not in _instances:
+        backend = _registry[name]
+        if isinstance(backend, str):
+            module, _, attr = backend.partition(':')
+            backend = getattr(importlib.import_module(module), attr)
+        _instances[name] = backend()
+    return _instances[name]
+
+
+def create_backend(name):
+    """Construct a backend without loading it (worker processes preparing batch inputs)"""
+    if name not in _registry:
+        raise BackendUnavailable(f"Unknown backend '{name}' (registered: {', '.join(_registry)})")
+    with _lock:
+        return _instance(name)
+
+
+def is_available(name):
+    """Enabled, constructible, passing its availability check and not failed to load"""
+    if name not in ENABLED_BACKENDS or name not in _registry or name in _failed:
+        return False
+    try:
+        with _lock:
+            return _instance(name).available()
+    except Exception as e:
+        _errors[name] = str(e)
+        return False
+
+
+def default_backend():
+    """First available backend in ENABLED_BACKENDS order"""
+    for name in ENABLED_BACKENDS:
+        if is_available(name):
+            return name
+    raise BackendUnavailable("No prediction backend is available")
+
+
+def _load(name):
+    with _lock:
+        backend = _instance(name)
+        load_lock = _load_locks.setdefault(name, threading.Lock())
+
+    # Loading can take seconds; only requests for this backend wait on it
+    with load_lock:
+        if name in _failed:
+            raise BackendUnavailable(f"Backend '{name}' failed to load: {_errors.get(name)}")
+        if name not in _loaded:
+            rss_before, start = rss_mb(), time.perf_counter()
+            print(f"📥 Loading '{name}' backend...")
+            try:
+                backend.load()
+            except Exception as e:
+                # Like a missing model at startup: stay off until restart
+                _errors[name] = str(e)
+                _failed.add(name)
+                raise BackendUnavailable(f"Backend '{name}' failed to load: {e}") from e
+            _loaded[name] = {
+                'loadSeconds': round(time.perf_counter() - start, 3),
+                'rssDeltaMb': round(rss_mb() - rss_before, 1),
+            }
+            print(f"✅ '{name}' backend ready in {_loaded[name]['loadSeconds']:.2f}s "
+                  f"(+{_loaded[name]['rssDeltaMb']:.0f} MB)")
+    return backend
+
+
+def get_backend(name=None):
+    """
+    Return a loaded backend, loading it (and its heavy imports) on first use
+
+    Args:
+        name: Backend name; by default the first ENABLED_BACKENDS entry
+            that is available and loads (falling through on failure)
+
+    Raises:
+        BackendUnavailable: unknown, disabled, unavailable or failed to load
+    """
+    if name is None:
+        for candidate in ENABLED_BACKENDS:
+            if is_available(candidate):
+                try:
+                    return _load(candidate)
+                except BackendUnavailable as e:
+                    print(f"⚠️ {e} - falling back to the next backend")
+        raise BackendUnavailable("No prediction backend is available")
+
+    if name not in _registry:
+        raise BackendUnavailable(f"Unknown backend '{name}' (registered: {', '.join(_registry)})")
+    if not is_available(name):
+        raise BackendUnavailable(f"Backend '{name}' is not available in this deployment")
+    return _load(name)
+
+
+def backend_report():
+    """Availability, load state and cost of every registered backend"""
+    try:
+        default = default_backend()
+    except BackendUnavailable:
+        default = None
+    return {
+        'default': default,
+        'enabled': ENABLED_BACKENDS,
+        'rssMb': round(rss_mb(), 1),
+        'backends': {
+            name: {
+                'enabled': name in ENABLED_BACKENDS,
+                'available': is_available(name),
+                'loaded': name in _loaded,
+                **_loaded.get(name, {}),
+                **({'error': _errors[name]} if name in _errors else {}),
+            }
+            for name in _registry
+        },
+    }
+
+
+def loaded_backends():
+    """Names of the backends loaded in this process"""
+    return list(_loaded)
+
+
+def preload(names=None):
+    """
+    Load and warm up backends (PRELOAD_BACKENDS by default; called at
+    startup); failures are reported, not raised
+    """
+    for name in PRELOAD_BACKENDS if names is None else names:
+        try:
+            backend = get_backend(name)
+        except BackendUnavailable as e:
+            print(f"⚠️ {e}")
+            continue
+        try:
+            backend.warm_up()
+        except Exception as e:
+            print(f"⚠️ Warm-up of '{name}' failed: {e}")
+
+
+_PROFILE_SCRIPT = """
+import time, json
+start = time.perf_counter()
+import app.main
+from app.services import backends
+imported = time.perf_counter() - start
+rss_import = backends.rss_mb()
+backends.preload()
+print(json.dumps({'importSeconds': round(imported, 2), 'readySeconds': round(time.perf_counter() - start, 2),
+                  'rssImportMb': round(rss_import), 'rssReadyMb': round(backends.rss_mb()),
+                  'default': backends.backend_report()['default']}))
+"""
+
+
+def measure_profile(enabled):
+    """Start-up time and RSS of the service for one ENABLED_BACKENDS profile, in a fresh interpreter"""
+    env = {**os.environ, 'ENABLED_BACKENDS': enabled, 'PRELOAD_BACKENDS': enabled}
+    proc = subprocess.run([sys.executable, '-c', _PROFILE_SCRIPT], env=env,
+                          capture_output=True, text=True, check=False)
+    lines = [line for line in proc.stdout.splitlines() if line.startswith('{')]
+    if proc.returncode != 0 or not lines:
+        return {'error': proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'failed'}
+    return json.loads(lines[-1])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Start-up time and memory per deployment profile')
+    parser.add_argument('--profiles', nargs='+', default=['rules', 'summary,rules', 'yamnet,rules', 'cnn,rules'],
+                        help='ENABLED_BACKENDS values to measure (each fully preloaded)')
+    args = parser.parse_args()
+
+    print(f"{'profile':<16} {'default':<8} {'import s':>8} {'ready s':>8} {'RSS import':>10} {'RSS ready':>10}")
+    for profile in args.profiles:
+        r = measure_profile(profile)
+        if 'error' in r:
+            print(f"{profile:<16} ❌ {r['error']}")
+            continue
+        print(f"{profile:<16} {r['default'] or '-':<8} {r['importSeconds']:>8.2f} {r['readySeconds']:>8.2f} "
+              f"{r['rssImportMb']:>7} MB {r['rssReadyMb']:>7} MB")
@@ -1,18 +1,41 @@
 """
 CNN-based Music Emotion Classifier
 Uses trained CNN model for accurate emotion prediction
+
+With CNN_INFERENCE_MODE=server the model is not loaded in this process;
+spectrograms are sent to the shared inference server instead
+(see inference_server.py), so TensorFlow is only imported when needed.
 """
 
 import numpy as np
 import librosa
-import tensorflow as tf
-from tensorflow import keras
 import pickle
 import os
+from app.services.audio_processor import load_audio, LazyFeatures
+from app.services.metrics import stage
+
+# Model paths per variant: 'teacher' is the full CNN (train_model.py),
+# 'student' the distilled low-latency CNN (train_model.py --distill)
+MODEL_PATHS = {
+    'teacher': 'models/navarasa_cnn.h5',
+    'student': 'models/navarasa_cnn_student.h5',
+}
+CNN_MODEL_VARIANT = os.getenv('CNN_MODEL_VARIANT', 'teacher')
+if CNN_MODEL_VARIANT not in MODEL_PATHS:
+    raise ValueError(f"CNN_MODEL_VARIANT must be one of {', '.join(MODEL_PATHS)}")
+MODEL_PATH = MODEL_PATHS[CNN_MODEL_VARIANT]
+ENCODER_PATH = MODEL_PATH.replace('.h5', '_encoder.pkl')
+
+# Tier name reported in responses
+CNN_TIER = 'cnn' if CNN_MODEL_VARIANT == 'teacher' else f'cnn_{CNN_MODEL_VARIANT}'
+
+# 'local' loads the model in this process, 'server' uses the shared inference server
+CNN_INFERENCE_MODE = os.getenv('CNN_INFERENCE_MODE', 'local')
 
-# Model paths
-MODEL_PATH = 'models/navarasa_cnn.h5'
-ENCODER_PATH = 'models/navarasa_cnn_encoder.pkl'
+# 'librosa' computes the mel spectrogram per request in NumPy; 'graph' feeds
+# the waveform to the model and computes it in TensorFlow (spectrogram_graph.py),
+# so batched requests share one vectorized STFT + CNN call
+CNN_PREPROCESSING = os.getenv('CNN_PREPROCESSING', 'librosa')
 
 # Audio parameters (must match training)
 SAMPLE_RATE = 22050
@@ -22,12 +45,16 @@ N_MELS = 128
 # Cached model and encoder
 _model = None
 _label_encoder = None
+_embedding_model = None
+_waveform_model = None
 
 def load_trained_model():
     """Load trained CNN model and label encoder"""
     global _model, _label_encoder
     
     if _model is None:
+        from tensorflow import keras
+        
         if not os.path.exists(MODEL_PATH):
             raise FileNotFoundError(f"Trained model not found at {MODEL_PATH}")
         
@@ -42,20 +69,65 @@ def load_trained_model():
     
     return _model, _label_encoder
 
-def extract_features_for_prediction(audio_path):
+def get_embedding_model():
+    """
+    Build (and cache) a model that returns both the penultimate-layer
+    embedding and the softmax output in a single forward pass
+    """
+    global _embedding_model
+    
+    if _embedding_model is None:
+        from tensorflow import keras
+        
+        model, _ = load_trained_model()
+        
+        # Dense layer before the classifier Dense (256-d for both variants;
+        # the student's classifier is followed by a separate softmax layer)
+        penultimate = [layer for layer in model.layers
+                       if isinstance(layer, keras.layers.Dense)][-2]
+        _embedding_model = keras.Model(inputs=model.inputs,
+                                       outputs=[penultimate.output, model.output])
+        print(f"✅ Embedding model ready ({penultimate.units}-d)")
+    
+    return _embedding_model
+
+def get_waveform_model():
+    """
+    Build (and cache) the embedding model behind the in-graph mel
+    spectrogram layer: waveform_input() -> [embedding, probabilities]
+    """
+    global _waveform_model
+    
+    if _waveform_model is None:
+        from app.services.spectrogram_graph import build_waveform_model
+        
+        _waveform_model = build_waveform_model(get_embedding_model())
+        print("✅ Waveform model ready (in-graph mel spectrogram)")
+    
+    return _waveform_model
+
+def extract_features_for_prediction(audio_path, y=None):
     """
     Extract features from audio file (same as training)
+    
+    Args:
+        audio_path: Path to audio file
+        y: Already decoded waveform at SAMPLE_RATE (skips loading audio_path)
     """
     try:
         # Load audio
-        y, sr = librosa.load(audio_path, sr=SAMPLE_RATE, duration=DURATION, mono=True)
+        if y is None:
+            y, sr = load_audio(audio_path, sr=SAMPLE_RATE, duration=DURATION)
+        else:
+            sr = SAMPLE_RATE
         
         # Extract mel spectrogram
-        mel_spec = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=N_MELS, fmax=8000)
-        mel_spec_db = librosa.power_to_db(mel_spec, ref=np.max)
-        
-        # Normalize
-        mel_spec_db = (mel_spec_db - mel_spec_db.mean()) / mel_spec_db.std()
+        with stage('mel'):
+            mel_spec = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=N_MELS, fmax=8000)
+            mel_spec_db = librosa.power_to_db(mel_spec, ref=np.max)
+            
+            # Normalize
+            mel_spec_db = (mel_spec_db - mel_spec_db.mean()) / mel_spec_db.std()
         
         # Ensure fixed length
         target_length = int(SAMPLE_RATE / 512 * DURATION)
@@ -71,28 +143,151 @@ def extract_features_for_prediction(audio_path):
         print(f"❌ Feature extraction error: {e}")
         raise
 
-def predict_with_cnn(audio_path):
+def waveform_input(audio_path, y=None):
     """
-    Predict emotion using trained CNN model
+    Model input for in-graph preprocessing: the clip zero-padded to
+    DURATION seconds followed by its real length in samples
     """
-    print(f"🎵 Using trained CNN model for prediction")
+    if y is None:
+        y, sr = load_audio(audio_path, sr=SAMPLE_RATE, duration=DURATION)
     
-    # Load model
-    model, label_encoder = load_trained_model()
+    n_samples = SAMPLE_RATE * DURATION
+    features = np.zeros(n_samples + 1, dtype=np.float32)
+    length = min(len(y), n_samples)
+    features[:length] = y[:length]
+    features[-1] = length
+    return features
+
+def spectrogram_input_supported():
+    """
+    Whether classify_spectrogram can run: not against an inference server
+    that expects waveforms (CNN_PREPROCESSING=graph on the server)
+    """
+    if CNN_INFERENCE_MODE == 'server':
+        from app.services.inference_server import get_inference_client
+        return get_inference_client().preprocessing != 'graph'
+    return True
+
+def classify_spectrogram(features):
+    """
+    Emotion probabilities for an already computed spectrogram laid out like
+    extract_features_for_prediction (used by live streaming analysis)
     
-    # Extract features
-    print("📊 Extracting mel spectrogram features...")
-    features = extract_features_for_prediction(audio_path)
+    Returns:
+        Dictionary emotion -> probability
+    """
+    if CNN_INFERENCE_MODE == 'server':
+        from app.services.inference_server import get_inference_client, predict_remote
+        
+        if get_inference_client().preprocessing == 'graph':
+            raise RuntimeError("The inference server expects waveforms, not spectrograms")
+        with stage('inference'):
+            predictions, _ = predict_remote(features)
+        emotion_names = get_inference_client().classes
+    else:
+        model, label_encoder = load_trained_model()
+        with stage('inference'):
+            predictions = model.predict(np.expand_dims(features, axis=0), verbose=0)[0]
+        emotion_names = label_encoder.classes_
+    
+    return {str(emotion): float(p) for emotion, p in zip(emotion_names, predictions)}
+
+def model_input(audio_path, y=None):
+    """
+    Input of the local model for one clip: the waveform for in-graph
+    preprocessing, the normalized mel spectrogram otherwise
+    (NumPy / librosa only, so it can run in worker processes)
+    """
+    if CNN_PREPROCESSING == 'graph':
+        return waveform_input(audio_path, y)
+    return extract_features_for_prediction(audio_path, y=y)
+
+def classify_batch(inputs):
+    """
+    Emotion probabilities for a batch of model_input() rows in one forward
+    pass of the model loaded in this process (bulk analysis)
     
-    # Add batch dimension
-    features = np.expand_dims(features, axis=0)
+    Returns:
+        List of dictionaries emotion -> probability
+    """
+    model, label_encoder = load_trained_model()
+    batch = np.stack(inputs)
+    with stage('inference'):
+        if CNN_PREPROCESSING == 'graph':
+            _, predictions = get_waveform_model().predict(batch, verbose=0, batch_size=len(batch))
+        else:
+            predictions = model.predict(batch, verbose=0, batch_size=len(batch))
+    
+    emotion_names = [str(e) for e in label_encoder.classes_]
+    return [dict(zip(emotion_names, map(float, row))) for row in predictions]
+
+def predict_with_cnn(audio_path, return_embedding=False, y=None, audio_features=None, summary=True):
+    """
+    Predict emotion using trained CNN model
     
-    # Predict
-    print("🧠 Running CNN inference...")
-    predictions = model.predict(features, verbose=0)[0]
+    Args:
+        audio_path: Path to audio file
+        return_embedding: Also return the penultimate-layer embedding
+            under the 'embedding' key (used by the similarity index)
+        y: Already decoded waveform at SAMPLE_RATE (shared with other tiers)
+        audio_features: Output of audio_processor.extract_features for the
+            same audio; reused for the tempo/energy/brightness summary
+        summary: Compute the tempo/energy/brightness summary at all
+            (progressive inference only needs it for the segment it stops at)
+    """
+    print(f"🎵 Using trained CNN model for prediction")
     
-    # Get emotion labels
-    emotion_names = label_encoder.classes_
+    embedding = None
+    if CNN_INFERENCE_MODE == 'server':
+        from app.services.inference_server import get_inference_client, predict_remote
+        
+        # The server decides where the spectrogram is computed
+        if get_inference_client().preprocessing == 'graph':
+            features = waveform_input(audio_path, y)
+        else:
+            print("📊 Extracting mel spectrogram features...")
+            features = extract_features_for_prediction(audio_path, y=y)
+        
+        print("🧠 Running CNN inference on the shared inference server...")
+        with stage('inference'):
+            predictions, embedding = predict_remote(features)
+        emotion_names = np.array(get_inference_client().classes)
+        if not return_embedding:
+            embedding = None
+    elif CNN_PREPROCESSING == 'graph':
+        _, label_encoder = load_trained_model()
+        features = waveform_input(audio_path, y)
+        
+        print("🧠 Running mel spectrogram + CNN inference in one graph call...")
+        with stage('inference'):
+            embeddings, predictions = get_waveform_model().predict(
+                np.expand_dims(features, axis=0), verbose=0)
+        embedding, predictions = embeddings[0], predictions[0]
+        if not return_embedding:
+            embedding = None
+        emotion_names = label_encoder.classes_
+    else:
+        # Extract features
+        print("📊 Extracting mel spectrogram features...")
+        features = extract_features_for_prediction(audio_path, y=y)
+        
+        # Load model
+        model, label_encoder = load_trained_model()
+        
+        # Add batch dimension
+        features = np.expand_dims(features, axis=0)
+        
+        # Predict
+        print("🧠 Running CNN inference...")
+        with stage('inference'):
+            if return_embedding:
+                embeddings, predictions = get_embedding_model().predict(features, verbose=0)
+                embedding, predictions = embeddings[0], predictions[0]
+            else:
+                predictions = model.predict(features, verbose=0)[0]
+        
+        # Get emotion labels
+        emotion_names = label_encoder.classes_
     
     # Create emotion scores dictionary
     scores = {}
@@ -111,20 +306,34 @@ def predict_with_cnn(audio_path):
     print(f"  🎯 PRIMARY: {primary_emotion} ({confidence:.1%})")
     
     # Get basic audio features for response
-    y, sr = librosa.load(audio_path, sr=22050, duration=30, mono=True)
-    tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-    rms = librosa.feature.rms(y=y)
-    spectral_centroid = librosa.feature.spectral_centroid(y=y, sr=sr)
+    if not summary:
+        summary = None
+    elif audio_features is not None:
+        summary = {
+            'tempo': audio_features['tempo'],
+            'energy': audio_features['rms_mean'],
+            'brightness': audio_features['spectral_centroid_mean'],
+        }
+    else:
+        if y is None:
+            y, sr = load_audio(audio_path, sr=SAMPLE_RATE, duration=DURATION)
+        with stage('summary'):
+            lazy = LazyFeatures(y, SAMPLE_RATE)
+            summary = {
+                'tempo': lazy['tempo'],
+                'energy': lazy['rms_mean'],
+                'brightness': lazy['spectral_centroid_mean'],
+            }
     
     result = {
         'emotions': scores,
         'primaryEmotion': primary_emotion,
         'confidence': confidence,
-        'features': {
-            'tempo': float(tempo),
-            'energy': float(np.mean(rms)),
-            'brightness': float(np.mean(spectral_centroid)),
-        }
     }
+    if summary is not None:
+        result['features'] = summary
+    
+    if embedding is not None:
+        result['embedding'] = embedding.tolist()
     
     return result
@@ -0,0 +1,297 @@
+"""
+Audio decoding
+Decodes uploads to mono float32 at the analysis rate, stopping once the
+requested duration has been read. Backends are tried in DECODER_ORDER:
+
+    soundfile  libsndfile, in-process (WAV/FLAC/OGG, MP3 with libsndfile >= 1.1)
+    av         PyAV / libav, in-process (MP3, M4A/AAC, OPUS, ...), if installed
+    ffmpeg     ffmpeg subprocess piping f32le at the target rate, if on PATH
+    librosa    librosa.load (audioread fallback)
+
+so MP3/M4A previews no longer go through audioread, which decodes the
+whole file to 16-bit PCM through a subprocess before librosa resamples
+it. Downmixing and resampling (soxr HQ) match librosa.load. Everything
+runs locally; no backend needs network access.
+
+Per-format latency is recorded as decode.<format>.<backend> (file
+extensions outside AUDIO_EXTENSIONS as 'other', since they come from
+client file names) and backend failures as decode_failed.<backend> on
+/metrics.
+"""
+
+import io
+import os
+import shutil
+import subprocess
+import time
+import numpy as np
+import soundfile as sf
+import soxr
+from app.services import metrics
+
+try:
+    import av
+except ImportError:
+    av = None
+
+DECODER_ORDER = [b.strip() for b in os.getenv('DECODER_ORDER', 'soundfile,av,ffmpeg,librosa').split(',') if b.strip()]
+FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+DECODE_TIMEOUT_SECONDS = float(os.getenv('DECODE_TIMEOUT_SECONDS', 30))
+
+# File extensions the backends above decode; checked explicitly because
+# mimetypes only knows .flac / .ogg / .m4a when the OS ships a mime.types
+AUDIO_EXTENSIONS = frozenset({'wav', 'flac', 'ogg', 'oga', 'opus', 'mp3', 'm4a', 'aac', 'aif', 'aiff', 'webm'})
+
+
+def metric_format(extension):
+    """Format name for decode metrics; extensions outside AUDIO_EXTENSIONS share 'other'"""
+    fmt = extension.lstrip('.').lower()
+    return fmt if fmt in AUDIO_EXTENSIONS else 'other'
+
+
+class DecodeError(Exception):
+    """No configured backend could decode the file"""
+
+
+def _finish(y, native_sr, sr, duration):
+    """Mono float32 at sr, truncated to duration like librosa.load"""
+    if native_sr != sr:
+        y = soxr.resample(y, native_sr, sr, quality='HQ')
+    if duration is not None:
+        y = y[:int(round(duration * sr))]
+    return np.ascontiguousarray(y, dtype=np.float32)
+
+
+def _stream_soundfile(path, duration, block_seconds=1.0):
+    """Yield (native_sr, mono chunk) blocks of at most block_seconds"""
+    with sf.SoundFile(path) as f:
+        frames = -1 if duration is None else int(duration * f.samplerate)
+        blocksize = max(1, int(block_seconds * f.samplerate))
+        for block in f.blocks(blocksize=blocksize, frames=frames, dtype='float32', always_2d=True):
+            yield f.samplerate, block.mean(axis=1)
+
+
+def _stream_av(path, duration):
+    """Yield (native_sr, mono chunk) per decoded frame until duration is covered"""
+    with av.open(path) as container:
+        stream = container.streams.audio[0]
+        stream.thread_type = 'AUTO'
+        native_sr = stream.codec_context.sample_rate
+        # Native planar float; downmix here so mono matches librosa (channel mean)
+        resampler = av.AudioResampler(format='fltp', rate=native_sr)
+        remaining = None if duration is None else int(duration * native_sr)
+        for frame in container.decode(stream):
+            for out in resampler.resample(frame):
+                chunk = out.to_ndarray().mean(axis=0)
+                if remaining is not None:
+                    chunk = chunk[:remaining]
+                    remaining -= len(chunk)
+                yield native_sr, chunk
+            if remaining is not None and remaining <= 0:
+                return
+
+
+def _read_stream(chunks, sr, duration):
+    native_sr, parts = sr, []
+    for native_sr, chunk in chunks:
+        parts.append(chunk)
+    y = np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+    return _finish(y, native_sr, sr, duration)
+
+
+def _decode_soundfile(path, sr, duration):
+    return _read_stream(_stream_soundfile(path, duration), sr, duration)
+
+
+def _decode_av(path, sr, duration):
+    return _read_stream(_stream_av(path, duration), sr, duration)
+
+
+def _decode_ffmpeg(path, sr, duration):
+    # In-memory audio (decode_bytes) is piped in on stdin
+    data = path.getvalue() if isinstance(path, io.BytesIO) else None
+    cmd = [FFMPEG_BINARY, '-nostdin', '-v', 'error', '-i', 'pipe:0' if data is not None else path]
+    if duration is not None:
+        cmd += ['-t', str(duration)]
+    cmd += ['-map', '0:a:0', '-ac', '1', '-ar', str(sr), '-f', 'f32le', '-']
+    proc = subprocess.run(cmd, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          timeout=DECODE_TIMEOUT_SECONDS, check=False)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.decode(errors='replace').strip() or f"ffmpeg exited {proc.returncode}")
+    return _finish(np.frombuffer(proc.stdout, dtype='<f4'), sr, sr, duration)
+
+
+def _decode_librosa(path, sr, duration):
+    import librosa
+    y, _ = librosa.load(path, sr=sr, duration=duration, mono=True)
+    return y
+
+
+BACKENDS = {
+    'soundfile': _decode_soundfile,
+    'av': _decode_av,
+    'ffmpeg': _decode_ffmpeg,
+    'librosa': _decode_librosa,
+}
+
+# Backends that can hand out audio incrementally (see iter_decode)
+STREAMING_BACKENDS = {
+    'soundfile': _stream_soundfile,
+    'av': _stream_av,
+}
+
+
+def available_backends():
+    """Backends from DECODER_ORDER that can run in this environment"""
+    available = []
+    for name in DECODER_ORDER:
+        if name not in BACKENDS:
+            continue
+        if name == 'av' and av is None:
+            continue
+        if name == 'ffmpeg' and shutil.which(FFMPEG_BINARY) is None:
+            continue
+        available.append(name)
+    return available
+
+
+def decode(path, sr, duration=None):
+    """
+    Decode an audio file with the first backend that succeeds
+
+    Args:
+        path: Audio file
+        sr: Target sample rate
+        duration: Seconds to decode from the start (None = whole file)
+
+    Returns:
+        (y, sr) - mono float32 waveform at sr
+
+    Raises:
+        DecodeError: every available backend failed
+    """
+    fmt = metric_format(os.path.splitext(path)[1])
+    errors = []
+    for name in available_backends():
+        start = time.perf_counter()
+        try:
+            y = BACKENDS[name](path, sr, duration)
+        except Exception as e:
+            metrics.record(f'decode_failed.{name}', (time.perf_counter() - start) * 1000)
+            errors.append(f"{name}: {e}")
+            continue
+        metrics.record(f'decode.{fmt}.{name}', (time.perf_counter() - start) * 1000)
+        return y, sr
+    raise DecodeError(f"Could not decode {os.path.basename(path)} ({'; '.join(errors) or 'no decoder available'})")
+
+
+def decode_bytes(data, sr, duration=None, fmt='other'):
+    """
+    Decode audio held in memory (e.g. a downloaded preview) without
+    writing it to disk; same backends, order and result as decode()
+
+    Args:
+        data: Encoded audio bytes
+        fmt: Container / codec hint for the metrics ('mp3', 'wav', ...)
+    """
+    fmt = metric_format(fmt)
+    errors = []
+    for name in available_backends():
+        start = time.perf_counter()
+        try:
+            y = BACKENDS[name](io.BytesIO(data), sr, duration)
+        except Exception as e:
+            metrics.record(f'decode_failed.{name}', (time.perf_counter() - start) * 1000)
+            errors.append(f"{name}: {e}")
+            continue
+        metrics.record(f'decode.{fmt}.{name}', (time.perf_counter() - start) * 1000)
+        return y, sr
+    raise DecodeError(f"Could not decode {len(data)} bytes of {fmt} ({'; '.join(errors) or 'no decoder available'})")
+
+
+def _prefixes(chunks, sr, seconds):
+    """Resample (native_sr, chunk) pairs on the fly and yield y[:s * sr] for each s"""
+    resampler, native_sr = None, None
+    parts, n = [], 0
+    pending = list(seconds)
+    last = None     # length of the last prefix handed out
+    for native_sr, chunk in chunks:
+        if resampler is None and native_sr != sr:
+            resampler = soxr.ResampleStream(native_sr, sr, 1, dtype='float32', quality='HQ')
+        out = resampler.resample_chunk(chunk) if resampler is not None else chunk.astype(np.float32)
+        parts.append(out)
+        n += len(out)
+        while pending and n >= int(round(pending[0] * sr)):
+            y = np.concatenate(parts)
+            parts = [y]
+            last = int(round(pending.pop(0) * sr))
+            yield y[:last]
+    if pending:
+        # The file ended before the last boundary: whatever is left is the final
+        # prefix, unless it ended exactly on the boundary just handed out
+        if resampler is not None:
+            parts.append(resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True))
+        y = np.concatenate(parts)[:int(round(pending[-1] * sr))] if parts else np.zeros(0, dtype=np.float32)
+        if last is None or len(y) > last:
+            yield y
+
+
+def slice_prefixes(y, sr, seconds):
+    """
+    y[:s * sr] for each of the increasing prefix lengths s, stopping at the
+    first prefix that reaches the end of y (a clip ending exactly on a
+    boundary is not handed out twice)
+    """
+    last = None
+    for s in seconds:
+        end = min(int(round(s * sr)), len(y))
+        if last is not None and end <= last:
+            return
+        yield y[:end]
+        last = end
+
+
+def iter_decode(path, sr, seconds):
+    """
+    Decode growing prefixes of a file, reading every sample once
+
+    Args:
+        path: Audio file
+        sr: Target sample rate
+        seconds: Increasing prefix lengths, e.g. [5, 10, 20, 30]
+
+    Yields:
+        Mono float32 waveforms of the first s seconds for each s; the last
+        one is shorter (and nothing further is yielded) when the file ends
+        early. Backends without incremental decoding decode max(seconds)
+        once and hand out slices.
+    """
+    seconds = sorted(seconds)
+    fmt = metric_format(os.path.splitext(path)[1])
+    errors = []
+    for name in available_backends():
+        start = time.perf_counter()
+        try:
+            # Backends fail on open / first read; fall through to the next one then
+            if name in STREAMING_BACKENDS:
+                segments = _prefixes(STREAMING_BACKENDS[name](path, seconds[-1]), sr, seconds)
+            else:
+                segments = slice_prefixes(BACKENDS[name](path, sr, seconds[-1]), sr, seconds)
+            y = next(segments)
+        except Exception as e:
+            metrics.record(f'decode_failed.{name}', (time.perf_counter() - start) * 1000)
+            errors.append(f"{name}: {e}")
+            continue
+
+        elapsed = time.perf_counter() - start
+        try:
+            while y is not None:
+                yield y
+                start = time.perf_counter()
+                y = next(segments, None)
+                elapsed += time.perf_counter() - start
+        finally:
+            # Only the decoding time, not the caller's work between prefixes
+            metrics.record(f'decode.{fmt}.{name}', elapsed * 1000)
+        return
+    raise DecodeError(f"Could not decode {os.path.basename(path)} ({'; '.join(errors) or 'no decoder available'})")
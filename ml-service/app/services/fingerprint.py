@@ -0,0 +1,202 @@
+"""
+Perceptual audio fingerprints
+Landmark fingerprints built from spectral peaks of the STFT the feature
+extractor already computes. Peaks survive re-encoding at another bitrate
+or container, and matching aligns landmark times, so a copy trimmed by a
+second or two still matches. Used by /predict to return cached results
+for re-uploads and by train_model.load_dataset to drop near-duplicates.
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+import numpy as np
+from scipy.ndimage import maximum_filter, uniform_filter
+
+FINGERPRINT_DB_PATH = os.getenv('FINGERPRINT_DB_PATH', 'models/fingerprints.db')
+# Fraction of landmarks that must line up with a stored track
+FINGERPRINT_MATCH_THRESHOLD = float(os.getenv('FINGERPRINT_MATCH_THRESHOLD', 0.15))
+MIN_ALIGNED_HASHES = 20
+
+# Peak picking / landmark parameters (STFT at n_fft=2048, hop=512, 22.05 kHz)
+MAX_FREQ_BIN = 512          # ~5.5 kHz; higher bins are the first casualties of lossy codecs
+PEAK_NEIGHBORHOOD = (21, 15)  # (frequency bins, frames)
+DYNAMIC_RANGE_DB = 60
+MIN_PROMINENCE_DB = 10
+PEAKS_PER_SECOND = 30
+FAN_OUT = 5
+TARGET_DT = (1, 63)         # frames between anchor and target peak
+TARGET_DF = 96              # max frequency distance in bins
+FRAMES_PER_SECOND = 22050 / 512
+
+
+def compute_fingerprint(S):
+    """
+    Landmark hashes from an STFT magnitude spectrogram
+
+    Args:
+        S: |STFT| of shape (freq_bins, frames), e.g. LazyFeatures.node('stft')
+
+    Returns:
+        int64 array of shape (n, 2): (hash, anchor frame)
+    """
+    db = 20 * np.log10(S[:MAX_FREQ_BIN] + 1e-10)
+    # Floor the range: codecs zero out quiet bins, and isolated survivors
+    # in those holes must not look like strong peaks
+    db = np.maximum(db, db.max() - DYNAMIC_RANGE_DB)
+    # Prominence over the surrounding area: tonal peaks stand out, peaks in
+    # a noise floor (added noise, codec artefacts) do not
+    prominence = db - uniform_filter(db, size=PEAK_NEIGHBORHOOD)
+    is_peak = (db == maximum_filter(db, size=PEAK_NEIGHBORHOOD)) & (prominence > MIN_PROMINENCE_DB)
+    freqs, frames = np.nonzero(is_peak)
+
+    # Keep the most prominent peaks so the density does not depend on the mix
+    budget = max(1, int(PEAKS_PER_SECOND * db.shape[1] / FRAMES_PER_SECOND))
+    if len(frames) > budget:
+        keep = np.argsort(prominence[freqs, frames])[-budget:]
+        freqs, frames = freqs[keep], frames[keep]
+    order = np.lexsort((freqs, frames))
+    freqs, frames = freqs[order], frames[order]
+
+    hashes = []
+    for i in range(len(frames)):
+        paired = 0
+        for j in range(i + 1, len(frames)):
+            dt = frames[j] - frames[i]
+            if dt < TARGET_DT[0]:
+                continue
+            if dt > TARGET_DT[1] or paired >= FAN_OUT:
+                break
+            if abs(int(freqs[j]) - int(freqs[i])) > TARGET_DF:
+                continue
+            # 10 bits f1 | 10 bits f2 | 6 bits dt
+            hashes.append(((int(freqs[i]) << 16) | (int(freqs[j]) << 6) | int(dt), int(frames[i])))
+            paired += 1
+
+    return np.array(hashes, dtype=np.int64).reshape(-1, 2)
+
+
+class FingerprintIndex:
+    """
+    Inverted index hash -> (track, anchor frame) with cached results
+
+    db_path may be ':memory:' for throwaway indexes (dataset de-duplication).
+    """
+
+    def __init__(self, db_path=FINGERPRINT_DB_PATH):
+        if db_path != ':memory:':
+            os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS tracks (
+                    track_id TEXT PRIMARY KEY,
+                    label TEXT,
+                    n_hashes INTEGER NOT NULL,
+                    result TEXT,
+                    created_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS hashes (
+                    hash INTEGER NOT NULL,
+                    track_id TEXT NOT NULL,
+                    t INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS hashes_by_hash ON hashes (hash);
+            """)
+
+    def add(self, fingerprint, result=None, label=None, track_id=None):
+        """
+        Store a fingerprint (and optionally the analysis result to serve on a match)
+
+        Returns:
+            Track ID
+        """
+        track_id = track_id or uuid.uuid4().hex
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO tracks (track_id, label, n_hashes, result, created_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (track_id, label, len(fingerprint), json.dumps(result) if result else None, time.time()))
+            self.conn.executemany(
+                'INSERT INTO hashes (hash, track_id, t) VALUES (?, ?, ?)',
+                ((int(h), track_id, int(t)) for h, t in fingerprint))
+        return track_id
+
+    def match(self, fingerprint, threshold=FINGERPRINT_MATCH_THRESHOLD):
+        """
+        Find the stored track whose landmarks line up best with the query
+
+        Returns:
+            {'trackId', 'score', 'offsetSeconds', 'label', 'result'} or None
+            when no track reaches the threshold
+        """
+        if len(fingerprint) == 0:
+            return None
+
+        times_by_hash = defaultdict(list)
+        for h, t in fingerprint:
+            times_by_hash[int(h)].append(int(t))
+
+        # Histogram of time offsets per candidate track; a true match piles
+        # up in one offset bin, chance collisions spread out
+        offsets = defaultdict(Counter)
+        unique = list(times_by_hash)
+        with self.lock:
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT hash, track_id, t FROM hashes WHERE hash IN ({','.join('?' * len(chunk))})",
+                    chunk).fetchall()
+                for h, track_id, t in rows:
+                    for query_t in times_by_hash[h]:
+                        offsets[track_id][t - query_t] += 1
+
+        best = None
+        for track_id, histogram in offsets.items():
+            offset, aligned = histogram.most_common(1)[0]
+            # Allow one frame of jitter from re-encoding
+            aligned += histogram.get(offset - 1, 0) + histogram.get(offset + 1, 0)
+            if best is None or aligned > best[1]:
+                best = (track_id, aligned, offset)
+
+        if best is None or best[1] < MIN_ALIGNED_HASHES:
+            return None
+        track_id, aligned, offset = best
+
+        with self.lock:
+            label, result, n_hashes = self.conn.execute(
+                'SELECT label, result, n_hashes FROM tracks WHERE track_id = ?', (track_id,)).fetchone()
+        # Relative to the sparser of the two, so added noise (extra peaks in
+        # the query) or a trim (fewer peaks) does not dilute the score
+        score = aligned / max(1, min(len(fingerprint), n_hashes))
+        if score < threshold:
+            return None
+        return {
+            'trackId': track_id,
+            'score': round(score, 4),
+            'offsetSeconds': round(offset / FRAMES_PER_SECOND, 2),
+            'label': label,
+            'result': json.loads(result) if result else None,
+        }
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM tracks').fetchone()[0]
+
+
+# Cached index instance
+_index = None
+
+
+def get_fingerprint_index():
+    """Open and cache the persistent fingerprint index"""
+    global _index
+    if _index is None:
+        _index = FingerprintIndex()
+    return _index
@@ -0,0 +1,171 @@
+"""
+Fused frame-level feature kernel
+Frames the waveform once (librosa's centred, zero-padded framing at
+n_fft=2048 / hop=512) and computes RMS, zero-crossing rate, spectral
+centroid, spectral rolloff and chroma for every frame, reducing each to
+its mean/std as it goes. The STFT is built from the same frames, so the
+per-feature librosa calls no longer re-frame the signal or recompute
+magnitudes. When numba is installed the per-frame loop is compiled;
+otherwise the same statistics are computed with vectorized NumPy.
+Results match the individual librosa.feature calls within float32
+round-off (zcr differs only in the first/last frames, where librosa pads
+with edge values instead of zeros).
+"""
+
+import os
+import numpy as np
+import librosa
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Set to 0 to force the NumPy path even when numba is available
+FRAME_KERNEL_NUMBA = os.getenv('FRAME_KERNEL_NUMBA', '1') != '0'
+
+N_FFT = 2048
+HOP_LENGTH = 512
+ROLL_PERCENT = 0.85
+ZERO_THRESHOLD = 1e-10      # librosa.zero_crossings: |x| <= threshold counts as zero
+N_CHROMA = 12
+
+_window = librosa.filters.get_window('hann', N_FFT, fftbins=True).astype(np.float32)
+
+# Rows of the scalar statistics returned by the kernels
+_SCALARS = ('rms', 'zcr', 'spectral_centroid', 'spectral_rolloff')
+
+
+def frame_signal(y, n_fft=N_FFT, hop_length=HOP_LENGTH):
+    """
+    Centred frames of y, shape (frames, n_fft)
+
+    A strided view over the zero-padded signal: the same frames
+    librosa.stft / librosa.feature.rms(center=True) build internally.
+    """
+    padded = np.pad(np.asarray(y, dtype=np.float32), n_fft // 2, mode='constant')
+    return np.lib.stride_tricks.sliding_window_view(padded, n_fft)[::hop_length]
+
+
+def stft_magnitude(frames):
+    """|STFT| of framed audio as (freq_bins, frames), like np.abs(librosa.stft(y))"""
+    return np.abs(np.fft.rfft(frames * _window, axis=1)).astype(np.float32).T
+
+
+def _frame_stats_numpy(frames, S_t, freqs, spectral):
+    stats = np.zeros((len(_SCALARS), 2))
+    values = [
+        np.sqrt(np.mean(frames.astype(np.float64) ** 2, axis=1)),
+    ]
+    signs = np.signbit(np.where(np.abs(frames) <= ZERO_THRESHOLD, 0, frames))
+    values.append(np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / frames.shape[1])
+
+    if spectral:
+        S = S_t.astype(np.float64)
+        total = S.sum(axis=1)
+        norm = np.where(total < np.finfo(np.float32).tiny, 1.0, total)
+        values.append(S @ freqs / norm)
+        cumulative = np.cumsum(S, axis=1)
+        rolloff_bin = np.argmax(cumulative >= ROLL_PERCENT * cumulative[:, -1:], axis=1)
+        values.append(freqs[rolloff_bin])
+
+    for i, v in enumerate(values):
+        stats[i] = v.mean(), v.std()
+    return stats
+
+
+def _frame_stats_loop(frames, S_t, freqs, spectral):
+    # One pass over the frames with Welford running mean/variance
+    n_frames, frame_length = frames.shape
+    n_bins = S_t.shape[1]
+    mean = np.zeros(4)
+    m2 = np.zeros(4)
+    value = np.zeros(4)
+    n_stats = 4 if spectral else 2
+    tiny = np.finfo(np.float32).tiny
+
+    for t in range(n_frames):
+        energy = 0.0
+        crossings = 0
+        prev_negative = False
+        for i in range(frame_length):
+            x = frames[t, i]
+            energy += x * x
+            negative = x < -ZERO_THRESHOLD
+            if i > 0 and negative != prev_negative:
+                crossings += 1
+            prev_negative = negative
+        value[0] = np.sqrt(energy / frame_length)
+        value[1] = crossings / frame_length
+
+        if spectral:
+            total = 0.0
+            weighted = 0.0
+            for k in range(n_bins):
+                total += S_t[t, k]
+                weighted += freqs[k] * S_t[t, k]
+            value[2] = weighted / (1.0 if total < tiny else total)
+
+            threshold = ROLL_PERCENT * total
+            cumulative = 0.0
+            value[3] = freqs[n_bins - 1]
+            for k in range(n_bins):
+                cumulative += S_t[t, k]
+                if cumulative >= threshold:
+                    value[3] = freqs[k]
+                    break
+
+        for j in range(n_stats):
+            delta = value[j] - mean[j]
+            mean[j] += delta / (t + 1)
+            m2[j] += delta * (value[j] - mean[j])
+
+    stats = np.zeros((4, 2))
+    for j in range(n_stats):
+        stats[j, 0] = mean[j]
+        stats[j, 1] = np.sqrt(m2[j] / n_frames)
+    return stats
+
+
+_frame_stats_numba = numba.njit(cache=True)(_frame_stats_loop) if numba is not None else None
+
+
+def _chroma_stats(S, sr):
+    """Mean/std per chroma bin of librosa.feature.chroma_stft(S=S**2)"""
+    power = S ** 2
+    tuning = librosa.estimate_tuning(S=power, sr=sr, bins_per_octave=N_CHROMA)
+    fb = librosa.filters.chroma(sr=sr, n_fft=2 * (S.shape[0] - 1), tuning=tuning, n_chroma=N_CHROMA)
+    chroma = fb @ power
+    peak = np.abs(chroma).max(axis=0)
+    chroma /= np.where(peak < np.finfo(chroma.dtype).tiny, 1.0, peak)
+    return chroma.mean(axis=1), chroma.std(axis=1)
+
+
+def frame_features(frames, S=None, sr=22050):
+    """
+    Mean/std of the frame-level features in one pass over the frames
+
+    Args:
+        frames: Output of frame_signal
+        S: STFT magnitude (freq_bins, frames) of the same frames; when
+            None only the time-domain features (rms, zcr) are computed
+        sr: Sample rate
+
+    Returns:
+        {'rms': (mean, std), 'zcr': ..., 'spectral_centroid': ...,
+         'spectral_rolloff': ..., 'chroma': (means[12], stds[12])}
+    """
+    spectral = S is not None
+    freqs = librosa.fft_frequencies(sr=sr, n_fft=frames.shape[1])
+    S_t = S.T if spectral else np.zeros((len(frames), 0), dtype=np.float32)
+
+    if _frame_stats_numba is not None and FRAME_KERNEL_NUMBA:
+        stats = _frame_stats_numba(frames, np.ascontiguousarray(S_t), freqs, spectral)
+    else:
+        stats = _frame_stats_numpy(frames, S_t, freqs, spectral)
+
+    names = _SCALARS if spectral else _SCALARS[:2]
+    result = {name: (float(stats[i, 0]), float(stats[i, 1])) for i, name in enumerate(names)}
+    if spectral:
+        result['chroma'] = _chroma_stats(S, sr)
+    return result
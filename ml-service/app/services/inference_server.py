@@ -0,0 +1,390 @@
+"""
+Shared inference server
+One process owns the TensorFlow runtime and the CNN weights; HTTP worker
+processes send it mel spectrograms through shared memory instead of each
+loading their own copy of the model.
+
+Deployment:
+    python -m app.services.inference_server            # owns the model
+    CNN_INFERENCE_MODE=server uvicorn app.main:app --workers 4
+
+Protocol:
+    The server creates one shared-memory block split into INFERENCE_SERVER_SLOTS
+    fixed-size slots (model input + output embedding/probabilities). The
+    input is the mel spectrogram, or with CNN_PREPROCESSING=graph the packed
+    waveform, so STFT and mel run batched inside the server's graph call.
+    Each client connection is handed a free slot on connect. To run
+    inference the client writes its spectrogram into the slot and sends a
+    small ('infer', None) message over a multiprocessing
+    connection; the server batches every pending request, runs one forward
+    pass, writes the outputs back into each slot and replies ('ok',).
+    Only control messages cross the socket - tensors never get pickled.
+    Each HTTP worker keeps a small pool of INFERENCE_CLIENT_CONNECTIONS
+    connections (one slot each), so its scheduler and inference threads do
+    not queue behind a single slot.
+
+INFERENCE_SERVER_AUTHKEY must be set for both the server and its clients;
+the connection handshake is authenticated with it.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from multiprocessing import shared_memory, resource_tracker
+from multiprocessing import Pipe
+from multiprocessing.connection import Listener, Client, wait
+import numpy as np
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+INFERENCE_SERVER_ADDRESS = os.getenv('INFERENCE_SERVER_ADDRESS', '127.0.0.1:6011')
+INFERENCE_SERVER_AUTHKEY = os.getenv('INFERENCE_SERVER_AUTHKEY', '').encode()
+INFERENCE_SERVER_SLOTS = int(os.getenv('INFERENCE_SERVER_SLOTS', 16))
+# Connections (and slots) per HTTP worker; keep workers x this <= INFERENCE_SERVER_SLOTS
+INFERENCE_CLIENT_CONNECTIONS = int(os.getenv('INFERENCE_CLIENT_CONNECTIONS', 4))
+INFERENCE_SHM_NAME = os.getenv('INFERENCE_SHM_NAME', 'navarasa_inference')
+BATCH_WAIT_MS = float(os.getenv('INFERENCE_BATCH_WAIT_MS', 5))
+# Largest forward pass (0 = every pending request); set by the tuning profile
+MAX_BATCH = int(os.getenv('INFERENCE_MAX_BATCH', 0))
+
+# Input shapes (must match cnn_classifier / training)
+N_MELS = 128
+N_FRAMES = int(22050 / 512 * 30)
+INPUT_SHAPES = {
+    'librosa': (N_MELS, N_FRAMES),      # mel spectrogram
+    'graph': (22050 * 30 + 1,),         # cnn_classifier.waveform_input
+}
+# Room after the input for the embedding and class probabilities
+OUTPUT_SIZE = 1024
+
+
+def parse_address(address):
+    """'host:port' -> TCP address tuple, anything else -> Unix socket path"""
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return (host, int(port))
+    return address
+
+
+def require_authkey():
+    """The server and its clients refuse to run without a configured key"""
+    if not INFERENCE_SERVER_AUTHKEY:
+        raise RuntimeError("Set INFERENCE_SERVER_AUTHKEY to a shared secret to use the inference server")
+    return INFERENCE_SERVER_AUTHKEY
+
+
+def _attach_shared_memory(name):
+    """
+    Attach to an existing block without letting this process's resource
+    tracker unlink it on exit (it belongs to the server)
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+    return shm
+
+
+class InferenceServer:
+    """Owns the model, the shared-memory slots and the client connections"""
+
+    def __init__(self, address=INFERENCE_SERVER_ADDRESS, slots=INFERENCE_SERVER_SLOTS,
+                 shm_name=INFERENCE_SHM_NAME):
+        authkey = require_authkey()
+        from app.services.cnn_classifier import (
+            load_trained_model, get_embedding_model, get_waveform_model, CNN_PREPROCESSING)
+
+        model, label_encoder = load_trained_model()
+        self.preprocessing = CNN_PREPROCESSING
+        self.model = get_waveform_model() if self.preprocessing == 'graph' else get_embedding_model()
+        self.input_shape = INPUT_SHAPES[self.preprocessing]
+        self.input_size = int(np.prod(self.input_shape))
+        self.slot_size = self.input_size + OUTPUT_SIZE
+        self.classes = [str(c) for c in label_encoder.classes_]
+        self.embedding_dim = int(self.model.outputs[0].shape[-1])
+        if self.embedding_dim + len(self.classes) > OUTPUT_SIZE:
+            raise ValueError("Model outputs do not fit in a shared-memory slot")
+
+        try:
+            # Left behind by a crashed server
+            stale = shared_memory.SharedMemory(name=shm_name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        self.shm = shared_memory.SharedMemory(name=shm_name, create=True, size=slots * self.slot_size * 4)
+        self.buffer = np.ndarray((slots, self.slot_size), dtype=np.float32, buffer=self.shm.buf)
+
+        self.address = parse_address(address)
+        self.listener = Listener(self.address, authkey=authkey)
+        self.free_slots = deque(range(slots))
+        self.clients = {}
+        self.lock = threading.Lock()
+        # Written to by the accept loop so serve_forever starts watching new connections at once
+        self.wake_reader, self.wake_writer = Pipe(duplex=False)
+        self.running = True
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                conn = self.listener.accept()
+            except Exception as e:
+                if self.running:
+                    print(f"⚠️ Inference server accept failed: {e}")
+                continue
+            with self.lock:
+                if not self.free_slots:
+                    conn.send(('busy', None))
+                    conn.close()
+                    continue
+                slot = self.free_slots.popleft()
+                self.clients[conn] = slot
+            conn.send(('hello', {
+                'shm': self.shm.name,
+                'slot': slot,
+                'slot_size': self.slot_size,
+                'input_size': self.input_size,
+                'input_shape': self.input_shape,
+                'preprocessing': self.preprocessing,
+                'embedding_dim': self.embedding_dim,
+                'classes': self.classes,
+            }))
+            self.wake_writer.send_bytes(b'')
+            print(f"🔌 Client connected on slot {slot} ({len(self.clients)} active)")
+
+    def _drop(self, conn):
+        with self.lock:
+            slot = self.clients.pop(conn, None)
+            if slot is not None:
+                self.free_slots.append(slot)
+        conn.close()
+
+    def serve_forever(self):
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        print(f"🚀 Inference server listening on {self.address} "
+              f"({len(self.free_slots)} slots, shm={self.shm.name}, preprocessing={self.preprocessing})")
+
+        while self.running:
+            with self.lock:
+                conns = list(self.clients)
+
+            ready = wait([*conns, self.wake_reader], timeout=0.5)
+            if self.wake_reader in ready:
+                # A client connected: pick up the new connection list
+                while self.wake_reader.poll():
+                    self.wake_reader.recv_bytes()
+                continue
+            if not ready:
+                continue
+            # Give concurrent workers a moment to join the same batch
+            if BATCH_WAIT_MS > 0 and len(ready) < len(conns):
+                time.sleep(BATCH_WAIT_MS / 1000)
+                ready = wait(conns, timeout=0)
+
+            batch = []
+            for conn in ready:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    self._drop(conn)
+                    continue
+                if message[0] == 'infer':
+                    batch.append(conn)
+            if batch:
+                step = MAX_BATCH or len(batch)
+                for i in range(0, len(batch), step):
+                    self._run_batch(batch[i:i + step])
+
+    def _run_batch(self, batch):
+        slots = [self.clients[conn] for conn in batch]
+        try:
+            inputs = self.buffer[slots, :self.input_size].reshape(len(slots), *self.input_shape)
+            embeddings, probabilities = self.model.predict(inputs, verbose=0)
+            outputs = np.concatenate([embeddings, probabilities], axis=1)
+            self.buffer[slots, self.input_size:self.input_size + outputs.shape[1]] = outputs
+            reply = ('ok', None)
+        except Exception as e:
+            reply = ('error', str(e))
+        for conn in batch:
+            try:
+                conn.send(reply)
+            except (EOFError, OSError):
+                self._drop(conn)
+
+    def close(self):
+        self.running = False
+        self.listener.close()
+        self.shm.close()
+        self.shm.unlink()
+
+
+class InferenceClient:
+    """
+    Connection from an HTTP worker to the inference server; calls are
+    serialized per connection because each connection owns one slot
+    (see InferenceClientPool for concurrent callers)
+    """
+
+    def __init__(self, address=INFERENCE_SERVER_ADDRESS):
+        self.conn = Client(parse_address(address), authkey=require_authkey())
+        kind, info = self.conn.recv()
+        if kind != 'hello':
+            self.conn.close()
+            raise RuntimeError("Inference server has no free slots")
+
+        self.classes = info['classes']
+        self.embedding_dim = info['embedding_dim']
+        self.input_shape = tuple(info['input_shape'])
+        self.input_size = info['input_size']
+        self.preprocessing = info['preprocessing']
+        self.shm = _attach_shared_memory(info['shm'])
+        start = info['slot'] * info['slot_size']
+        self.slot = np.ndarray((info['slot_size'],), dtype=np.float32,
+                               buffer=self.shm.buf, offset=start * 4)
+        self.lock = threading.Lock()
+
+    def predict(self, features):
+        """
+        Run the CNN on one input (mel spectrogram, or packed waveform when
+        the server's preprocessing is 'graph')
+
+        Returns:
+            (probabilities, embedding) as NumPy arrays
+        """
+        n_classes = len(self.classes)
+        with self.lock:
+            self.slot[:self.input_size] = np.asarray(features, dtype=np.float32).reshape(-1)
+            self.conn.send(('infer', None))
+            kind, error = self.conn.recv()
+            if kind != 'ok':
+                raise RuntimeError(f"Inference server error: {error}")
+            outputs = self.slot[self.input_size:self.input_size + self.embedding_dim + n_classes].copy()
+        return outputs[self.embedding_dim:], outputs[:self.embedding_dim]
+
+    def close(self):
+        self.conn.close()
+        self.shm.close()
+
+
+class InferenceClientPool:
+    """
+    Up to `size` connections to the inference server, opened on demand and
+    lent to one caller at a time, so concurrent requests of a worker run in
+    separate slots (and can share the server's next batch)
+    """
+
+    def __init__(self, address=INFERENCE_SERVER_ADDRESS, size=INFERENCE_CLIENT_CONNECTIONS):
+        self.address = address
+        self.size = max(1, size)
+        self.idle = []
+        self.open = 0
+        self.cond = threading.Condition()
+        # Model metadata is the same on every connection; the first one fills it in
+        client = self._acquire()
+        self.classes = client.classes
+        self.embedding_dim = client.embedding_dim
+        self.input_shape = client.input_shape
+        self.preprocessing = client.preprocessing
+        self._release(client)
+
+    def _acquire(self):
+        with self.cond:
+            while not self.idle and self.open >= self.size:
+                self.cond.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.open += 1
+        try:
+            return InferenceClient(self.address)
+        except RuntimeError:
+            # Server out of slots: make do with the connections already open
+            with self.cond:
+                self.open -= 1
+                if not self.open:
+                    raise
+                self.size = self.open
+                print(f"⚠️ Inference server out of slots - using {self.open} connection(s)")
+            return self._acquire()
+        except BaseException:
+            with self.cond:
+                self.open -= 1
+                self.cond.notify()
+            raise
+
+    def _release(self, client, broken=False):
+        with self.cond:
+            if broken:
+                client.close()
+                self.open -= 1
+            else:
+                self.idle.append(client)
+            self.cond.notify()
+
+    def predict(self, features):
+        """InferenceClient.predict on a free connection"""
+        client = self._acquire()
+        try:
+            result = client.predict(features)
+        except (EOFError, OSError, ConnectionError):
+            self._release(client, broken=True)
+            raise
+        self._release(client)
+        return result
+
+    def reset(self):
+        """Close the idle connections (after the server restarted)"""
+        with self.cond:
+            for client in self.idle:
+                client.close()
+            self.open -= len(self.idle)
+            self.idle = []
+            self.cond.notify_all()
+
+    def close(self):
+        self.reset()
+
+
+# Cached connection pool (one per HTTP worker process)
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_inference_client():
+    """Connect to the shared inference server (once per process)"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = InferenceClientPool()
+            print(f"✅ Connected to inference server at {INFERENCE_SERVER_ADDRESS} "
+                  f"(up to {_client.size} connections)")
+        return _client
+
+
+def predict_remote(features):
+    """predict() on a pooled connection, reconnecting once if the server restarted"""
+    pool = get_inference_client()
+    try:
+        return pool.predict(features)
+    except (EOFError, OSError, ConnectionError):
+        pool.reset()
+        return pool.predict(features)
+
+
+if __name__ == "__main__":
+    import sys
+    import signal
+
+    server = InferenceServer()
+    # Make SIGTERM run the cleanup below so the shared-memory block is unlinked
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        print("👋 Inference server stopped")
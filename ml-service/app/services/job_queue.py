@@ -0,0 +1,332 @@
+"""
+Persistent job queue for long and bulk analyses
+SQLite-backed, so it needs no external broker and survives restarts of
+both the API and the workers. Workers claim jobs under a lease; a job
+whose worker dies is picked up again once its lease expires, and items
+that were already analysed are not redone.
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+JOB_DB_PATH = os.getenv('JOB_DB_PATH', 'jobs/jobs.db')
+JOB_STORAGE_DIR = os.getenv('JOB_STORAGE_DIR', 'jobs/uploads')
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', 300))
+JOB_RETRY_BACKOFF_SECONDS = float(os.getenv('JOB_RETRY_BACKOFF_SECONDS', 10))
+# Callbacks go to JOB_CALLBACK_URL, or to a caller's URL on one of these hosts
+JOB_CALLBACK_URL = os.getenv('JOB_CALLBACK_URL', '')
+JOB_CALLBACK_HOSTS = os.getenv('JOB_CALLBACK_HOSTS', '')
+# Priorities are clamped to +-JOB_MAX_PRIORITY; raising one above 0 needs the admin token
+JOB_MAX_PRIORITY = int(os.getenv('JOB_MAX_PRIORITY', 10))
+JOB_MAX_FILES = int(os.getenv('JOB_MAX_FILES', 50))
+JOB_MAX_UPLOAD_MB = float(os.getenv('JOB_MAX_UPLOAD_MB', 500))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    callback_url TEXT,
+    callback_status TEXT,
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker TEXT,
+    lease_until REAL,
+    next_attempt_at REAL NOT NULL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority DESC, created_at);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+"""
+
+def callback_allowed(url):
+    """
+    Whether a job may POST to url: JOB_CALLBACK_URL itself or an http(s)
+    URL on a host listed in JOB_CALLBACK_HOSTS. Anything else would let
+    callers make the workers send requests to internal hosts.
+    """
+    if not url:
+        return False
+    if url == JOB_CALLBACK_URL:
+        return True
+    hosts = {h.strip().lower() for h in JOB_CALLBACK_HOSTS.split(',') if h.strip()}
+    parsed = urlparse(url)
+    return parsed.scheme in ('http', 'https') and (parsed.hostname or '').lower() in hosts
+
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+
+class JobQueue:
+    """
+    Job store shared by the API process and any number of worker processes
+
+    Every call opens its own connection, so one instance can be used from
+    several threads and separate processes can point at the same file.
+    """
+
+    def __init__(self, db_path=JOB_DB_PATH, storage_dir=JOB_STORAGE_DIR):
+        self.db_path = db_path
+        self.storage_dir = storage_dir
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        os.makedirs(storage_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """Write transaction that takes the database lock up front"""
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def create_job(self, files, priority=0, callback_url=None, max_attempts=JOB_MAX_ATTEMPTS):
+        """
+        Store uploaded files and queue a job to analyse them
+
+        Args:
+            files: List of (filename, content bytes)
+            priority: Higher priorities are claimed first
+            callback_url: URL that receives the finished job as a JSON POST
+
+        Returns:
+            Job ID
+        """
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.storage_dir, job_id)
+        os.makedirs(job_dir, exist_ok=True)
+
+        items = []
+        for idx, (filename, content) in enumerate(files):
+            safe_name = os.path.basename(filename or f'file_{idx}')
+            path = os.path.join(job_dir, f'{idx:05d}_{safe_name}')
+            with open(path, 'wb') as f:
+                f.write(content)
+            items.append((job_id, idx, safe_name, path, QUEUED))
+
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, status, priority, callback_url, total, max_attempts, '
+                'next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, QUEUED, priority, callback_url, len(items), max_attempts, now, now, now))
+            conn.executemany(
+                'INSERT INTO job_items (job_id, idx, filename, path, status) VALUES (?, ?, ?, ?, ?)',
+                items)
+        return job_id
+
+    def claim(self, worker_id, lease_seconds=JOB_LEASE_SECONDS):
+        """
+        Atomically take the next runnable job: the highest priority queued
+        job whose retry time has come, or a running job whose lease expired
+
+        Returns:
+            Job dict with its pending items, or None if nothing is runnable.
+            A job whose lease expired on its final attempt is marked failed
+            and returned with status 'failed' (not claimed), so the caller
+            can send its callback and clean up its uploads.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                'SELECT * FROM jobs WHERE (status = ? AND next_attempt_at <= ?) '
+                'OR (status = ? AND lease_until < ?) '
+                'ORDER BY priority DESC, created_at LIMIT 1',
+                (QUEUED, now, RUNNING, now)).fetchone()
+            if row is None:
+                return None
+
+            if row['status'] == RUNNING and row['attempts'] >= row['max_attempts']:
+                # Worker died on the final attempt
+                self._finish(conn, row['id'], FAILED, f"Lease expired on worker {row['worker']}")
+                expired = True
+            else:
+                expired = False
+                conn.execute(
+                    'UPDATE jobs SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1, '
+                    'updated_at = ? WHERE id = ?',
+                    (RUNNING, worker_id, now + lease_seconds, now, row['id']))
+
+        return self.get_job(row['id'], pending_only=not expired)
+
+    def heartbeat(self, job_id, worker_id, lease_seconds=JOB_LEASE_SECONDS):
+        """Extend the lease of a job this worker still owns; False if it lost the lease"""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                'UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND worker = ? AND status = ?',
+                (now + lease_seconds, now, job_id, worker_id, RUNNING))
+            return cursor.rowcount == 1
+
+    def complete_item(self, job_id, idx, result):
+        """Record the result of one analysed file and advance progress"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                'UPDATE job_items SET status = ?, result = ?, error = NULL '
+                'WHERE job_id = ? AND idx = ? AND status != ?',
+                (COMPLETED, json.dumps(result), job_id, idx, COMPLETED))
+            if cursor.rowcount:
+                conn.execute('UPDATE jobs SET done = done + 1, updated_at = ? WHERE id = ?',
+                             (time.time(), job_id))
+
+    def fail_item(self, job_id, idx, error):
+        """Record a per-file error (the file is retried with the job)"""
+        with self._transaction() as conn:
+            conn.execute('UPDATE job_items SET error = ? WHERE job_id = ? AND idx = ?',
+                         (error, job_id, idx))
+
+    def complete(self, job_id, worker_id):
+        """Mark a job this worker still owns completed; False if it lost the lease"""
+        with self._transaction() as conn:
+            return self._finish(conn, job_id, COMPLETED, worker_id=worker_id)
+
+    def fail(self, job_id, error, worker_id):
+        """
+        Record a failed attempt of a job this worker still owns: requeue with
+        exponential backoff, or mark the job failed once max_attempts is reached
+
+        Returns:
+            True if the job will be retried, False if it failed for good,
+            None if the worker lost the lease (the job is left to its new owner)
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute('SELECT attempts, max_attempts FROM jobs WHERE id = ? AND worker = ? AND status = ?',
+                               (job_id, worker_id, RUNNING)).fetchone()
+            if row is None:
+                return None
+            if row['attempts'] < row['max_attempts']:
+                delay = JOB_RETRY_BACKOFF_SECONDS * 2 ** (row['attempts'] - 1)
+                conn.execute(
+                    'UPDATE jobs SET status = ?, worker = NULL, lease_until = NULL, error = ?, '
+                    'next_attempt_at = ?, updated_at = ? WHERE id = ?',
+                    (QUEUED, error, now + delay, now, job_id))
+                return True
+            self._finish(conn, job_id, FAILED, error, worker_id=worker_id)
+            return False
+
+    def release(self, job_id, worker_id):
+        """Hand a job back without counting the attempt (worker shutting down)"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, worker = NULL, lease_until = NULL, '
+                'attempts = MAX(attempts - 1, 0), next_attempt_at = ?, updated_at = ? '
+                'WHERE id = ? AND worker = ? AND status = ?',
+                (QUEUED, now, now, job_id, worker_id, RUNNING))
+
+    def set_callback_status(self, job_id, status):
+        with self._transaction() as conn:
+            conn.execute('UPDATE jobs SET callback_status = ? WHERE id = ?', (status, job_id))
+
+    @staticmethod
+    def _finish(conn, job_id, status, error=None, worker_id=None):
+        """Set a final status; with worker_id only while that worker holds the job. True if updated"""
+        query = ('UPDATE jobs SET status = ?, error = COALESCE(?, error), worker = NULL, '
+                 'lease_until = NULL, updated_at = ? WHERE id = ?')
+        params = (status, error, time.time(), job_id)
+        if worker_id is not None:
+            query += ' AND worker = ? AND status = ?'
+            params += (worker_id, RUNNING)
+        return conn.execute(query, params).rowcount == 1
+
+    def get_job(self, job_id, pending_only=False):
+        """
+        Job status, progress and per-file results
+
+        Returns:
+            Dict, or None if the job does not exist
+        """
+        with self._connect() as conn:
+            job = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if job is None:
+                return None
+            query = 'SELECT * FROM job_items WHERE job_id = ?'
+            if pending_only:
+                query += f" AND status != '{COMPLETED}'"
+            items = conn.execute(query + ' ORDER BY idx', (job_id,)).fetchall()
+
+        return {
+            'jobId': job['id'],
+            'status': job['status'],
+            'priority': job['priority'],
+            'progress': {
+                'done': job['done'],
+                'total': job['total'],
+                'fraction': round(job['done'] / job['total'], 4) if job['total'] else 1.0,
+            },
+            'attempts': job['attempts'],
+            'maxAttempts': job['max_attempts'],
+            'error': job['error'],
+            'callbackUrl': job['callback_url'],
+            'callbackStatus': job['callback_status'],
+            'createdAt': job['created_at'],
+            'updatedAt': job['updated_at'],
+            'items': [
+                {
+                    'index': item['idx'],
+                    'filename': item['filename'],
+                    'path': item['path'],
+                    'status': item['status'],
+                    'result': json.loads(item['result']) if item['result'] else None,
+                    'error': item['error'],
+                }
+                for item in items
+            ],
+        }
+
+    def counts(self):
+        """Number of jobs per status"""
+        with self._connect() as conn:
+            rows = conn.execute('SELECT status, COUNT(*) AS n FROM jobs GROUP BY status').fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+
+# Cached queue instance
+_queue = None
+
+
+def get_job_queue():
+    """Open and cache the job queue configured by JOB_DB_PATH / JOB_STORAGE_DIR"""
+    global _queue
+    if _queue is None:
+        _queue = JobQueue()
+    return _queue
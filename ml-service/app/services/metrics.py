@@ -0,0 +1,97 @@
+"""
+Lightweight in-process metrics
+Per-request stage timings (exposed as a Server-Timing header) and
+rolling latency percentiles per stage (exposed on /metrics)
+"""
+
+import time
+import threading
+import contextvars
+from collections import defaultdict, deque
+from contextlib import contextmanager
+import numpy as np
+
+# Number of most recent samples kept per metric for percentiles
+RESERVOIR_SIZE = 2048
+
+# Stage timings of the request being handled in this context
+_request_stages = contextvars.ContextVar('request_stages', default=None)
+
+_samples = defaultdict(lambda: deque(maxlen=RESERVOIR_SIZE))
+_counts = defaultdict(int)
+_lock = threading.Lock()
+
+
+def start_request():
+    """Begin collecting stage timings for the current request"""
+    stages = {}
+    _request_stages.set(stages)
+    return stages
+
+
+def request_stages():
+    """Stage timings (ms) recorded so far for the current request"""
+    return _request_stages.get() or {}
+
+
+def record(name, value):
+    """Add one observation to the rolling window of a metric"""
+    with _lock:
+        _samples[name].append(value)
+        _counts[name] += 1
+
+
+def add_stage(name, elapsed_ms):
+    """Add time measured elsewhere to a named stage of the current request"""
+    stages = _request_stages.get()
+    if stages is not None:
+        stages[name] = stages.get(name, 0.0) + elapsed_ms
+    record(f'stage.{name}', elapsed_ms)
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a block of work as a named stage of the current request
+
+    Usage:
+        with stage('decode'):
+            y, sr = librosa.load(...)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(name, (time.perf_counter() - start) * 1000)
+
+
+def server_timing_header(stages):
+    """Format stage timings as an HTTP Server-Timing header value"""
+    return ', '.join(f'{name};dur={ms:.1f}' for name, ms in stages.items())
+
+
+def summarize(values):
+    """Count/mean/percentiles of a list of observations"""
+    if not len(values):
+        return {'count': 0}
+    values = np.asarray(values, dtype=float)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'count': int(len(values)),
+        'mean': round(float(values.mean()), 3),
+        'p50': round(float(p50), 3),
+        'p95': round(float(p95), 3),
+        'p99': round(float(p99), 3),
+        'max': round(float(values.max()), 3),
+    }
+
+
+def snapshot():
+    """Summary of every metric's rolling window plus lifetime counts"""
+    with _lock:
+        samples = {name: list(window) for name, window in _samples.items()}
+        counts = dict(_counts)
+    return {
+        name: {**summarize(values), 'total': counts[name]}
+        for name, values in sorted(samples.items())
+    }
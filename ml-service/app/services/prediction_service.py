@@ -1,31 +1,14 @@
+import os
+import time
+import threading
+import contextvars
 import numpy as np
-from app.services.audio_processor import extract_features, create_feature_vector
-
-# Try to import trained CNN model first (highest priority)
-USE_CNN = False
-USE_YAMNET = False
-
-try:
-    from app.services.cnn_classifier import predict_with_cnn
-    import os
-    if os.path.exists('models/navarasa_cnn.h5'):
-        USE_CNN = True
-        print("✅ Trained CNN model found - using custom trained model (HIGHEST ACCURACY)")
-    else:
-        print("⚠️ Trained CNN model not found at models/navarasa_cnn.h5")
-except Exception as e:
-    print(f"⚠️ CNN classifier not available ({e})")
-    USE_CNN = False
-
-# Try YAMNet as secondary option
-if not USE_CNN:
-    try:
-        from app.services.yamnet_classifier import predict_with_yamnet_and_audio_features
-        USE_YAMNET = True
-        print("✅ YAMNet classifier available - using enhanced ML model")
-    except Exception as e:
-        print(f"⚠️ YAMNet not available ({e}), using rule-based classifier")
-        USE_YAMNET = False
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from app.services.audio_processor import load_audio, load_audio_segments, extract_features, create_feature_vector, LazyFeatures, SAMPLE_RATE
+from app.services import metrics, profiling
+from app.services.metrics import stage
+from app.services.decoder import slice_prefixes
+from app.services.backends import get_backend
 
 # Emotion labels
 EMOTION_LABELS = [
@@ -33,64 +16,74 @@ EMOTION_LABELS = [
     'veera', 'bhayanaka', 'bibhatsa', 'adbhuta', 'shanta'
 ]
 
-def predict_emotion(audio_path):
+# Features read by classify_emotion_rule_based (the rest are never computed)
+RULE_BASED_FIELDS = [
+    'mfccs_mean', 'spectral_centroid_mean', 'spectral_rolloff_mean',
+    'zcr_mean', 'tempo', 'rms_mean',
+]
+
+# Deadline-aware tiering: the expensive tier runs on a small bounded pool so
+# a load spike degrades to the cheap tier instead of queueing requests
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', 1))
+INFERENCE_QUEUE_LIMIT = int(os.getenv('INFERENCE_QUEUE_LIMIT', 4))
+
+_inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS,
+                                         thread_name_prefix='inference')
+_inference_pending = 0
+_inference_lock = threading.Lock()
+
+# Serve re-uploads (re-encoded or trimmed copies included) from the
+# fingerprint index instead of analysing them again
+FINGERPRINT_CACHE_ENABLED = os.getenv('FINGERPRINT_CACHE_ENABLED', 'false').lower() == 'true'
+
+# Progressive (anytime) inference: score growing prefixes of the clip and
+# stop once the top emotion leads the runner-up by PROGRESSIVE_MARGIN
+PROGRESSIVE_INFERENCE = os.getenv('PROGRESSIVE_INFERENCE', 'false').lower() == 'true'
+PROGRESSIVE_SEGMENTS = [float(s) for s in os.getenv('PROGRESSIVE_SEGMENTS', '5,10,20,30').split(',')]
+PROGRESSIVE_MARGIN = float(os.getenv('PROGRESSIVE_MARGIN', 0.25))
+
+def predict_emotion(audio_path, return_embedding=False, deadline=None, progressive=None, backend=None):
     """
-    Predict emotion from audio file using best available model:
+    Predict emotion from audio file using the selected backend, by default
+    the best available one (see backends.ENABLED_BACKENDS):
     1. Trained CNN model (if available) - HIGHEST ACCURACY
     2. YAMNet + Enhanced Audio Features - HIGH ACCURACY  
     3. Rule-based classifier - BASELINE
     
     Args:
         audio_path: Path to audio file
+        return_embedding: Include the CNN embedding under 'embedding'
+            (only available when the trained CNN model is in use)
+        deadline: Absolute time.perf_counter() value by which an answer is
+            due. When set, the rule-based tier is scored first and the
+            model tier's result is only used if it finishes in time.
+        progressive: Score growing prefixes and stop early on a clear
+            answer (see predict_progressive; default PROGRESSIVE_INFERENCE).
+            Not used with a deadline or when an embedding is requested.
+        backend: Backend name ('cnn', 'yamnet', 'rules' or a plugin);
+            loaded on first use
         
     Returns:
-        Dictionary with emotions, primaryEmotion, confidence, and features
+        Dictionary with emotions, primaryEmotion, confidence, features and
+        tier (which backend answered; degraded=True if the deadline forced
+        the cheap tier). With FINGERPRINT_CACHE_ENABLED, a recording that
+        matches a previously analysed one returns that stored result with
+        cached=True and the match under 'fingerprint'.
+    
+    Raises:
+        backends.BackendUnavailable: the backend cannot be used here
     """
+    model = get_backend(backend)
     try:
         print(f"🎵 Starting prediction for: {audio_path}")
         
-        # Priority 1: Use trained CNN model if available
-        if USE_CNN:
-            print("🚀 Using trained CNN model (custom trained)...")
-            result = predict_with_cnn(audio_path)
-            print(f"✅ Prediction complete: {result['primaryEmotion']} ({result['confidence']:.1%})")
-            return result
+        if progressive is None:
+            progressive = PROGRESSIVE_INFERENCE
         
-        # Priority 2: Use YAMNet-enhanced classifier if available
-        if USE_YAMNET:
-            print("🚀 Using YAMNet-enhanced classifier...")
-            result = predict_with_yamnet_and_audio_features(audio_path)
-            print(f"✅ Prediction complete: {result['primaryEmotion']} ({result['confidence']:.1%})")
-            return result
+        if FINGERPRINT_CACHE_ENABLED:
+            return predict_with_fingerprint_cache(audio_path, model, return_embedding, deadline, progressive)
         
-        # Fallback to rule-based
-        print("📊 Extracting audio features...")
-        features = extract_features(audio_path)
-        print(f"✅ Features extracted - Tempo: {features['tempo']:.1f}, Energy: {features['rms_mean']:.3f}")
-        
-        # Rule-based classification based on audio features
-        print("🧠 Classifying emotions...")
-        emotions = classify_emotion_rule_based(features)
-        
-        # Get primary emotion (highest probability)
-        primary_emotion = max(emotions, key=emotions.get)
-        confidence = emotions[primary_emotion]
-        
-        print(f"✅ Primary emotion: {primary_emotion} ({confidence:.1%})")
-        
-        # Prepare response
-        result = {
-            'emotions': emotions,
-            'primaryEmotion': primary_emotion,
-            'confidence': confidence,
-            'features': {
-                'tempo': features['tempo'],
-                'energy': features['rms_mean'],
-                'brightness': features['spectral_centroid_mean'],
-            }
-        }
-        
-        return result
+        return run_prediction(audio_path, model, return_embedding, deadline, progressive=progressive)
         
     except Exception as e:
         print(f"❌ Prediction error: {str(e)}")
@@ -98,6 +91,231 @@ def predict_emotion(audio_path):
         traceback.print_exc()
         raise Exception(f"Prediction failed: {str(e)}")
 
+def model_fields(model, extra=()):
+    """extract_features fields for a backend, plus extra ones (None = all)"""
+    fields = model.feature_fields()
+    if fields is None:
+        return None
+    return list(dict.fromkeys([*extra, *fields]))
+
+def run_prediction(audio_path, model, return_embedding=False, deadline=None, y=None, lazy=None, progressive=False):
+    """
+    Run one backend (see predict_emotion)
+    
+    y / lazy: Already decoded waveform and its LazyFeatures, reused
+        instead of decoding audio_path again
+    """
+    if deadline is not None:
+        return predict_within_deadline(audio_path, deadline, model, return_embedding, y=y, lazy=lazy)
+    
+    # An embedding of a partial clip would not be comparable in the similarity index
+    if progressive and not return_embedding and model.accepts_waveform:
+        return predict_progressive(audio_path, model, y=y)
+    
+    print(f"🚀 Using {model.tier} backend...")
+    audio_features = extract_features(audio_path, fields=model_fields(model), lazy=lazy) if lazy else None
+    result = model.predict(audio_path, return_embedding=return_embedding, y=y, audio_features=audio_features)
+    result['tier'] = model.tier
+    print(f"✅ Prediction complete: {result['primaryEmotion']} ({result['confidence']:.1%})")
+    return result
+
+def predict_with_fingerprint_cache(audio_path, model, return_embedding=False, deadline=None, progressive=False):
+    """
+    Look the recording up in the fingerprint index before analysing it
+    
+    The fingerprint comes from the same STFT the feature extractor uses,
+    so a cache miss costs only the peak picking and the index lookup.
+    Fresh results are stored for later uploads unless they were degraded
+    by the deadline.
+    """
+    from app.services.fingerprint import compute_fingerprint, get_fingerprint_index
+    
+    y, sr = load_audio(audio_path)
+    lazy = LazyFeatures(y, sr)
+    index = get_fingerprint_index()
+    with stage('fingerprint'):
+        fingerprint = compute_fingerprint(lazy.node('stft'))
+        match = index.match(fingerprint)
+    
+    # A cached result carries no embedding, so analyse again when one is wanted;
+    # it is also only reused for the backend that produced it
+    if match and match['result'] and not return_embedding and match['result'].get('tier') == model.tier:
+        print(f"♻️ Fingerprint match {match['trackId']} (score {match['score']:.2f}) - returning cached result")
+        result = match['result']
+        result['cached'] = True
+        result['fingerprint'] = {'trackId': match['trackId'], 'score': match['score'],
+                                 'offsetSeconds': match['offsetSeconds']}
+        return result
+    
+    result = run_prediction(audio_path, model, return_embedding, deadline, y=y, lazy=lazy, progressive=progressive)
+    # Results of a partial clip are not stored either
+    if match is None and not result.get('degraded') and not result.get('earlyExit'):
+        stored = {k: v for k, v in result.items() if k != 'embedding'}
+        index.add(fingerprint, result=stored, label=result['primaryEmotion'])
+    result['cached'] = False
+    return result
+
+def predict_progressive(audio_path, model=None, y=None, seconds=None, margin=None):
+    """
+    Anytime prediction over growing prefixes of the clip
+    
+    The first seconds[0] seconds are decoded and scored by a backend that
+    accepts waveforms (CNN or rules), then the next prefix, and so on; each prefix
+    only decodes its new samples. Scoring stops at the first prefix whose
+    top emotion leads the runner-up by at least `margin`, or when the
+    clip ends. The tempo/energy/brightness summary is computed once, for
+    the prefix that answered.
+    
+    Args:
+        audio_path: Path to audio file
+        model: Loaded backend (default: get_backend())
+        y: Already decoded waveform at SAMPLE_RATE (prefixes are sliced from it)
+        seconds: Prefix lengths (default PROGRESSIVE_SEGMENTS)
+        margin: Required probability margin (default PROGRESSIVE_MARGIN)
+    
+    Returns:
+        The usual response plus secondsConsumed, earlyExit and
+        progressive.steps (seconds / primaryEmotion / margin per prefix)
+    """
+    model = model or get_backend()
+    if not model.accepts_waveform:
+        raise ValueError(f"The {model.tier} backend cannot score partial clips")
+    seconds = sorted(seconds or PROGRESSIVE_SEGMENTS)
+    margin = PROGRESSIVE_MARGIN if margin is None else margin
+    
+    if y is None:
+        segments = load_audio_segments(audio_path, seconds)
+    else:
+        segments = ((segment, SAMPLE_RATE) for segment in slice_prefixes(y, SAMPLE_RATE, seconds))
+    
+    steps = []
+    for segment, sr in segments:
+        result = model.predict(audio_path, y=segment, summary=False)
+        result['tier'] = model.tier
+        
+        top, runner_up = sorted(result['emotions'].values(), reverse=True)[:2]
+        steps.append({
+            'seconds': round(len(segment) / sr, 2),
+            'primaryEmotion': result['primaryEmotion'],
+            'margin': round(top - runner_up, 4),
+        })
+        if top - runner_up >= margin:
+            break
+    
+    consumed = steps[-1]['seconds']
+    early_exit = len(steps) < len(seconds) and consumed >= seconds[len(steps) - 1]
+    print(f"⏩ Progressive: answered after {consumed:.1f}s ({len(steps)} step(s), "
+          f"margin {steps[-1]['margin']:.2f}{', early exit' if early_exit else ''})")
+    metrics.record('progressive.seconds_consumed', consumed)
+    
+    if 'features' not in result:
+        with stage('summary'):
+            features = extract_features(audio_path, y=segment, sr=sr,
+                                        fields=['tempo', 'rms_mean', 'spectral_centroid_mean'])
+        result['features'] = {
+            'tempo': features['tempo'],
+            'energy': features['rms_mean'],
+            'brightness': features['spectral_centroid_mean'],
+        }
+    
+    result['secondsConsumed'] = consumed
+    result['earlyExit'] = early_exit
+    result['progressive'] = {'steps': steps, 'margin': margin}
+    return result
+
+def predict_with_rules(features):
+    """
+    Score already extracted features with the rule-based classifier
+    and build the standard response
+    """
+    # Rule-based classification based on audio features
+    print("🧠 Classifying emotions...")
+    with stage('rules'):
+        emotions = classify_emotion_rule_based(features)
+    
+    # Get primary emotion (highest probability)
+    primary_emotion = max(emotions, key=emotions.get)
+    confidence = emotions[primary_emotion]
+    
+    print(f"✅ Primary emotion: {primary_emotion} ({confidence:.1%})")
+    
+    # Prepare response
+    result = {
+        'emotions': emotions,
+        'primaryEmotion': primary_emotion,
+        'confidence': confidence,
+        'features': {
+            'tempo': features['tempo'],
+            'energy': features['rms_mean'],
+            'brightness': features['spectral_centroid_mean'],
+        },
+        'tier': 'rule_based',
+    }
+    
+    return result
+
+def predict_within_deadline(audio_path, deadline, model, return_embedding=False, y=None, lazy=None):
+    """
+    Tiered prediction under a latency budget
+    
+    The audio is decoded and summarised once; the rule-based answer is
+    computed from those shared features first, then the model tier runs
+    on the bounded inference pool. Whichever is the best answer available
+    at the deadline is returned.
+    """
+    global _inference_pending
+    
+    if y is None:
+        y, sr = load_audio(audio_path)
+        lazy = LazyFeatures(y, sr)
+    # One pass for both tiers: the rule-based fields plus whatever the model reads
+    features = extract_features(audio_path, fields=model_fields(model, RULE_BASED_FIELDS), lazy=lazy)
+    cheap = predict_with_rules(features)
+    cheap['degraded'] = False
+    
+    if model.tier == cheap['tier']:
+        return cheap
+    tier, run = model.tier, lambda: model.predict(
+        audio_path, return_embedding=return_embedding, y=y, audio_features=features)
+    
+    cheap['degraded'] = True
+    remaining = deadline - time.perf_counter()
+    if remaining <= 0:
+        print(f"⏱️ Deadline already spent on features - answering with rule-based tier")
+        return cheap
+    
+    with _inference_lock:
+        if _inference_pending >= INFERENCE_WORKERS + INFERENCE_QUEUE_LIMIT:
+            print(f"⏱️ Inference pool saturated ({_inference_pending} pending) - answering with rule-based tier")
+            return cheap
+        _inference_pending += 1
+    
+    def run_tracked():
+        global _inference_pending
+        try:
+            return run()
+        finally:
+            with _inference_lock:
+                _inference_pending -= 1
+    
+    # Copy the request context so stage timings (and a request profile) from the pool thread are kept
+    future = _inference_executor.submit(contextvars.copy_context().run,
+                                        profiling.in_request_profile, run_tracked)
+    try:
+        result = future.result(timeout=remaining)
+    except FutureTimeoutError:
+        # Drop the job if it has not started yet so it does not occupy the pool
+        if future.cancel():
+            with _inference_lock:
+                _inference_pending -= 1
+        print(f"⏱️ {tier} tier missed the deadline - answering with rule-based tier")
+        return cheap
+    
+    result['tier'] = tier
+    result['degraded'] = False
+    print(f"✅ {tier} tier answered within deadline: {result['primaryEmotion']} ({result['confidence']:.1%})")
+    return result
+
 def classify_emotion_rule_based(features):
     """
     Rule-based emotion classification based on audio features
@@ -232,23 +450,87 @@ def classify_emotion_rule_based(features):
     
     return scores
 
-# For future: Load trained CNN model
+# Summary-feature model tier (train_summary_model.py): a compact scikit-learn
+# classifier over create_feature_vector, scored in batches
+SUMMARY_MODEL_PATH = os.getenv('SUMMARY_MODEL_PATH', 'models/navarasa_summary.joblib')
+
+_summary_model = None
+_summary_model_lock = threading.Lock()
+
 def load_model():
     """
-    Load pre-trained CNN model
-    (To be implemented when model is trained)
+    Load the trained summary-feature model (cached after the first call)
+
+    Returns:
+        {'model', 'classes', 'n_features', ...} as saved by train_summary_model.py
     """
-    # import tensorflow as tf
-    # model = tf.keras.models.load_model('models/navarasa_model.h5')
-    # return model
-    pass
+    global _summary_model
+    
+    with _summary_model_lock:
+        if _summary_model is None:
+            import joblib
+            
+            if not os.path.exists(SUMMARY_MODEL_PATH):
+                raise FileNotFoundError(f"Summary model not found at {SUMMARY_MODEL_PATH}")
+            
+            print(f"📥 Loading summary model from {SUMMARY_MODEL_PATH}...")
+            _summary_model = joblib.load(SUMMARY_MODEL_PATH)
+            print(f"✅ Summary model loaded ({_summary_model['kind']}, "
+                  f"{_summary_model['n_features']} features)")
+    
+    return _summary_model
 
 def predict_with_model(model, features):
     """
-    Predict using trained ML model
-    (To be implemented)
+    Score extracted features with the summary-feature model
+    
+    Args:
+        model: Output of load_model()
+        features: One extract_features() dict, or a list of them; a list is
+            stacked into one matrix and scored with a single predict_proba
+    
+    Returns:
+        {emotion: probability} for a dict, a list of them for a list
+    """
+    batch = features if isinstance(features, list) else [features]
+    if not batch:
+        return []
+    
+    X = np.stack([create_feature_vector(f) for f in batch]).astype(np.float32)
+    if X.shape[1] != model['n_features']:
+        raise ValueError(f"Summary model expects {model['n_features']} features, got {X.shape[1]}")
+    
+    with stage('summary_model'):
+        probabilities = model['model'].predict_proba(X)
+    
+    # Classes missing from the training set score 0
+    columns = [model['classes'].index(e) if e in model['classes'] else None for e in EMOTION_LABELS]
+    results = [
+        {e: round(float(row[c]), 4) if c is not None else 0.0 for e, c in zip(EMOTION_LABELS, columns)}
+        for row in probabilities
+    ]
+    return results if isinstance(features, list) else results[0]
+
+def predict_with_summary_model(features):
+    """
+    Score already extracted features with the summary-feature model
+    and build the standard response
     """
-    # feature_vector = create_feature_vector(features)
-    # predictions = model.predict(np.expand_dims(feature_vector, axis=0))
-    # return dict(zip(EMOTION_LABELS, predictions[0]))
-    pass
+    emotions = predict_with_model(load_model(), features)
+    
+    primary_emotion = max(emotions, key=emotions.get)
+    confidence = emotions[primary_emotion]
+    
+    print(f"✅ Primary emotion: {primary_emotion} ({confidence:.1%})")
+    
+    return {
+        'emotions': emotions,
+        'primaryEmotion': primary_emotion,
+        'confidence': confidence,
+        'features': {
+            'tempo': features['tempo'],
+            'energy': features['rms_mean'],
+            'brightness': features['spectral_centroid_mean'],
+        },
+        'tier': 'summary_model',
+    }
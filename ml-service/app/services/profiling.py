@@ -0,0 +1,250 @@
+"""
+Opt-in per-request profiling
+A request is profiled when it carries X-Profile: <PROFILE_TOKEN> or is
+picked by PROFILE_SAMPLE_RATE. The default profiler samples Python stacks
+of busy threads on a timer (low overhead, no tracing) and writes
+flamegraph-compatible collapsed stacks; cProfile is the fallback and
+writes a .prof file. cProfile only traces the thread that enables it, so
+work handed to the scheduler and inference pool runs through
+in_request_profile, which profiles that thread too; the per-thread stats
+are merged into the request's file. Profiles are stored under PROFILE_DIR keyed by
+a profile ID (the request ID plus a server-generated suffix, so a caller
+reusing an X-Request-ID cannot overwrite another profile) and served by the
+/admin/profiles endpoints.
+"""
+
+import os
+import re
+import hmac
+import uuid
+import sys
+import time
+import pstats
+import random
+import tempfile
+import threading
+import contextvars
+import cProfile
+from collections import Counter
+
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_MODE = os.getenv('PROFILE_MODE', 'sampling')  # 'sampling' or 'cprofile'
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', 5))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'navarasa_profiles'))
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', 200))
+
+# (file suffix, function) of frames where a thread is parked waiting for work
+IDLE_FRAMES = {
+    ('threading.py', 'wait'),
+    ('selectors.py', 'select'),
+    ('queue.py', 'get'),
+    ('thread.py', '_worker'),
+}
+
+# cProfile-mode RequestProfile of the request being handled, if any
+_current_profile = contextvars.ContextVar('current_profile', default=None)
+
+_REQUEST_ID = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+
+def valid_request_id(request_id):
+    """Request IDs become file names, so only allow a safe character set"""
+    return bool(request_id and _REQUEST_ID.match(request_id))
+
+
+def new_profile_id(request_id):
+    """Profile ID for a request: its (validated) ID plus a server-generated suffix"""
+    return f"{request_id[:51]}.{uuid.uuid4().hex[:12]}"
+
+
+def should_profile(profile_header):
+    """Decide whether to profile a request from its X-Profile header and the sample rate"""
+    if PROFILE_TOKEN and profile_header and hmac.compare_digest(profile_header.encode(), PROFILE_TOKEN.encode()):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _is_idle(frame):
+    code = frame.f_code
+    return any(code.co_filename.endswith(suffix) and code.co_name == name
+               for suffix, name in IDLE_FRAMES)
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all busy threads every interval_ms from a
+    background thread and aggregates them into collapsed-stack counts
+    ("thread;module:function;... count"), the input format of
+    flamegraph.pl and speedscope.
+
+    Concurrent requests running at the same time show up in the same
+    profile; filter by thread name when that matters.
+    """
+
+    def __init__(self, interval_ms=PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or _is_idle(frame):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+                    stack.append(f"{module}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def output(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class RequestProfile:
+    """
+    Context manager profiling one request with the configured profiler
+
+    Usage:
+        with RequestProfile(request_id) as profile:
+            response = await call_next(request)
+        profile.profile_id  # key for /admin/profiles/{profile_id}
+        profile.path        # where the profile was written
+    """
+
+    def __init__(self, request_id, mode=PROFILE_MODE):
+        self.request_id = request_id
+        self.profile_id = new_profile_id(request_id)
+        # Fall back to cProfile where frame sampling is unavailable (non-CPython)
+        self.mode = mode if hasattr(sys, '_current_frames') else 'cprofile'
+        self.path = None
+        self._profiler = None
+        self._start = None
+        self._token = None
+        self._thread_profiles = []      # finished profiles of worker threads
+        self._threads = set()           # threads currently profiled for this request
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        if self.mode == 'cprofile':
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+            self._token = _current_profile.set(self)
+        else:
+            self._profiler = SamplingProfiler()
+            self._profiler.start()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed_ms = (time.perf_counter() - self._start) * 1000
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+
+        if self.mode == 'cprofile':
+            self._profiler.disable()
+            _current_profile.reset(self._token)
+            stats = pstats.Stats(self._profiler)
+            with self._lock:
+                for profile in self._thread_profiles:
+                    stats.add(profile)
+            self.path = os.path.join(PROFILE_DIR, f"{self.profile_id}.prof")
+            stats.dump_stats(self.path)
+        else:
+            self._profiler.stop()
+            self.path = os.path.join(PROFILE_DIR, f"{self.profile_id}.collapsed")
+            with open(self.path, 'w') as f:
+                f.write(self._profiler.output())
+
+        print(f"🔬 Profiled request {self.request_id} ({elapsed_ms:.0f} ms) -> {self.path}")
+        _prune()
+        return False
+
+    def run_in_thread(self, fn, *args, **kwargs):
+        """Call fn with a cProfile on the calling thread, kept for the merged profile"""
+        thread_id = threading.get_ident()
+        with self._lock:
+            if thread_id in self._threads:
+                # Already profiled further up this thread's stack
+                return fn(*args, **kwargs)
+            self._threads.add(thread_id)
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.disable()
+            with self._lock:
+                self._threads.discard(thread_id)
+                self._thread_profiles.append(profiler)
+
+
+def in_request_profile(fn, *args, **kwargs):
+    """
+    Call fn, profiling the calling thread when the request in context is
+    being cProfiled. Wrap work submitted to other threads with this (in the
+    request's copied context) so it shows up in the request's profile.
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        return fn(*args, **kwargs)
+    return profile.run_in_thread(fn, *args, **kwargs)
+
+
+def _prune():
+    """Keep only the newest PROFILE_MAX_FILES profiles"""
+    files = list_profiles()
+    for entry in files[PROFILE_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, entry['file']))
+        except OSError:
+            pass
+
+
+def list_profiles():
+    """Stored profiles, newest first"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    entries = []
+    for name in os.listdir(PROFILE_DIR):
+        profile_id, ext = os.path.splitext(name)
+        if ext not in ('.collapsed', '.prof'):
+            continue
+        stat = os.stat(os.path.join(PROFILE_DIR, name))
+        entries.append({
+            'profileId': profile_id,
+            'requestId': profile_id.rsplit('.', 1)[0],
+            'file': name,
+            'format': 'collapsed' if ext == '.collapsed' else 'pstats',
+            'bytes': stat.st_size,
+            'created': stat.st_mtime,
+        })
+    return sorted(entries, key=lambda e: e['created'], reverse=True)
+
+
+def profile_path(profile_id):
+    """Path of a stored profile, or None"""
+    if not valid_request_id(profile_id):
+        return None
+    for ext in ('.collapsed', '.prof'):
+        path = os.path.join(PROFILE_DIR, f"{profile_id}{ext}")
+        if os.path.exists(path):
+            return path
+    return None
@@ -0,0 +1,216 @@
+"""
+Fair per-client request scheduler
+Analysis requests are queued per client (API key or address; the
+X-Client-ID header only for configured client IDs) and served by a fixed
+pool of worker threads in deficit round-robin order, so a client
+bulk-uploading a playlist only gets its weighted share of the workers
+while interactive clients keep getting slots. While other clients are
+waiting, a client is capped at SCHEDULER_CLIENT_CONCURRENCY running
+requests; a client alone in the queue may use every idle worker. Each
+client may have at most SCHEDULER_CLIENT_QUEUE_LIMIT queued requests.
+"""
+
+import os
+import time
+import threading
+import contextvars
+from collections import deque, defaultdict, OrderedDict
+from concurrent.futures import Future
+from app.services import metrics
+
+SCHEDULER_WORKERS = int(os.getenv('SCHEDULER_WORKERS', 2))
+SCHEDULER_CLIENT_CONCURRENCY = int(os.getenv('SCHEDULER_CLIENT_CONCURRENCY', 1))
+SCHEDULER_CLIENT_QUEUE_LIMIT = int(os.getenv('SCHEDULER_CLIENT_QUEUE_LIMIT', 64))
+# "client:weight,..." - a weight of 3 gets three requests per round (default 1)
+SCHEDULER_CLIENT_WEIGHTS = os.getenv('SCHEDULER_CLIENT_WEIGHTS', '')
+# X-Client-ID values honoured besides the clients in SCHEDULER_CLIENT_WEIGHTS
+SCHEDULER_TRUSTED_CLIENTS = os.getenv('SCHEDULER_TRUSTED_CLIENTS', '')
+# Per-client served counters kept for stats() (least recently served dropped first)
+SCHEDULER_MAX_TRACKED_CLIENTS = int(os.getenv('SCHEDULER_MAX_TRACKED_CLIENTS', 256))
+
+
+class QueueFull(Exception):
+    """The client already has SCHEDULER_CLIENT_QUEUE_LIMIT requests waiting"""
+
+
+def parse_weights(spec):
+    """'interactive:4,batch:1' -> {'interactive': 4.0, 'batch': 1.0}"""
+    weights = {}
+    for entry in filter(None, (e.strip() for e in spec.split(','))):
+        client, _, weight = entry.rpartition(':')
+        if not client or float(weight) <= 0:
+            raise ValueError(f"Invalid scheduler weight entry: {entry}")
+        weights[client] = float(weight)
+    return weights
+
+
+def trusted_clients():
+    """Client IDs a caller may claim with X-Client-ID (configured ones only)"""
+    named = {c.strip() for c in SCHEDULER_TRUSTED_CLIENTS.split(',') if c.strip()}
+    return named | set(parse_weights(SCHEDULER_CLIENT_WEIGHTS))
+
+
+class _Task:
+    __slots__ = ('client', 'fn', 'cost', 'future', 'context', 'enqueued')
+
+    def __init__(self, client, fn, cost):
+        self.client = client
+        self.fn = fn
+        self.cost = cost
+        self.future = Future()
+        # Keep the request context so stage timings land in its Server-Timing
+        self.context = contextvars.copy_context()
+        self.enqueued = time.perf_counter()
+
+
+class FairScheduler:
+    """
+    Deficit round-robin over per-client FIFO queues
+
+    Clients with queued work sit in a round-robin ring. A visit adds
+    weight x quantum to the client's deficit; it is served while the
+    deficit covers the cost of its next request. Clients at their
+    concurrency cap are skipped without losing their place, unless no
+    other client has work queued (idle workers are never held back).
+    """
+
+    def __init__(self, workers=SCHEDULER_WORKERS, client_concurrency=SCHEDULER_CLIENT_CONCURRENCY,
+                 queue_limit=SCHEDULER_CLIENT_QUEUE_LIMIT, weights=None, quantum=1.0):
+        self.client_concurrency = client_concurrency
+        self.queue_limit = queue_limit
+        self.weights = parse_weights(SCHEDULER_CLIENT_WEIGHTS) if weights is None else weights
+        self.quantum = quantum
+
+        self.queues = {}                # client -> deque of _Task
+        self.ring = deque()             # clients with queued tasks, in service order
+        self.deficit = defaultdict(float)
+        self.running = {}
+        self.served = OrderedDict()     # bounded LRU: client -> requests served
+        # Clients with their own queue_wait metric; the rest share queue_wait.other
+        self.named_clients = set(self.weights) | trusted_clients()
+        self.cond = threading.Condition()
+
+        self.threads = [threading.Thread(target=self._worker, name=f'scheduler-{i}', daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, client, fn, cost=1.0):
+        """
+        Queue fn() for a client
+
+        Returns:
+            concurrent.futures.Future with fn's result
+
+        Raises:
+            QueueFull: the client's queue is at its limit
+        """
+        task = _Task(client, fn, cost)
+        with self.cond:
+            queue = self.queues.get(client)
+            if queue is None:
+                queue = self.queues[client] = deque()
+            if len(queue) >= self.queue_limit:
+                raise QueueFull(f"Client {client} has {len(queue)} requests queued")
+            if not queue:
+                self.ring.append(client)
+            queue.append(task)
+            self.cond.notify()
+        return task.future
+
+    def _capped(self, client):
+        # The cap only shares workers between clients; a lone client is not held back
+        return self.running.get(client, 0) >= self.client_concurrency and len(self.ring) > 1
+
+    def _pick(self):
+        """Next task in DRR order, or None if every queued client is at its cap"""
+        if all(self._capped(c) for c in self.ring):
+            return None
+
+        while True:
+            client = self.ring[0]
+            if self._capped(client):
+                self.ring.rotate(-1)
+                continue
+
+            queue = self.queues[client]
+            if self.deficit[client] >= queue[0].cost:
+                task = queue.popleft()
+                self.deficit[client] -= task.cost
+                if not queue:
+                    # Idle clients do not bank credit
+                    self.ring.popleft()
+                    del self.queues[client]
+                    self.deficit.pop(client, None)
+                elif self.deficit[client] < queue[0].cost:
+                    # Visit over; the next client is up
+                    self.ring.rotate(-1)
+                return task
+
+            self.deficit[client] += self.quantum * self.weights.get(client, 1.0)
+            if self.deficit[client] < queue[0].cost:
+                self.ring.rotate(-1)
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                task = self._pick()
+                while task is None:
+                    self.cond.wait()
+                    task = self._pick()
+                self.running[task.client] = self.running.get(task.client, 0) + 1
+
+            try:
+                if task.future.set_running_or_notify_cancel():
+                    task.context.run(self._run, task)
+            finally:
+                with self.cond:
+                    self.running[task.client] -= 1
+                    if not self.running[task.client]:
+                        del self.running[task.client]
+                    self.served[task.client] = self.served.pop(task.client, 0) + 1
+                    while len(self.served) > SCHEDULER_MAX_TRACKED_CLIENTS:
+                        self.served.popitem(last=False)
+                    self.cond.notify_all()
+
+    def _run(self, task):
+        wait_ms = (time.perf_counter() - task.enqueued) * 1000
+        # One metric per configured client at most, so arbitrary IDs cannot grow /metrics
+        name = task.client if task.client in self.named_clients else 'other'
+        metrics.record(f'queue_wait.{name}', wait_ms)
+        metrics.add_stage('queue', wait_ms)
+        try:
+            task.future.set_result(task.fn())
+        except BaseException as e:
+            task.future.set_exception(e)
+
+    def stats(self):
+        """Queued / running / served requests per client"""
+        with self.cond:
+            clients = set(self.queues) | set(self.running) | set(self.served)
+            return {
+                'workers': len(self.threads),
+                'clients': {
+                    client: {
+                        'queued': len(self.queues.get(client, ())),
+                        'running': self.running.get(client, 0),
+                        'served': self.served.get(client, 0),
+                        'weight': self.weights.get(client, 1.0),
+                    }
+                    for client in sorted(clients)
+                },
+            }
+
+
+# Process-wide scheduler
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Create (on first use) and return the process-wide scheduler"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = FairScheduler()
+        return _scheduler
@@ -0,0 +1,386 @@
+"""
+Embedding Similarity Index
+Persistent vector index over the CNN's penultimate-layer embeddings,
+used to answer "find tracks with a similar rasa" without re-running
+inference over the catalog.
+
+Vectors are L2-normalized and stored in a NumPy memmap, so cosine
+similarity is a single BLAS matrix-vector product. For large catalogs an
+optional IVF + product-quantization (IVF-PQ) structure can be built on
+top of the memmap and is used to shortlist candidates before exact
+re-ranking.
+
+Several service workers can share one index directory: writers serialise
+on an flock'd lock file, and every instance picks up the rows other
+processes appended (and any IVF-PQ build they saved) before it adds or
+searches.
+"""
+
+import os
+import json
+import fcntl
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+# Index location and layout
+INDEX_DIR = os.getenv('SIMILARITY_INDEX_DIR', 'models/similarity_index')
+EMBEDDING_DIM = 256
+INITIAL_CAPACITY = 1024
+
+# Search mode: 'flat' (brute force), 'ivfpq', or 'auto' (ivfpq when built)
+SEARCH_MODE = os.getenv('SIMILARITY_INDEX_MODE', 'auto')
+
+VECTORS_FILE = 'vectors.f32'
+METADATA_FILE = 'metadata.jsonl'
+IVFPQ_FILE = 'ivfpq.npz'
+LOCK_FILE = 'index.lock'
+
+
+def _normalize(vectors):
+    """L2-normalize a vector or a batch of row vectors"""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _kmeans(data, n_clusters, iterations=20, seed=42):
+    """
+    Plain Lloyd's k-means on squared Euclidean distance
+
+    Returns:
+        (centroids, assignments)
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(data))
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+    data_sq = np.sum(data ** 2, axis=1, keepdims=True)
+
+    for _ in range(iterations):
+        distances = data_sq - 2 * data @ centroids.T + np.sum(centroids ** 2, axis=1)
+        assignments = np.argmin(distances, axis=1)
+        for c in range(n_clusters):
+            members = data[assignments == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+            else:
+                # Re-seed empty clusters with a random point
+                centroids[c] = data[rng.integers(len(data))]
+
+    distances = data_sq - 2 * data @ centroids.T + np.sum(centroids ** 2, axis=1)
+    return centroids.astype(np.float32), np.argmin(distances, axis=1)
+
+
+class EmbeddingIndex:
+    """
+    Append-only embedding store with brute-force and IVF-PQ search
+
+    Layout of index_dir:
+        vectors.f32     - float32 memmap, capacity x dim (first len(self) rows used)
+        metadata.jsonl  - one JSON object per row: {"trackId": ..., ...metadata}
+        ivfpq.npz       - optional IVF-PQ structure (see build_ivfpq)
+        index.lock      - flock'd by writers (exclusive) and reloads (shared)
+    """
+
+    def __init__(self, index_dir=INDEX_DIR, dim=EMBEDDING_DIM):
+        self.index_dir = index_dir
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._metadata = []
+        self._rows = {}
+        self._metadata_offset = 0
+        self._vectors = None
+        self._ivfpq = None
+        self._ivfpq_mtime = None
+
+        os.makedirs(index_dir, exist_ok=True)
+        self._vectors_path = os.path.join(index_dir, VECTORS_FILE)
+        self._metadata_path = os.path.join(index_dir, METADATA_FILE)
+        self._ivfpq_path = os.path.join(index_dir, IVFPQ_FILE)
+        self._lock_path = os.path.join(index_dir, LOCK_FILE)
+
+        with self._lock, self._file_lock(fcntl.LOCK_SH):
+            self._reload_metadata()
+            capacity = INITIAL_CAPACITY
+            if os.path.exists(self._vectors_path):
+                capacity = max(os.path.getsize(self._vectors_path) // (4 * dim), 1)
+            self._open_vectors(max(capacity, len(self._metadata)))
+
+        self._reload_ivfpq()
+
+    def __len__(self):
+        return len(self._metadata)
+
+    def _append_metadata(self, entry):
+        track_id = entry['trackId']
+        if track_id in self._rows:
+            # Later lines overwrite earlier ones for the same track
+            self._metadata[self._rows[track_id]] = entry
+        else:
+            self._rows[track_id] = len(self._metadata)
+            self._metadata.append(entry)
+
+    @contextmanager
+    def _file_lock(self, operation):
+        """Hold an flock on the index's lock file (shared across worker processes)"""
+        with open(self._lock_path, 'a') as f:
+            fcntl.flock(f, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _reload_metadata(self):
+        """
+        Read metadata lines appended since the last read, including those
+        written by other processes, and remap the vectors if they grew.
+        Call with self._lock and the file lock held.
+        """
+        try:
+            size = os.path.getsize(self._metadata_path)
+        except FileNotFoundError:
+            size = 0
+        if size > self._metadata_offset:
+            with open(self._metadata_path, 'rb') as f:
+                f.seek(self._metadata_offset)
+                data = f.read(size - self._metadata_offset)
+            # Only whole lines; a torn write is picked up once it completes
+            end = data.rfind(b'\n') + 1
+            for line in data[:end].splitlines():
+                if line.strip():
+                    self._append_metadata(json.loads(line))
+            self._metadata_offset += end
+
+        if self._vectors is not None:
+            capacity = os.path.getsize(self._vectors_path) // (4 * self.dim)
+            if capacity > self._vectors.shape[0] or len(self._metadata) > self._vectors.shape[0]:
+                self._vectors.flush()
+                self._open_vectors(max(capacity, len(self._metadata)))
+
+    def _reload_ivfpq(self):
+        """Load the IVF-PQ file if another process built (or rebuilt) it since the last load"""
+        try:
+            mtime = os.stat(self._ivfpq_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._ivfpq_mtime:
+            return
+        try:
+            ivfpq = dict(np.load(self._ivfpq_path)) if mtime is not None else None
+        except FileNotFoundError:
+            ivfpq, mtime = None, None
+        self._ivfpq, self._ivfpq_mtime = ivfpq, mtime
+
+    def _sync(self):
+        """Pick up rows and IVF-PQ builds from other processes, if their files changed"""
+        self._reload_ivfpq()
+        try:
+            changed = os.path.getsize(self._metadata_path) != self._metadata_offset
+        except FileNotFoundError:
+            changed = False
+        if changed:
+            with self._lock, self._file_lock(fcntl.LOCK_SH):
+                self._reload_metadata()
+
+    def _open_vectors(self, capacity):
+        mode = 'r+' if os.path.exists(self._vectors_path) else 'w+'
+        if mode == 'r+' and os.path.getsize(self._vectors_path) < capacity * self.dim * 4:
+            with open(self._vectors_path, 'r+b') as f:
+                f.truncate(capacity * self.dim * 4)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32,
+                                  mode=mode, shape=(capacity, self.dim))
+
+    def add(self, track_id, embedding, metadata=None):
+        """
+        Add (or replace) the embedding of an analysed track
+
+        Args:
+            track_id: Stable identifier of the track (e.g. content hash)
+            embedding: Penultimate-layer activations, shape (dim,)
+            metadata: Extra JSON-serializable fields returned with search hits
+        """
+        vector = _normalize(np.asarray(embedding, dtype=np.float32).reshape(self.dim))
+        entry = {'trackId': track_id, **(metadata or {})}
+
+        with self._lock, self._file_lock(fcntl.LOCK_EX):
+            # Rows other workers appended must be known before allocating one
+            self._reload_metadata()
+            row = self._rows.get(track_id, len(self._metadata))
+            if row >= self._vectors.shape[0]:
+                self._vectors.flush()
+                self._open_vectors(self._vectors.shape[0] * 2)
+            self._vectors[row] = vector
+            self._vectors.flush()
+
+            # The vector is on disk before the metadata line that publishes it
+            self._append_metadata(entry)
+            with open(self._metadata_path, 'ab') as f:
+                f.write((json.dumps(entry) + '\n').encode())
+                self._metadata_offset = f.tell()
+
+        return row
+
+    def get_vector(self, track_id):
+        """Return the stored (normalized) embedding of a track, or None"""
+        self._sync()
+        row = self._rows.get(track_id)
+        if row is None:
+            return None
+        return np.array(self._vectors[row])
+
+    def search(self, query, k=10, mode=None, exclude_id=None, nprobe=8):
+        """
+        Find the k most similar tracks to a query embedding
+
+        Args:
+            query: Embedding of shape (dim,)
+            k: Number of neighbours to return
+            mode: 'flat', 'ivfpq' or 'auto' (defaults to SIMILARITY_INDEX_MODE)
+            exclude_id: Track ID to leave out (the query track itself)
+            nprobe: Number of IVF lists to visit in ivfpq mode
+
+        Returns:
+            List of {"trackId", "score", ...metadata} sorted by cosine similarity
+        """
+        self._sync()
+        n = len(self._metadata)
+        if n == 0:
+            return []
+
+        query = _normalize(np.asarray(query, dtype=np.float32).reshape(self.dim))
+        mode = mode or SEARCH_MODE
+        ivf = self._ivfpq
+        use_ivfpq = ivf is not None and mode in ('auto', 'ivfpq')
+        wanted = k + (1 if exclude_id is not None else 0)
+
+        if use_ivfpq:
+            rows, scores = self._search_ivfpq(ivf, query, wanted, n, nprobe)
+        else:
+            rows, scores = self._search_flat(query, wanted, n)
+
+        results = []
+        for row, score in zip(rows, scores):
+            entry = self._metadata[row]
+            if entry['trackId'] == exclude_id:
+                continue
+            results.append({**entry, 'score': round(float(score), 4)})
+        return results[:k]
+
+    def _search_flat(self, query, k, n):
+        """Exact cosine top-k over the first n rows"""
+        scores = self._vectors[:n] @ query
+        return self._top_k(np.arange(n), scores, k)
+
+    @staticmethod
+    def _top_k(rows, scores, k):
+        if len(scores) > k:
+            part = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[part], scores[part]
+        order = np.argsort(-scores)
+        return rows[order], scores[order]
+
+    def build_ivfpq(self, n_lists=None, n_subvectors=16, n_centroids=256,
+                    iterations=20, max_training_points=100000):
+        """
+        Build (or rebuild) the IVF-PQ structure over all stored vectors
+
+        A coarse k-means splits the catalog into n_lists inverted lists; the
+        residual of each vector to its list centroid is product-quantized into
+        n_subvectors uint8 codes. Vectors added after the build are searched
+        exactly until the next rebuild.
+        """
+        self._sync()
+        n = len(self._metadata)
+        if n == 0:
+            raise ValueError("Cannot build IVF-PQ on an empty index")
+        if self.dim % n_subvectors != 0:
+            raise ValueError(f"dim {self.dim} is not divisible by n_subvectors {n_subvectors}")
+
+        data = np.array(self._vectors[:n])
+        rng = np.random.default_rng(42)
+        sample = data[rng.choice(n, min(n, max_training_points), replace=False)]
+
+        n_lists = n_lists or max(1, int(np.sqrt(n)))
+        print(f"🏗️ Building IVF-PQ index: {n} vectors, {n_lists} lists, {n_subvectors} sub-quantizers")
+        coarse, _ = _kmeans(sample, n_lists, iterations)
+        assignments = np.argmax(data @ coarse.T, axis=1)
+        residuals = data - coarse[assignments]
+
+        sub_dim = self.dim // n_subvectors
+        codebooks = np.zeros((n_subvectors, n_centroids, sub_dim), dtype=np.float32)
+        codes = np.zeros((n, n_subvectors), dtype=np.uint8)
+        sample_residuals = residuals[rng.choice(n, min(n, max_training_points), replace=False)]
+        for j in range(n_subvectors):
+            block = slice(j * sub_dim, (j + 1) * sub_dim)
+            centroids, _ = _kmeans(sample_residuals[:, block], n_centroids, iterations)
+            codebooks[j, :len(centroids)] = centroids
+            distances = (np.sum(residuals[:, block] ** 2, axis=1, keepdims=True)
+                         - 2 * residuals[:, block] @ codebooks[j].T
+                         + np.sum(codebooks[j] ** 2, axis=1))
+            codes[:, j] = np.argmin(distances, axis=1)
+
+        ivfpq = {
+            'coarse': coarse,
+            'codebooks': codebooks,
+            'codes': codes,
+            'assignments': assignments.astype(np.int32),
+            'n_indexed': np.array(n),
+        }
+        # Write then rename, so readers never load a half-written file
+        tmp_path = f"{self._ivfpq_path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, **ivfpq)
+        os.replace(tmp_path, self._ivfpq_path)
+        self._ivfpq, self._ivfpq_mtime = ivfpq, os.stat(self._ivfpq_path).st_mtime_ns
+        print(f"✅ IVF-PQ index saved to {self._ivfpq_path}")
+
+    def _search_ivfpq(self, ivf, query, k, n, nprobe, rerank_factor=4):
+        """Asymmetric-distance IVF-PQ shortlist, re-ranked exactly from the memmap"""
+        n_indexed = int(ivf['n_indexed'])
+        codebooks = ivf['codebooks']
+        n_subvectors, _, sub_dim = codebooks.shape
+
+        # Inner product is additive over the residual decomposition:
+        # q.x ~= q.c + sum_j q_j . codebook_j[code_j]
+        coarse_scores = ivf['coarse'] @ query
+        probe = np.argsort(-coarse_scores)[:nprobe]
+        lut = np.einsum('jcd,jd->jc', codebooks, query.reshape(n_subvectors, sub_dim))
+
+        candidates = np.flatnonzero(np.isin(ivf['assignments'], probe))
+        approx = (coarse_scores[ivf['assignments'][candidates]]
+                  + lut[np.arange(n_subvectors), ivf['codes'][candidates]].sum(axis=1))
+        shortlist, _ = self._top_k(candidates, approx, k * rerank_factor)
+
+        # Rows added since the last build are not quantized yet - scan them exactly
+        rows = np.concatenate([shortlist, np.arange(n_indexed, n)]).astype(np.int64)
+        scores = self._vectors[rows] @ query
+        return self._top_k(rows, scores, k)
+
+
+# Cached index instance
+_index = None
+
+
+def get_similarity_index():
+    """Load and cache the on-disk embedding index"""
+    global _index
+    if _index is None:
+        _index = EmbeddingIndex()
+        print(f"✅ Similarity index loaded ({len(_index)} tracks)")
+    return _index
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Maintain the embedding similarity index')
+    parser.add_argument('--build-ivfpq', action='store_true',
+                        help='(Re)build the IVF-PQ structure for large catalogs')
+    parser.add_argument('--lists', type=int, default=None,
+                        help='Number of IVF lists (default: sqrt of catalog size)')
+    parser.add_argument('--subvectors', type=int, default=16,
+                        help='Number of PQ sub-quantizers')
+
+    args = parser.parse_args()
+
+    index = get_similarity_index()
+    if args.build_ivfpq:
+        index.build_ivfpq(n_lists=args.lists, n_subvectors=args.subvectors)
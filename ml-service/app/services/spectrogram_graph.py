@@ -0,0 +1,104 @@
+"""
+In-graph mel spectrogram preprocessing
+A Keras layer that turns raw 22.05 kHz waveforms into the normalized
+log-mel spectrogram of cnn_classifier.extract_features_for_prediction /
+train_model.extract_features_for_training, so a batch of waveforms goes
+through STFT, mel projection and the CNN in one graph call.
+
+Matches librosa (center=True zero padding, periodic Hann window, Slaney
+mel basis, power_to_db(ref=max, top_db=80), per-clip standardization,
+crop/pad to 1291 frames) to within float32 round-off.
+"""
+
+import numpy as np
+import librosa
+import tensorflow as tf
+from tensorflow import keras
+
+# Must match cnn_classifier / train_model
+SAMPLE_RATE = 22050
+DURATION = 30
+N_SAMPLES = SAMPLE_RATE * DURATION
+N_FFT = 2048
+HOP_LENGTH = 512
+N_MELS = 128
+FMAX = 8000
+TOP_DB = 80.0
+AMIN = 1e-10
+N_FRAMES = int(SAMPLE_RATE / HOP_LENGTH * DURATION)
+
+
+class MelSpectrogram(keras.layers.Layer):
+    """
+    Input: (batch, N_SAMPLES + 1) - each clip zero-padded to N_SAMPLES
+        followed by its real length in samples (cnn_classifier.waveform_input)
+    Output: normalized log-mel spectrograms (batch, N_MELS, N_FRAMES)
+
+    The dB reference, mean and std only use the frames librosa would have
+    produced for the unpadded clip; the remaining frames are zero.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, n_fft=N_FFT, hop_length=HOP_LENGTH,
+                 n_mels=N_MELS, fmax=FMAX, n_frames=N_FRAMES, **kwargs):
+        super().__init__(**kwargs)
+        self.sample_rate = sample_rate
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.n_mels = n_mels
+        self.fmax = fmax
+        self.n_frames = n_frames
+        # librosa's Slaney-normalized basis; tf.signal.linear_to_mel_weight_matrix
+        # builds an unnormalized HTK basis the trained CNN never saw
+        self.mel_basis = tf.constant(
+            librosa.filters.mel(sr=sample_rate, n_fft=n_fft, n_mels=n_mels, fmax=fmax).T,
+            dtype=tf.float32)
+
+    def call(self, inputs):
+        waveforms = inputs[:, :-1]
+        lengths = tf.cast(inputs[:, -1], tf.int32)
+
+        # center=True: n_fft // 2 zeros on both sides
+        padded = tf.pad(waveforms, [[0, 0], [self.n_fft // 2, self.n_fft // 2]])
+        stft = tf.signal.stft(padded, frame_length=self.n_fft, frame_step=self.hop_length,
+                              fft_length=self.n_fft, window_fn=tf.signal.hann_window)
+        power = tf.math.square(tf.abs(stft))
+        mel = tf.transpose(tf.matmul(power, self.mel_basis), [0, 2, 1])
+
+        # Frames librosa computes for the unpadded clip
+        valid = 1 + lengths // self.hop_length
+        mask = tf.sequence_mask(valid, maxlen=tf.shape(mel)[2], dtype=tf.float32)[:, tf.newaxis, :]
+        count = tf.reduce_sum(mask, axis=[1, 2], keepdims=True) * self.n_mels
+
+        # power_to_db(ref=np.max, top_db=80)
+        db = 10.0 * tf.math.log(tf.maximum(mel, AMIN)) / tf.math.log(10.0)
+        ref = tf.reduce_max(tf.where(mask > 0, db, -np.inf), axis=[1, 2], keepdims=True)
+        db = tf.maximum(db - ref, -TOP_DB)
+
+        # Per-clip standardization over the valid frames
+        mean = tf.reduce_sum(db * mask, axis=[1, 2], keepdims=True) / count
+        var = tf.reduce_sum(tf.square(db - mean) * mask, axis=[1, 2], keepdims=True) / count
+        normalized = (db - mean) / tf.sqrt(var) * mask
+
+        return normalized[:, :, :self.n_frames]
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({
+            'sample_rate': self.sample_rate,
+            'n_fft': self.n_fft,
+            'hop_length': self.hop_length,
+            'n_mels': self.n_mels,
+            'fmax': self.fmax,
+            'n_frames': self.n_frames,
+        })
+        return config
+
+
+def build_waveform_model(model):
+    """
+    Wrap a model that takes mel spectrograms so it takes packed waveforms
+    (N_SAMPLES + 1 values per clip) instead; outputs are unchanged
+    """
+    waveforms = keras.Input(shape=(N_SAMPLES + 1,), name='waveform')
+    mel = MelSpectrogram(name='mel_spectrogram')(waveforms)
+    return keras.Model(inputs=waveforms, outputs=model(mel))
@@ -0,0 +1,157 @@
+"""
+Live streaming analysis
+State for the /ws/analyze WebSocket: incoming PCM chunks are resampled
+to 22.05 kHz and framed incrementally, so each chunk only costs the STFT
+and mel projection of its own new frames. Mel frames go into a fixed-size
+ring holding the latest window; every STREAM_UPDATE_SECONDS the CNN
+scores that window. Per-connection memory is bounded by the window
+(128 x 1291 floats), the resampler state and one chunk.
+"""
+
+import os
+import threading
+import numpy as np
+import librosa
+
+STREAM_MAX_CONNECTIONS = int(os.getenv('STREAM_MAX_CONNECTIONS', 8))
+STREAM_UPDATE_SECONDS = float(os.getenv('STREAM_UPDATE_SECONDS', 5))
+# Largest accepted binary message, in seconds of audio
+STREAM_MAX_CHUNK_SECONDS = float(os.getenv('STREAM_MAX_CHUNK_SECONDS', 1))
+
+# Analysis parameters (must match cnn_classifier / training)
+SAMPLE_RATE = 22050
+DURATION = 30
+N_FFT = 2048
+HOP_LENGTH = 512
+N_MELS = 128
+FMAX = 8000
+N_FRAMES = int(SAMPLE_RATE / HOP_LENGTH * DURATION)
+
+SAMPLE_FORMATS = {
+    'f32le': np.dtype('<f4'),
+    's16le': np.dtype('<i2'),
+}
+# Accepted stream formats (the chunk limit scales with rate x channels)
+MAX_STREAM_SAMPLE_RATE = 192000
+MAX_STREAM_CHANNELS = 8
+
+_window = librosa.filters.get_window('hann', N_FFT, fftbins=True).astype(np.float32)
+_mel_basis = librosa.filters.mel(sr=SAMPLE_RATE, n_fft=N_FFT, n_mels=N_MELS, fmax=FMAX)
+
+# Concurrent stream slots
+_active_streams = 0
+_streams_lock = threading.Lock()
+
+
+def acquire_stream():
+    """Reserve a stream slot; False when STREAM_MAX_CONNECTIONS are active"""
+    global _active_streams
+    with _streams_lock:
+        if _active_streams >= STREAM_MAX_CONNECTIONS:
+            return False
+        _active_streams += 1
+        return True
+
+
+def release_stream():
+    global _active_streams
+    with _streams_lock:
+        _active_streams -= 1
+
+
+def active_streams():
+    return _active_streams
+
+
+class IncrementalMel:
+    """
+    Streaming equivalent of librosa.feature.melspectrogram(center=True)
+
+    Samples are buffered only until the frames that need them are
+    computed (at most N_FFT - HOP_LENGTH + one chunk). Mel power frames
+    are kept in a ring of the latest N_FRAMES.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, channels=1, sample_format='f32le'):
+        if not isinstance(sample_format, str) or sample_format not in SAMPLE_FORMATS:
+            raise ValueError(f"Unsupported format {sample_format} (use {', '.join(SAMPLE_FORMATS)})")
+        if not 1 <= sample_rate <= MAX_STREAM_SAMPLE_RATE:
+            raise ValueError(f"sampleRate must be between 1 and {MAX_STREAM_SAMPLE_RATE}")
+        if not 1 <= channels <= MAX_STREAM_CHANNELS:
+            raise ValueError(f"channels must be between 1 and {MAX_STREAM_CHANNELS}")
+        self.channels = channels
+        self.dtype = SAMPLE_FORMATS[sample_format]
+        self.frame_bytes = self.dtype.itemsize * channels
+        self.max_chunk_bytes = int(STREAM_MAX_CHUNK_SECONDS * sample_rate) * self.frame_bytes
+        self.resampler = None
+        if sample_rate != SAMPLE_RATE:
+            import soxr
+            self.resampler = soxr.ResampleStream(sample_rate, SAMPLE_RATE, 1, dtype='float32')
+
+        # center=True: the first frame is centred on sample 0
+        self.pending = np.zeros(N_FFT // 2, dtype=np.float32)
+        self.ring = np.zeros((N_MELS, N_FRAMES), dtype=np.float32)
+        self.frames = 0        # mel frames produced so far
+        self.samples = 0       # samples received (at SAMPLE_RATE)
+
+    @property
+    def seconds(self):
+        return self.samples / SAMPLE_RATE
+
+    def push(self, chunk):
+        """
+        Add raw PCM bytes (interleaved channels)
+
+        Returns:
+            Number of new mel frames
+        """
+        if len(chunk) > self.max_chunk_bytes:
+            raise ValueError(f"Chunk larger than {STREAM_MAX_CHUNK_SECONDS:g} s of audio")
+        if len(chunk) % self.frame_bytes:
+            raise ValueError("Chunk is not a whole number of sample frames")
+
+        y = np.frombuffer(chunk, dtype=self.dtype).reshape(-1, self.channels).mean(axis=1)
+        if self.dtype.kind == 'i':
+            y = y / 32768.0
+        y = y.astype(np.float32)
+        if self.resampler is not None:
+            y = self.resampler.resample_chunk(y)
+        return self._push_samples(y)
+
+    def _push_samples(self, y):
+        self.samples += len(y)
+        buffer = np.concatenate([self.pending, y])
+        if len(buffer) < N_FFT:
+            self.pending = buffer
+            return 0
+
+        frames = np.lib.stride_tricks.sliding_window_view(buffer, N_FFT)[::HOP_LENGTH]
+        n_new = len(frames)
+        power = np.abs(np.fft.rfft(frames * _window, axis=1)) ** 2
+        mel = (_mel_basis @ power.T).astype(np.float32)
+
+        # Keep only the samples the next frame still needs
+        self.pending = buffer[n_new * HOP_LENGTH:]
+
+        # Circular write; the window is only put in order when it is scored
+        columns = (self.frames + np.arange(n_new)[-N_FRAMES:]) % N_FRAMES
+        self.ring[:, columns] = mel[:, -N_FRAMES:]
+        self.frames += n_new
+        return n_new
+
+    def spectrogram(self):
+        """
+        Normalized log-mel spectrogram of the latest window, laid out like
+        cnn_classifier.extract_features_for_prediction (zero-padded at the
+        end until a full window has been received)
+        """
+        n = min(self.frames, N_FRAMES)
+        if self.frames > N_FRAMES:
+            window = np.roll(self.ring, -(self.frames % N_FRAMES), axis=1)
+        else:
+            window = self.ring[:, :n]
+        mel_db = librosa.power_to_db(window, ref=np.max)
+        mel_db = (mel_db - mel_db.mean()) / (mel_db.std() + 1e-8)
+        if n < N_FRAMES:
+            mel_db = np.pad(mel_db, ((0, 0), (0, N_FRAMES - n)), mode='constant')
+        return mel_db
@@ -0,0 +1,206 @@
+"""
+Worker supervisor with graceful recycling
+Runs the uvicorn workers of serve.py on one shared listening socket and
+keeps their number constant:
+
+    - a worker whose memory watchdog reports it past WORKER_MAX_RSS_MB /
+      WORKER_MAX_REQUESTS gets a replacement first; the replacement
+      preloads and warms up the backends the old worker had loaded
+    - once the replacement is ready (taking connections), the old worker
+      is sent SIGTERM: uvicorn stops accepting, finishes its in-flight
+      requests (up to WORKER_DRAIN_SECONDS) and exits
+    - a worker that dies unexpectedly is replaced; if workers keep dying
+      before they are ready (import error, OOM while loading the model),
+      restarts of that slot back off exponentially from
+      WORKER_RESTART_BACKOFF_SECONDS up to WORKER_RESTART_BACKOFF_MAX_SECONDS,
+      and after WORKER_MAX_START_FAILURES in a row the supervisor gives up:
+      it stops recycling a worker whose replacements never start, and
+      exits with status 1 when a slot has no worker left
+
+Only one recycle runs at a time, so memory briefly holds one extra worker;
+leave that much headroom under the container limit.
+"""
+
+import os
+import time
+import signal
+import multiprocessing
+from multiprocessing.connection import wait
+
+WORKER_DRAIN_SECONDS = float(os.getenv('WORKER_DRAIN_SECONDS', 30))
+WORKER_READY_TIMEOUT_SECONDS = float(os.getenv('WORKER_READY_TIMEOUT_SECONDS', 180))
+WORKER_RESTART_BACKOFF_SECONDS = float(os.getenv('WORKER_RESTART_BACKOFF_SECONDS', 1))
+WORKER_RESTART_BACKOFF_MAX_SECONDS = float(os.getenv('WORKER_RESTART_BACKOFF_MAX_SECONDS', 60))
+WORKER_MAX_START_FAILURES = int(os.getenv('WORKER_MAX_START_FAILURES', 5))
+
+
+def _run_worker(app, config_kwargs, sockets, conn, preload):
+    """Worker process: uvicorn on the supervisor's socket, watchdog attached to the pipe"""
+    if preload is not None:
+        os.environ['PRELOAD_BACKENDS'] = ','.join(preload)
+    from app.services import watchdog
+    watchdog.attach(conn)
+
+    import uvicorn
+    uvicorn.Server(uvicorn.Config(app, **config_kwargs)).run(sockets=sockets)
+
+
+class Worker:
+    def __init__(self, process, conn, slot, replaces=None):
+        self.process = process
+        self.conn = conn
+        self.slot = slot                # replacements take over their predecessor's slot
+        self.replaces = replaces        # worker this one is taking over from
+        self.replacement = None         # worker taking over from this one
+        self.state = 'starting'         # starting -> ready -> draining
+        self.started = time.monotonic()
+        self.deadline = None
+
+
+class Supervisor:
+    def __init__(self, app, workers=1, host='0.0.0.0', port=8000, **uvicorn_kwargs):
+        self.app = app
+        self.count = workers
+        self.host = host
+        self.port = port
+        self.config_kwargs = {'host': host, 'port': port,
+                              'timeout_graceful_shutdown': WORKER_DRAIN_SECONDS, **uvicorn_kwargs}
+        self.context = multiprocessing.get_context('spawn')
+        self.workers = []
+        self.sockets = []
+        self.should_exit = False
+        self.exit_code = 0
+        self.start_failures = {}        # slot -> workers in a row that died before ready
+        self.not_before = {}            # slot -> monotonic time of its next allowed start
+        self.pending = {}               # slot -> monotonic time to respawn an empty slot
+
+    def _spawn(self, slot, preload=None, replaces=None):
+        parent, child = self.context.Pipe()
+        process = self.context.Process(target=_run_worker, name='uvicorn-worker',
+                                       args=(self.app, self.config_kwargs, self.sockets, child, preload))
+        process.start()
+        child.close()
+        worker = Worker(process, parent, slot, replaces)
+        self.workers.append(worker)
+        return worker
+
+    def _drain(self, worker):
+        worker.state = 'draining'
+        worker.deadline = time.monotonic() + WORKER_DRAIN_SECONDS + 10
+        try:
+            os.kill(worker.process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def _handle(self, worker, kind, info):
+        if kind == 'ready':
+            worker.state = 'ready'
+            self.start_failures.pop(worker.slot, None)
+            self.not_before.pop(worker.slot, None)
+            print(f"✅ Worker {info['pid']} ready ({info['rssMb']:.0f} MB)")
+            old = worker.replaces
+            worker.replaces = None
+            if old is not None and old.process.is_alive():
+                print(f"♻️ Draining worker {old.process.pid}")
+                self._drain(old)
+        elif kind == 'recycle':
+            # One recycle at a time; repeats while the replacement starts are ignored
+            if worker.state != 'ready' or worker.replacement is not None:
+                return
+            if any(w.state == 'starting' for w in self.workers):
+                return
+            # Backing off (or given up) after replacements that failed to start
+            if self.start_failures.get(worker.slot, 0) >= WORKER_MAX_START_FAILURES:
+                return
+            if time.monotonic() < self.not_before.get(worker.slot, 0):
+                return
+            print(f"♻️ Recycling worker {info['pid']} ({info['reason']}, {info['requests']} requests) - "
+                  f"starting a replacement with {', '.join(info['loaded']) or 'no backends'} preloaded")
+            worker.replacement = self._spawn(worker.slot, preload=info['loaded'], replaces=worker)
+
+    def _start_failed(self, slot):
+        """Count a worker that died before ready and push back the slot's next start"""
+        failures = self.start_failures.get(slot, 0) + 1
+        self.start_failures[slot] = failures
+        delay = min(WORKER_RESTART_BACKOFF_SECONDS * 2 ** (failures - 1), WORKER_RESTART_BACKOFF_MAX_SECONDS)
+        self.not_before[slot] = time.monotonic() + delay
+        return failures
+
+    def _reap(self):
+        now = time.monotonic()
+        for worker in list(self.workers):
+            if not worker.process.is_alive():
+                worker.process.join()
+                worker.conn.close()
+                self.workers.remove(worker)
+                if worker.state == 'draining' or self.should_exit:
+                    print(f"👋 Worker {worker.process.pid} exited")
+                    continue
+                print(f"⚠️ Worker {worker.process.pid} died (exit code {worker.process.exitcode})")
+                failures = self._start_failed(worker.slot) if worker.state == 'starting' else 0
+                gave_up = failures >= WORKER_MAX_START_FAILURES
+                if worker.replaces is not None:
+                    # Replacement failed: the old worker keeps serving and asks again after the backoff
+                    worker.replaces.replacement = None
+                    if gave_up:
+                        print(f"❌ {failures} replacements failed to start - "
+                              f"no longer recycling worker {worker.replaces.process.pid}")
+                elif worker.replacement is not None:
+                    # Its replacement is already on the way
+                    worker.replacement.replaces = None
+                elif gave_up:
+                    print(f"❌ {failures} workers in a row failed to start - shutting down")
+                    self.exit_code = 1
+                    self.should_exit = True
+                else:
+                    self.pending[worker.slot] = self.not_before.get(worker.slot, now)
+                    if failures:
+                        print(f"⏳ Restarting in {self.pending[worker.slot] - now:.0f}s")
+                continue
+
+            if worker.state == 'draining' and now > worker.deadline:
+                print(f"⚠️ Worker {worker.process.pid} did not drain in time - killing it")
+                worker.process.kill()
+            elif worker.state == 'starting' and now - worker.started > WORKER_READY_TIMEOUT_SECONDS:
+                print(f"⚠️ Worker {worker.process.pid} not ready after {WORKER_READY_TIMEOUT_SECONDS:.0f}s - killing it")
+                worker.process.kill()
+
+        for slot, start_at in list(self.pending.items()):
+            if now >= start_at and not self.should_exit:
+                del self.pending[slot]
+                self._spawn(slot)
+
+    def _stop(self, *args):
+        self.should_exit = True
+
+    def run(self):
+        """Supervise until SIGINT/SIGTERM; returns the process exit status"""
+        import uvicorn
+
+        self.sockets = [uvicorn.Config(self.app, host=self.host, port=self.port).bind_socket()]
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+        print(f"🚀 Supervising {self.count} worker(s) on {self.host}:{self.port} (pid {os.getpid()})")
+        for slot in range(self.count):
+            self._spawn(slot)
+
+        while not self.should_exit:
+            conns = {w.conn: w for w in self.workers if not w.conn.closed}
+            for conn in wait(list(conns), timeout=1):
+                try:
+                    kind, info = conn.recv()
+                except (EOFError, OSError):
+                    continue
+                self._handle(conns[conn], kind, info)
+            self._reap()
+
+        # Graceful stop: every worker drains its in-flight requests
+        for worker in self.workers:
+            self._drain(worker)
+        for worker in self.workers:
+            worker.process.join(max(0.0, worker.deadline - time.monotonic()))
+            if worker.process.is_alive():
+                worker.process.kill()
+        for sock in self.sockets:
+            sock.close()
+        return self.exit_code
@@ -0,0 +1,121 @@
+"""
+Worker memory watchdog
+Samples this worker's RSS every WATCHDOG_INTERVAL_SECONDS and counts the
+analysis requests it served. Memory growth is exposed on /metrics
+(worker.rss_mb, request.rss_delta_kb and the growth per request since
+warm-up). Past WORKER_MAX_RSS_MB or WORKER_MAX_REQUESTS the worker asks
+the supervisor (serve.py, app/services/supervisor.py) to recycle it: the
+supervisor starts a pre-warmed replacement first, then the old worker
+stops accepting connections and drains its in-flight requests before
+exiting, so capacity is never lost.
+
+Under plain uvicorn there is no supervisor; thresholds are then only
+reported.
+"""
+
+import os
+import time
+import threading
+from app.services import metrics
+from app.services.backends import rss_mb
+
+WORKER_MAX_RSS_MB = float(os.getenv('WORKER_MAX_RSS_MB', 0))        # 0 = no limit
+WORKER_MAX_REQUESTS = int(os.getenv('WORKER_MAX_REQUESTS', 0))      # 0 = no limit
+WATCHDOG_INTERVAL_SECONDS = float(os.getenv('WATCHDOG_INTERVAL_SECONDS', 5))
+
+# Probes do not count as served requests
+UNCOUNTED_PATHS = ('/health', '/metrics')
+
+_conn = None            # pipe to the supervisor (None under plain uvicorn)
+_lock = threading.Lock()
+_state = {
+    'requests': 0,
+    'baselineRssMb': None,
+    'rssMb': None,
+    'recycleReason': None,
+    'startedAt': time.time(),
+}
+
+
+def attach(conn):
+    """Connect this worker process to its supervisor (before the app starts)"""
+    global _conn
+    _conn = conn
+
+
+def _send(message):
+    if _conn is None:
+        return
+    try:
+        with _lock:
+            _conn.send(message)
+    except (OSError, EOFError):
+        pass
+
+
+def request_finished(path, rss_delta_mb):
+    """Count a served request and record the RSS it added"""
+    if path in UNCOUNTED_PATHS:
+        return
+    with _lock:
+        _state['requests'] += 1
+    metrics.record('request.rss_delta_kb', rss_delta_mb * 1024)
+
+
+def _over_limit(rss):
+    if WORKER_MAX_RSS_MB and rss > WORKER_MAX_RSS_MB:
+        return f"RSS {rss:.0f} MB > {WORKER_MAX_RSS_MB:.0f} MB"
+    if WORKER_MAX_REQUESTS and _state['requests'] >= WORKER_MAX_REQUESTS:
+        return f"{_state['requests']} requests >= {WORKER_MAX_REQUESTS}"
+    return None
+
+
+def _loop():
+    while True:
+        time.sleep(WATCHDOG_INTERVAL_SECONDS)
+        rss = rss_mb()
+        _state['rssMb'] = round(rss, 1)
+        metrics.record('worker.rss_mb', rss)
+
+        reason = _over_limit(rss)
+        if reason is None:
+            continue
+        if _state['recycleReason'] is None:
+            print(f"♻️ Worker {os.getpid()} past its limit ({reason})"
+                  + (" - requesting a recycle" if _conn is not None else " - no supervisor, not recycling"))
+        _state['recycleReason'] = reason
+        # Repeated every interval until the supervisor acts (it ignores duplicates)
+        from app.services import backends
+        _send(('recycle', {'pid': os.getpid(), 'reason': reason, 'rssMb': round(rss, 1),
+                           'requests': _state['requests'], 'loaded': backends.loaded_backends()}))
+
+
+def start():
+    """
+    Start sampling once the worker is warm (models preloaded): the RSS now
+    is the baseline for growth per request, and the supervisor is told the
+    worker is ready to take traffic
+    """
+    rss = rss_mb()
+    _state['baselineRssMb'] = _state['rssMb'] = round(rss, 1)
+    threading.Thread(target=_loop, name='memory-watchdog', daemon=True).start()
+    _send(('ready', {'pid': os.getpid(), 'rssMb': round(rss, 1)}))
+
+
+def stats():
+    """Memory and request counters of this worker"""
+    requests = _state['requests']
+    growth = None
+    if requests and _state['baselineRssMb'] is not None and _state['rssMb'] is not None:
+        growth = round((_state['rssMb'] - _state['baselineRssMb']) * 1024 / requests, 1)
+    return {
+        'pid': os.getpid(),
+        'supervised': _conn is not None,
+        'requests': requests,
+        'rssMb': _state['rssMb'],
+        'baselineRssMb': _state['baselineRssMb'],
+        'growthPerRequestKb': growth,
+        'uptimeSeconds': round(time.time() - _state['startedAt']),
+        'limits': {'rssMb': WORKER_MAX_RSS_MB or None, 'requests': WORKER_MAX_REQUESTS or None},
+        'recycleReason': _state['recycleReason'],
+    }
@@ -7,8 +7,8 @@ and maps outputs to Navarasa emotions
 import numpy as np
 import tensorflow as tf
 import tensorflow_hub as hub
-import librosa
 from typing import Dict
+from app.services.audio_processor import load_audio
 
 # Load YAMNet model (cached after first load)
 _yamnet_model = None
@@ -22,6 +22,9 @@ def get_yamnet_model():
         print("✅ YAMNet model loaded successfully!")
     return _yamnet_model
 
+# Audio features read by the hybrid classifier
+AUDIO_FEATURE_FIELDS = ['tempo', 'rms_mean', 'spectral_centroid_mean', 'zcr_mean']
+
 # Navarasa emotion labels
 EMOTION_LABELS = [
     'shringara', 'hasya', 'karuna', 'raudra', 
@@ -88,8 +91,8 @@ def extract_yamnet_features(audio_path: str) -> tuple:
     """
     try:
         # Load audio
-        print(f"  📊 Loading audio with librosa...")
-        waveform, sr = librosa.load(audio_path, sr=16000, duration=30, mono=True)
+        print(f"  📊 Loading audio...")
+        waveform, sr = load_audio(audio_path, sr=16000, duration=30)
         
         # Convert to float32 and normalize
         waveform = waveform.astype(np.float32)
@@ -107,17 +110,22 @@ def extract_yamnet_features(audio_path: str) -> tuple:
         print(f"  ❌ YAMNet feature extraction failed: {e}")
         raise
 
-def predict_with_yamnet_and_audio_features(audio_path: str) -> Dict:
+def predict_with_yamnet_and_audio_features(audio_path: str, audio_features: Dict = None) -> Dict:
     """
     Hybrid approach: Use YAMNet + traditional audio features
     for accurate emotion prediction
+    
+    Args:
+        audio_path: Path to audio file
+        audio_features: Already extracted audio_processor features to reuse
     """
     from app.services.audio_processor import extract_features
     
     print(f"🎵 Using YAMNet + Audio Features for prediction")
     
     # Get traditional audio features
-    audio_features = extract_features(audio_path)
+    if audio_features is None:
+        audio_features = extract_features(audio_path, fields=AUDIO_FEATURE_FIELDS)
     
     tempo = audio_features['tempo']
     energy = audio_features['rms_mean']
@@ -0,0 +1,393 @@
+"""
+Build the CNN training set straight from the per-rasa Spotify CSVs
+
+Replaces the prepare_spotify_dataset.py -> download_previews.py ->
+train_model.load_dataset chain after the CSVs exist with one pipeline:
+
+    read CSV rows -> fetch previews -> decode + mel spectrogram -> write shards
+      (1 thread)     (--fetchers       (--workers processes,      (main thread)
+                      threads)          audio stays in memory)
+
+The stages are connected by bounded queues, so they all run at once and
+memory stays flat: the build takes as long as its slowest stage rather
+than the sum of all of them. The per-stage busy time printed at the end
+shows which stage that is.
+
+Output is a directory of feature shards plus a checkpoint:
+
+    <output>/part-00000.npz     X (n, 128, 1291) float16 mel spectrograms,
+                                y rasa labels, track_ids
+    <output>/_checkpoint.jsonl  completed shards, their tracks and failures
+
+train_model.py --dataset <output> trains from the shards directly. An
+interrupted build started again with the same arguments resumes after
+the last complete shard. --archive also keeps the downloaded previews in
+the dataset folder layout (<archive>/<rasa>/<track_id>.mp3); archived
+previews are read from there instead of being fetched again.
+
+Previews come from a preview_url column when the CSV has one, otherwise
+from the Spotify Web API (SPOTIFY_CLIENT_ID / SPOTIFY_CLIENT_SECRET, as
+for download_previews.py). SPOTIFY_API_URL and SPOTIFY_TOKEN_URL point
+the builder at another server, e.g. a local stub for testing.
+
+Usage:
+    python build_dataset.py --csv-dir spotify_dataset --output features
+    python build_dataset.py --csv-dir spotify_dataset --output features --archive dataset --fetchers 16
+"""
+
+import os
+import csv
+import json
+import time
+import queue
+import argparse
+import datetime
+import threading
+import multiprocessing
+import email.utils
+import urllib.error
+import urllib.parse
+import urllib.request
+from base64 import b64encode
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from bulk_analyze import Checkpoint
+from app.services.autotune import available_cpus, THREAD_ENV_VARS
+from app.services.prediction_service import EMOTION_LABELS
+
+SPOTIFY_API_URL = os.getenv('SPOTIFY_API_URL', 'https://api.spotify.com/v1')
+SPOTIFY_TOKEN_URL = os.getenv('SPOTIFY_TOKEN_URL', 'https://accounts.spotify.com/api/token')
+FETCH_TIMEOUT_SECONDS = 30
+FETCH_RETRIES = 3
+
+_DONE = object()
+
+
+class StageTimer:
+    """Busy time and item count of one pipeline stage (shared by its threads)"""
+
+    def __init__(self, name):
+        self.name = name
+        self.busy = 0.0
+        self.items = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds, items=1):
+        with self._lock:
+            self.busy += seconds
+            self.items += items
+
+
+def read_rows(csv_dir, emotions=EMOTION_LABELS):
+    """Stream (key, emotion, row) from the <rasa>_songs.csv files, one row at a time"""
+    for emotion in emotions:
+        csv_path = os.path.join(csv_dir, f"{emotion}_songs.csv")
+        if not os.path.exists(csv_path):
+            print(f"⚠️ Warning: {csv_path} not found, skipping...")
+            continue
+        with open(csv_path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                yield f"{emotion}/{row['track_id']}", emotion, row
+
+
+def retry_after_seconds(value, default):
+    """
+    Delay asked for by a Retry-After header: delta-seconds or an HTTP date.
+    Falls back to `default` when the header is missing or malformed.
+    """
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if when.tzinfo is None:
+        # HTTP dates are always GMT
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, when.timestamp() - time.time())
+
+
+class PreviewFetcher:
+    """Downloads preview audio, resolving preview URLs through the Spotify API when needed"""
+
+    def __init__(self, api_url=SPOTIFY_API_URL, token_url=SPOTIFY_TOKEN_URL):
+        self.api_url = api_url.rstrip('/')
+        self.token_url = token_url
+        self._token = None
+        self._lock = threading.Lock()
+
+    def _get(self, url, headers=None):
+        """GET with retries on 429 / 5xx / connection errors"""
+        for attempt in range(FETCH_RETRIES + 1):
+            try:
+                request = urllib.request.Request(url, headers=headers or {})
+                with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT_SECONDS) as response:
+                    return response.read()
+            except urllib.error.HTTPError as e:
+                if e.code == 401 and headers and 'Authorization' in headers:
+                    raise
+                if e.code != 429 and e.code < 500 or attempt == FETCH_RETRIES:
+                    raise
+                delay = retry_after_seconds(e.headers.get('Retry-After'), 2 ** attempt)
+            except urllib.error.URLError:
+                if attempt == FETCH_RETRIES:
+                    raise
+                delay = 2 ** attempt
+            time.sleep(delay)
+
+    def token(self, refresh=False):
+        with self._lock:
+            if self._token is None or refresh:
+                client_id = os.getenv('SPOTIFY_CLIENT_ID')
+                client_secret = os.getenv('SPOTIFY_CLIENT_SECRET')
+                if not client_id or not client_secret:
+                    raise RuntimeError("Set SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET "
+                                       "(or add a preview_url column to the CSVs)")
+                auth = b64encode(f"{client_id}:{client_secret}".encode()).decode()
+                request = urllib.request.Request(
+                    self.token_url,
+                    data=urllib.parse.urlencode({'grant_type': 'client_credentials'}).encode(),
+                    headers={'Authorization': f"Basic {auth}",
+                             'Content-Type': 'application/x-www-form-urlencoded'})
+                with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT_SECONDS) as response:
+                    self._token = json.loads(response.read())['access_token']
+            return self._token
+
+    def preview_url(self, track_id):
+        url = f"{self.api_url}/tracks/{track_id}"
+        try:
+            body = self._get(url, {'Authorization': f"Bearer {self.token()}"})
+        except urllib.error.HTTPError as e:
+            if e.code != 401:
+                raise
+            # Token expired during a long build
+            body = self._get(url, {'Authorization': f"Bearer {self.token(refresh=True)}"})
+        return json.loads(body).get('preview_url')
+
+    def fetch(self, row):
+        """Preview audio bytes of a CSV row, or None when the track has no preview"""
+        url = row.get('preview_url') or self.preview_url(row['track_id'])
+        if not url:
+            return None
+        return self._get(url)
+
+
+def fetch_stage(fetcher, rows, decode_queue, failed, archive, timer):
+    """Fetcher thread: rows -> (key, emotion, audio bytes)"""
+    while True:
+        item = rows.get()
+        if item is _DONE:
+            return
+        key, emotion, row = item
+        start = time.perf_counter()
+        archive_path = os.path.join(archive, emotion, f"{row['track_id']}.mp3") if archive else None
+        try:
+            if archive_path and os.path.exists(archive_path):
+                with open(archive_path, 'rb') as f:
+                    data = f.read()
+            else:
+                data = fetcher.fetch(row)
+                if data is None:
+                    failed.put((key, 'no preview'))
+                    continue
+                if archive_path:
+                    os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+                    with open(archive_path + '.tmp', 'wb') as f:
+                        f.write(data)
+                    os.replace(archive_path + '.tmp', archive_path)
+        except Exception as e:
+            failed.put((key, str(e)))
+            continue
+        finally:
+            timer.add(time.perf_counter() - start)
+        decode_queue.put((key, emotion, data))
+
+
+def spectrogram(key, emotion, data):
+    """Decode preview bytes in memory and compute the training mel spectrogram (worker process)"""
+    from app.services.audio_processor import SAMPLE_RATE, DURATION
+    from app.services.decoder import decode_bytes
+    from app.services.cnn_classifier import extract_features_for_prediction
+
+    start = time.perf_counter()
+    y, _ = decode_bytes(data, sr=SAMPLE_RATE, duration=DURATION, fmt='mp3')
+    mel = extract_features_for_prediction(None, y=y).astype(np.float16)
+    return key, emotion, mel, time.perf_counter() - start
+
+
+def _init_worker():
+    import sys
+    sys.stdout = open(os.devnull, 'w')
+
+
+def write_shard(path, mels, labels, keys):
+    """Write one shard atomically (temporary file + rename)"""
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, X=np.stack(mels), y=np.array(labels), track_ids=np.array(keys))
+    os.replace(tmp, path)
+
+
+def build(csv_dir, output, archive=None, fetchers=8, workers=None, shard_size=256,
+          retry_failed=False, api_url=SPOTIFY_API_URL, token_url=SPOTIFY_TOKEN_URL):
+    os.makedirs(output, exist_ok=True)
+    checkpoint = Checkpoint(output, retry_failed=retry_failed)
+    workers = workers or available_cpus()
+    print(f"📂 {csv_dir} -> {output} ({len(checkpoint.done)} tracks already done)")
+    print(f"🚀 {fetchers} fetchers, {workers} decode workers, shards of {shard_size}")
+
+    # Bounded hand-offs: a fast stage waits for a slow one instead of buffering
+    rows = queue.Queue(maxsize=fetchers * 4)
+    decoded = queue.Queue(maxsize=workers * 2)
+    failed = queue.Queue()
+    results = queue.Queue()
+    in_flight = threading.BoundedSemaphore(workers * 2)
+    timers = {name: StageTimer(name) for name in ('read', 'fetch', 'decode', 'write')}
+    stop = threading.Event()
+
+    def reader():
+        try:
+            start = time.perf_counter()
+            for key, emotion, row in read_rows(csv_dir):
+                if key in checkpoint.done:
+                    continue
+                timers['read'].add(time.perf_counter() - start)
+                while not stop.is_set():
+                    try:
+                        rows.put((key, emotion, row), timeout=1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+                start = time.perf_counter()
+        finally:
+            for _ in range(fetchers):
+                rows.put(_DONE)
+
+    # Split the CPUs between the worker processes (explicit settings win)
+    for name in THREAD_ENV_VARS:
+        os.environ.setdefault(name, str(max(1, available_cpus() // workers)))
+
+    fetcher = PreviewFetcher(api_url, token_url)
+    context = multiprocessing.get_context('spawn')
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker)
+
+    def dispatcher(fetch_threads):
+        # Feeds decoded-queue items to the process pool, at most workers * 2 at a time
+        while True:
+            try:
+                item = decoded.get(timeout=0.5)
+            except queue.Empty:
+                # Fetchers put before they exit, so this is the end of the stream
+                if not any(t.is_alive() for t in fetch_threads) and decoded.empty():
+                    break
+                continue
+            in_flight.acquire()
+            future = pool.submit(spectrogram, *item)
+            future.add_done_callback(lambda f, key=item[0]: results.put((key, f)))
+        results.put(_DONE)
+
+    fetch_threads = [threading.Thread(target=fetch_stage, name=f'fetch-{i}',
+                                      args=(fetcher, rows, decoded, failed, archive, timers['fetch']),
+                                      daemon=True)
+                     for i in range(fetchers)]
+    threads = [threading.Thread(target=reader, name='reader', daemon=True), *fetch_threads]
+    for thread in threads:
+        thread.start()
+    threads.append(threading.Thread(target=dispatcher, args=(fetch_threads,), name='dispatcher', daemon=True))
+    threads[-1].start()
+
+    mels, labels, keys, errors = [], [], [], {}
+    written = 0
+    start = time.perf_counter()
+
+    def drain_failed():
+        while True:
+            try:
+                key, error = failed.get_nowait()
+            except queue.Empty:
+                return
+            errors[key] = error
+            print(f"⚠️ {key}: {error}")
+
+    def flush():
+        nonlocal mels, labels, keys, errors, written
+        drain_failed()
+        if not mels and not errors:
+            return
+        flush_start = time.perf_counter()
+        part = f'part-{checkpoint.next_part:05d}.npz'
+        if mels:
+            write_shard(os.path.join(output, part), mels, labels, keys)
+        checkpoint.commit(part, keys, errors)
+        timers['write'].add(time.perf_counter() - flush_start, len(keys))
+        written += len(keys)
+        elapsed = time.perf_counter() - start
+        print(f"💾 {part}: {written} tracks, {written / elapsed * 60:.0f} tracks/min, "
+              f"{len(checkpoint.failed)} failed")
+        mels, labels, keys, errors = [], [], [], {}
+
+    try:
+        while True:
+            item = results.get()
+            if item is _DONE:
+                break
+            key, future = item
+            in_flight.release()
+            try:
+                key, emotion, mel, seconds = future.result()
+            except Exception as e:
+                errors[key] = str(e)
+                print(f"⚠️ {key}: {e}")
+                continue
+            timers['decode'].add(seconds)
+            mels.append(mel)
+            labels.append(emotion)
+            keys.append(key)
+            if len(mels) + len(errors) >= shard_size:
+                flush()
+    finally:
+        # Keep every finished shard, including on Ctrl+C
+        stop.set()
+        flush()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ {written} tracks in {elapsed:.1f}s ({written / elapsed * 60:.0f} tracks/min), "
+          f"{len(checkpoint.failed)} failed")
+
+    # Utilisation per stage: busy time over the capacity of its threads / processes
+    capacity = {'read': 1, 'fetch': fetchers, 'decode': workers, 'write': 1}
+    print("⏱️ Stage busy time (share of wall time x parallelism):")
+    for name, timer in timers.items():
+        share = timer.busy / (elapsed * capacity[name]) if elapsed else 0.0
+        print(f"   {name:<7} {timer.busy:8.1f}s  {share:6.1%}  ({timer.items} items)")
+    slowest = max(timers, key=lambda n: timers[n].busy / capacity[n])
+    print(f"   Slowest stage: {slowest}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream the Spotify CSVs into CNN feature shards')
+    parser.add_argument('--csv-dir', default='spotify_dataset', help='Folder with the <rasa>_songs.csv files')
+    parser.add_argument('--output', required=True, help='Shard directory')
+    parser.add_argument('--archive', help='Also keep the preview audio here (<rasa>/<track_id>.mp3)')
+    parser.add_argument('--fetchers', type=int, default=8, help='Concurrent downloads')
+    parser.add_argument('--workers', type=int, help='Decode / mel processes (default: available CPUs)')
+    parser.add_argument('--shard-size', type=int, default=256, help='Tracks per shard (and checkpoint interval)')
+    parser.add_argument('--retry-failed', action='store_true', help='Try tracks that failed in earlier runs again')
+    parser.add_argument('--api-url', default=SPOTIFY_API_URL, help='Spotify Web API base URL')
+    parser.add_argument('--token-url', default=SPOTIFY_TOKEN_URL, help='Spotify token endpoint')
+    args = parser.parse_args()
+
+    build(args.csv_dir, args.output, archive=args.archive, fetchers=args.fetchers, workers=args.workers,
+          shard_size=args.shard_size, retry_failed=args.retry_failed,
+          api_url=args.api_url, token_url=args.token_url)
+
+
+if __name__ == "__main__":
+    main()
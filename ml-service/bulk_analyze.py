@@ -0,0 +1,291 @@
+"""
+Offline bulk analysis of the music catalogue
+
+Re-scores a directory tree (or a manifest of paths) without going through
+HTTP /predict: a process pool decodes each track and extracts its features
+and model input, while the main process scores them in batches with one
+vectorized call per batch (one CNN forward pass for the 'cnn' backend).
+
+Results go to Hive-style partitions, one per model version:
+
+    <output>/model_version=<version>/part-00000.parquet
+    <output>/model_version=<version>/_checkpoint.jsonl
+
+with one row per track: path, primary_emotion, confidence, the nine rasa
+scores, tempo / energy / brightness, seconds analysed, model_version and
+analyzed_at. Every part file is recorded in _checkpoint.jsonl once it is
+complete, so an interrupted run started again with the same arguments
+skips what is already written and resumes where it stopped. A new model
+version writes a new partition.
+
+Usage:
+    python bulk_analyze.py --input /data/catalogue --output results
+    python bulk_analyze.py --manifest tracks.txt --output results --format csv --workers 8
+    python bulk_analyze.py --input /data/catalogue --output results --backend summary --retry-failed
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import contextlib
+import multiprocessing
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from app.services import backends
+from app.services.autotune import available_cpus, load_profile, THREAD_ENV_VARS
+from app.services.audio_processor import load_audio, extract_features
+from app.services.prediction_service import EMOTION_LABELS
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.flac', '.ogg', '.m4a')
+CHECKPOINT_FILE = '_checkpoint.jsonl'
+
+
+def list_tracks(input_dir=None, manifest=None):
+    """Audio files under input_dir, or the paths listed in a manifest (text or CSV with a 'path' column)"""
+    if input_dir:
+        tracks = []
+        for root, dirs, files in os.walk(input_dir):
+            dirs.sort()
+            tracks += [os.path.join(root, f) for f in sorted(files) if f.lower().endswith(AUDIO_EXTENSIONS)]
+        return tracks
+
+    base = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest, newline='') as f:
+        if manifest.lower().endswith('.csv'):
+            paths = [row['path'] for row in csv.DictReader(f)]
+        else:
+            paths = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    return [p if os.path.isabs(p) else os.path.join(base, p) for p in paths]
+
+
+class Checkpoint:
+    """Completed part files of one partition and the tracks they cover"""
+
+    def __init__(self, partition_dir, retry_failed=False):
+        self.path = os.path.join(partition_dir, CHECKPOINT_FILE)
+        self.done = set()
+        self.failed = {}
+        parts = set()
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn last line of a crashed run: its part is an orphan
+                        continue
+                    parts.add(entry['part'])
+                    self.done.update(entry['paths'])
+                    self.failed.update(entry['failed'])
+        if retry_failed:
+            self.failed = {}
+        else:
+            self.done.update(self.failed)
+        self.next_part = len(parts)
+
+        # Parts written after the last checkpoint line are redone
+        committed = {p.split('.')[0] for p in parts}
+        for name in os.listdir(partition_dir):
+            if name.startswith('part-') and name.split('.')[0] not in committed:
+                os.remove(os.path.join(partition_dir, name))
+
+    def commit(self, part, paths, failed):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'part': part, 'paths': paths, 'failed': failed}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.update(paths)
+        self.done.update(failed)
+        self.failed.update(failed)
+        self.next_part += 1
+
+
+def write_part(rows, path, fmt):
+    """Write rows atomically (temporary file + rename)"""
+    tmp = path + '.tmp'
+    if fmt == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        pq.write_table(pa.Table.from_pylist(rows), tmp, compression='zstd')
+    else:
+        with open(tmp, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+    os.replace(tmp, path)
+
+
+_backend = None
+
+
+def _init_worker(backend_name, verbose):
+    global _backend
+    _backend = backends.create_backend(backend_name)
+    if not verbose:
+        sys.stdout = open(os.devnull, 'w')
+
+
+def prepare_track(path):
+    """Decode one track and compute its features and model input (worker process)"""
+    start = time.perf_counter()
+    y, sr = load_audio(path)
+    features = extract_features(path, y=y, sr=sr, fields=_backend.feature_fields())
+    return {
+        'path': path,
+        'features': features,
+        'input': _backend.batch_input(path, y),
+        'seconds': round(len(y) / sr, 2),
+        'prepareSeconds': time.perf_counter() - start,
+    }
+
+
+def score_batch(backend, prepared, model_version, verbose=False):
+    """Result rows for a batch of prepared tracks, scored in one call when the backend allows"""
+    with contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, 'w')):
+        if backend.supports_batch:
+            scores = backend.predict_batch([p['input'] for p in prepared], [p['features'] for p in prepared])
+        else:
+            scores = [backend.predict(p['path'], audio_features=p['features'])['emotions'] for p in prepared]
+
+    analyzed_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    rows = []
+    for p, emotions in zip(prepared, scores):
+        primary = max(emotions, key=emotions.get)
+        rows.append({
+            'path': p['path'],
+            'primary_emotion': primary,
+            'confidence': round(float(emotions[primary]), 4),
+            **{e: round(float(emotions.get(e, 0.0)), 4) for e in EMOTION_LABELS},
+            'tempo': float(p['features']['tempo']),
+            'energy': float(p['features']['rms_mean']),
+            'brightness': float(p['features']['spectral_centroid_mean']),
+            'seconds': p['seconds'],
+            'model_version': model_version,
+            'analyzed_at': analyzed_at,
+        })
+    return rows
+
+
+def run(tracks, output, backend_name=None, fmt='parquet', workers=None, batch_size=None,
+        part_size=1000, retry_failed=False, verbose=False):
+    backend_name = backend_name or backends.default_backend()
+    backend = backends.get_backend(backend_name)
+    model_version = backend.model_version()
+
+    partition_dir = os.path.join(output, f'model_version={model_version}')
+    os.makedirs(partition_dir, exist_ok=True)
+    checkpoint = Checkpoint(partition_dir, retry_failed=retry_failed)
+    todo = [t for t in tracks if t not in checkpoint.done]
+    print(f"📂 {len(tracks)} tracks, {len(tracks) - len(todo)} already done -> {partition_dir}")
+    if not todo:
+        return
+
+    workers = workers or available_cpus()
+    batch_size = batch_size or (load_profile() or {}).get('batch_size') or 32
+    print(f"🚀 Scoring {len(todo)} tracks with the {backend_name} backend ({model_version}), "
+          f"{workers} workers, batches of {batch_size}")
+
+    rows, failed, prepared = [], {}, []
+    scored = 0
+    start = time.perf_counter()
+
+    def flush():
+        nonlocal rows, failed
+        if not rows and not failed:
+            return
+        part = f'part-{checkpoint.next_part:05d}.{fmt}'
+        if rows:
+            write_part(rows, os.path.join(partition_dir, part), fmt)
+        checkpoint.commit(part, [r['path'] for r in rows], failed)
+        elapsed = time.perf_counter() - start
+        print(f"💾 {part}: {scored}/{len(todo)} tracks, {scored / elapsed * 60:.0f} tracks/min, "
+              f"{len(checkpoint.failed)} failed")
+        rows, failed = [], {}
+
+    def score_prepared():
+        nonlocal prepared, rows, scored
+        rows += score_batch(backend, prepared, model_version, verbose)
+        scored += len(prepared)
+        prepared = []
+        if len(rows) + len(failed) >= part_size:
+            flush()
+
+    # Split the CPUs between the worker processes instead of each sizing its
+    # math thread pools to the whole machine (explicit settings win)
+    for name in THREAD_ENV_VARS:
+        os.environ.setdefault(name, str(max(1, available_cpus() // workers)))
+
+    # spawn: workers never inherit the loaded model (or TensorFlow's threads)
+    context = multiprocessing.get_context('spawn')
+    pending = iter(todo)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(backend_name, verbose)) as pool:
+            in_flight = {}
+            while True:
+                # Keep the pool busy (bounded, so memory does not grow with the catalogue)
+                while len(in_flight) < workers * 4:
+                    path = next(pending, None)
+                    if path is None:
+                        break
+                    in_flight[pool.submit(prepare_track, path)] = path
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = in_flight.pop(future)
+                    try:
+                        prepared.append(future.result())
+                    except Exception as e:
+                        failed[path] = str(e)
+                        scored += 1
+                        print(f"⚠️ {path}: {e}")
+                if len(prepared) >= batch_size:
+                    score_prepared()
+            if prepared:
+                score_prepared()
+    finally:
+        # Keep everything already scored, including on Ctrl+C
+        flush()
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ {scored} tracks in {elapsed:.1f}s ({scored / elapsed * 60:.0f} tracks/min), "
+          f"{len(checkpoint.failed)} failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk-analyze a music catalogue offline')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input', help='Directory to scan for audio files')
+    source.add_argument('--manifest', help='Text file with one path per line, or CSV with a path column')
+    parser.add_argument('--output', required=True, help='Output directory (partitioned by model version)')
+    parser.add_argument('--format', choices=['parquet', 'csv'], default='parquet', help='Output file format')
+    parser.add_argument('--backend', help='Backend to score with (default: the service default)')
+    parser.add_argument('--workers', type=int, help='Decode / feature processes (default: available CPUs)')
+    parser.add_argument('--batch-size', type=int,
+                        help='Tracks per model call (default: the tuning profile\'s, else 32)')
+    parser.add_argument('--part-size', type=int, default=1000,
+                        help='Tracks per output file (and checkpoint interval)')
+    parser.add_argument('--retry-failed', action='store_true', help='Analyze tracks that failed in earlier runs again')
+    parser.add_argument('--verbose', action='store_true', help='Keep per-track analysis logs')
+    args = parser.parse_args()
+
+    if args.format == 'parquet':
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise SystemExit("❌ Parquet output needs pyarrow (pip install pyarrow) - or use --format csv")
+
+    tracks = list_tracks(args.input, args.manifest)
+    run(tracks, args.output, backend_name=args.backend, fmt=args.format, workers=args.workers,
+        batch_size=args.batch_size, part_size=args.part_size, retry_failed=args.retry_failed,
+        verbose=args.verbose)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""
+Compare prediction backends on accuracy and cost
+
+Runs stratified k-fold cross-validation (or one fixed hold-out split) over
+a labelled dataset for every backend and reports, per backend:
+
+    - accuracy (mean / std over folds) and macro F1
+    - per-rasa precision / recall and the confusion matrix (pooled test folds)
+    - mean / p95 inference latency per clip, from cached inputs
+    - mean / p95 feature extraction time per clip (decode + features + model input)
+    - peak RSS of the process that ran the backend
+
+Decoded features and model inputs are cached per file in --cache-dir, so
+re-running (other backends, fold counts, models) skips the audio work.
+Every (backend, fold) pair runs in its own fresh process, in parallel
+(--jobs); a fresh process per pair keeps the peak-memory figure specific
+to the backend.
+
+Trainable tiers are fitted on each fold's training split ('summary': the
+train_summary_model.py classifier). Pre-trained tiers (cnn, yamnet, rules)
+only score the test split; if the deployed CNN was trained on the same
+dataset its figures are optimistic.
+
+Dataset layout is the same as train_model.py (one folder per rasa).
+
+Usage:
+    python evaluate_backends.py --dataset dataset
+    python evaluate_backends.py --dataset dataset --backends cnn,summary,rules --folds 5 --jobs 4
+    python evaluate_backends.py --dataset dataset --holdout 0.2 --output evaluation.json
+"""
+
+import os
+import json
+import time
+import pickle
+import hashlib
+import argparse
+import resource
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from sklearn.model_selection import StratifiedKFold, train_test_split
+from sklearn.metrics import precision_recall_fscore_support, confusion_matrix
+
+from app.services import backends
+from app.services.prediction_service import EMOTION_LABELS
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.flac', '.ogg', '.m4a')
+
+
+def list_dataset(dataset_path):
+    """[(path, label)] for every audio file of the rasa folders"""
+    items = []
+    for emotion in EMOTION_LABELS:
+        emotion_path = os.path.join(dataset_path, emotion)
+        if not os.path.isdir(emotion_path):
+            print(f"⚠️ Warning: {emotion_path} not found, skipping...")
+            continue
+        files = sorted(f for f in os.listdir(emotion_path) if f.lower().endswith(AUDIO_EXTENSIONS))
+        print(f"  {emotion}: {len(files)} files")
+        items += [(os.path.join(emotion_path, f), emotion) for f in files]
+    return items
+
+
+def cache_key(path):
+    """Changes whenever the file does"""
+    stat = os.stat(path)
+    return hashlib.sha1(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+
+
+def _cache_paths(cache_dir, key, backend_names):
+    return (os.path.join(cache_dir, 'features', key + '.pkl'),
+            {name: os.path.join(cache_dir, 'inputs', name, key + '.npy') for name in backend_names})
+
+
+def prepare_file(path, backend_names, cache_dir):
+    """Decode once, cache all features and each backend's model input; returns the cache key"""
+    from app.services.audio_processor import load_audio, extract_features
+
+    key = cache_key(path)
+    features_path, input_paths = _cache_paths(cache_dir, key, backend_names)
+    missing = [n for n, p in input_paths.items() if not os.path.exists(p)]
+    if os.path.exists(features_path) and not missing:
+        return key
+
+    start = time.perf_counter()
+    y, sr = load_audio(path)
+    features = extract_features(path, y=y, sr=sr)
+    timing = {'features': (time.perf_counter() - start) * 1000}
+    for name in missing:
+        start = time.perf_counter()
+        model_input = backends.create_backend(name).batch_input(path, y)
+        if model_input is not None:
+            os.makedirs(os.path.dirname(input_paths[name]), exist_ok=True)
+            np.save(input_paths[name], model_input)
+        timing[name] = (time.perf_counter() - start) * 1000
+
+    if os.path.exists(features_path):
+        with open(features_path, 'rb') as f:
+            timing = {**pickle.load(f)['timingMs'], **timing}
+    os.makedirs(os.path.dirname(features_path), exist_ok=True)
+    with open(features_path + '.tmp', 'wb') as f:
+        pickle.dump({'features': features, 'timingMs': timing}, f)
+    os.replace(features_path + '.tmp', features_path)
+    return key
+
+
+def _load_cached(cache_dir, key, name):
+    features_path, input_paths = _cache_paths(cache_dir, key, [name])
+    with open(features_path, 'rb') as f:
+        cached = pickle.load(f)
+    model_input = np.load(input_paths[name]) if os.path.exists(input_paths[name]) else None
+    prepare_ms = cached['timingMs']['features'] + cached['timingMs'].get(name, 0.0)
+    return cached['features'], model_input, prepare_ms
+
+
+def _fit_summary(features, labels):
+    """Fold-local summary-feature model, scored through the serving code path"""
+    from app.services.audio_processor import create_feature_vector
+    from app.services.prediction_service import predict_with_model
+    from train_summary_model import build_summary_model
+
+    X = np.stack([create_feature_vector(f) for f in features]).astype(np.float32)
+    model = build_summary_model().fit(X, labels)
+    bundle = {'model': model, 'classes': list(model.classes_), 'n_features': X.shape[1]}
+    return lambda path, f, model_input: predict_with_model(bundle, f)
+
+
+# Backends fitted on each fold's training split instead of loaded
+FOLD_TRAINERS = {
+    'summary': _fit_summary,
+}
+
+
+def evaluate_fold(name, fold, items, train_idx, test_idx, cache_dir):
+    """Score one backend on one test fold (runs in its own process)"""
+    import contextlib
+
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        if name in FOLD_TRAINERS:
+            train = [_load_cached(cache_dir, items[i][2], name)[0] for i in train_idx]
+            score = FOLD_TRAINERS[name](train, [items[i][1] for i in train_idx])
+        else:
+            backend = backends.get_backend(name)
+            if backend.supports_batch:
+                def score(path, f, model_input):
+                    return backend.predict_batch([model_input], [f])[0]
+            else:
+                def score(path, f, model_input):
+                    return backend.predict(path, audio_features=f)['emotions']
+
+        predictions, latencies, prepare = [], [], []
+        for i in test_idx:
+            path, label, key = items[i]
+            features, model_input, prepare_ms = _load_cached(cache_dir, key, name)
+            start = time.perf_counter()
+            emotions = score(path, features, model_input)
+            latencies.append((time.perf_counter() - start) * 1000)
+            prepare.append(prepare_ms)
+            predictions.append(max(emotions, key=emotions.get))
+
+    # ru_maxrss is in KB on Linux
+    return {
+        'backend': name,
+        'fold': fold,
+        'labels': [items[i][1] for i in test_idx],
+        'predictions': predictions,
+        'latenciesMs': latencies,
+        'prepareMs': prepare,
+        'peakRssMb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def summarize(results):
+    """Per-backend report from the fold results"""
+    labels = [l for r in results for l in r['labels']]
+    predictions = [p for r in results for p in r['predictions']]
+    latencies = [ms for r in results for ms in r['latenciesMs']]
+    prepare = [ms for r in results for ms in r['prepareMs']]
+    fold_accuracy = [np.mean(np.array(r['labels']) == np.array(r['predictions'])) for r in results]
+
+    precision, recall, f1, support = precision_recall_fscore_support(
+        labels, predictions, labels=EMOTION_LABELS, zero_division=0)
+    return {
+        'folds': len(results),
+        'accuracy': round(float(np.mean(fold_accuracy)), 4),
+        'accuracyStd': round(float(np.std(fold_accuracy)), 4),
+        'macroF1': round(float(np.mean(f1[support > 0])) if support.any() else 0.0, 4),
+        'perRasa': {
+            e: {'precision': round(float(p), 4), 'recall': round(float(r), 4), 'support': int(s)}
+            for e, p, r, s in zip(EMOTION_LABELS, precision, recall, support)
+        },
+        'confusionMatrix': {
+            'labels': EMOTION_LABELS,
+            'matrix': confusion_matrix(labels, predictions, labels=EMOTION_LABELS).tolist(),
+        },
+        'latencyMs': {'mean': round(float(np.mean(latencies)), 2),
+                      'p95': round(float(np.percentile(latencies, 95)), 2)},
+        'prepareMs': {'mean': round(float(np.mean(prepare)), 1),
+                      'p95': round(float(np.percentile(prepare, 95)), 1)},
+        'peakRssMb': round(max(r['peakRssMb'] for r in results), 1),
+    }
+
+
+def print_report(report):
+    print(f"\n📊 {'backend':<10} {'accuracy':>14} {'macro F1':>8} {'infer ms':>9} {'p95':>8} "
+          f"{'prep ms':>8} {'p95':>8} {'peak RSS':>9}")
+    for name, r in report.items():
+        print(f"   {name:<10} {r['accuracy']:>7.1%} ±{r['accuracyStd']:>5.1%} {r['macroF1']:>8.3f} "
+              f"{r['latencyMs']['mean']:>9.2f} {r['latencyMs']['p95']:>8.2f} "
+              f"{r['prepareMs']['mean']:>8.0f} {r['prepareMs']['p95']:>8.0f} {r['peakRssMb']:>6.0f} MB")
+
+    for name, r in report.items():
+        print(f"\n🎯 {name} - per rasa (precision / recall) and confusion matrix (rows: true)")
+        short = [e[:5] for e in EMOTION_LABELS]
+        print(f"   {'':<10} {'prec':>5} {'rec':>5}   " + ' '.join(f"{s:>5}" for s in short))
+        for e, row in zip(EMOTION_LABELS, r['confusionMatrix']['matrix']):
+            stats = r['perRasa'][e]
+            print(f"   {e:<10} {stats['precision']:>5.2f} {stats['recall']:>5.2f}   "
+                  + ' '.join(f"{v:>5}" for v in row))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cross-validated accuracy vs. cost per backend')
+    parser.add_argument('--dataset', required=True, help='Labelled dataset (one folder per rasa)')
+    parser.add_argument('--backends', help='Comma-separated backends (default: every enabled, usable one)')
+    parser.add_argument('--folds', type=int, default=5, help='Stratified k-fold splits')
+    parser.add_argument('--holdout', type=float, help='Use one stratified hold-out split of this size instead')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='Parallel processes')
+    parser.add_argument('--cache-dir', default='.evaluation_cache', help='Feature / model input cache')
+    parser.add_argument('--seed', type=int, default=42, help='Split seed')
+    parser.add_argument('--output', help='Save the report as JSON')
+    args = parser.parse_args()
+
+    names = ([b.strip() for b in args.backends.split(',') if b.strip()] if args.backends else
+             [b for b in backends.ENABLED_BACKENDS if b in FOLD_TRAINERS or backends.is_available(b)])
+    for name in names:
+        if name not in FOLD_TRAINERS and not backends.is_available(name):
+            raise SystemExit(f"❌ Backend '{name}' is not available")
+
+    print(f"📂 Loading {args.dataset}...")
+    dataset = list_dataset(args.dataset)
+    if not dataset:
+        raise SystemExit("❌ No audio files found")
+
+    # spawn: fresh processes, so per-backend memory is not inherited from this one
+    context = multiprocessing.get_context('spawn')
+    input_backends = [n for n in names if n not in FOLD_TRAINERS]
+    print(f"🎛️ Preparing features for {len(dataset)} clips (cache: {args.cache_dir})...")
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.jobs, mp_context=context) as pool:
+        futures = [pool.submit(prepare_file, path, input_backends, args.cache_dir) for path, _ in dataset]
+        items = []
+        for (path, label), future in zip(dataset, futures):
+            try:
+                items.append((path, label, future.result()))
+            except Exception as e:
+                print(f"Error processing {path}: {e}")
+    print(f"⏱️ Prepared in {time.perf_counter() - start:.1f}s")
+
+    labels = np.array([label for _, label, _ in items])
+    indices = np.arange(len(items))
+    if args.holdout:
+        train_idx, test_idx = train_test_split(indices, test_size=args.holdout,
+                                               random_state=args.seed, stratify=labels)
+        splits = [(train_idx, test_idx)]
+    else:
+        splits = list(StratifiedKFold(n_splits=args.folds, shuffle=True,
+                                      random_state=args.seed).split(indices, labels))
+
+    print(f"🧪 {len(names)} backends x {len(splits)} folds on {args.jobs} processes...")
+    results = {name: [] for name in names}
+    with ProcessPoolExecutor(max_workers=args.jobs, mp_context=context, max_tasks_per_child=1) as pool:
+        futures = [pool.submit(evaluate_fold, name, fold, items, train_idx.tolist(), test_idx.tolist(),
+                               args.cache_dir)
+                   for name in names for fold, (train_idx, test_idx) in enumerate(splits)]
+        for future in futures:
+            r = future.result()
+            results[r['backend']].append(r)
+
+    report = {name: summarize(fold_results) for name, fold_results in results.items()}
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'dataset': args.dataset,
+                'clips': len(items),
+                'split': {'holdout': args.holdout} if args.holdout else {'folds': args.folds},
+                'seed': args.seed,
+                'backends': report,
+            }, f, indent=2)
+        print(f"\n💾 Report saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
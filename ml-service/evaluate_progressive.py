@@ -0,0 +1,132 @@
+"""
+Pick a PROGRESSIVE_MARGIN for progressive (anytime) inference
+
+Runs every clip of a labelled validation set through all prefixes
+(PROGRESSIVE_SEGMENTS) once, then replays the early-exit rule for a sweep
+of margins. For each margin it reports accuracy, agreement with the
+full-clip answer, the share of clips that exited early and the mean
+seconds of audio analysed, and recommends the smallest-cost margin whose
+accuracy stays within --tolerance of the full-clip accuracy.
+
+Dataset layout is the same as train_model.py (one folder per rasa).
+
+Usage:
+    python evaluate_progressive.py --dataset dataset_val
+    python evaluate_progressive.py --dataset dataset_val --segments 5,10,20,30 --output progressive.json
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+
+from app.services.prediction_service import predict_progressive, EMOTION_LABELS, PROGRESSIVE_SEGMENTS
+from app.services.backends import get_backend
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.flac', '.ogg', '.m4a')
+DEFAULT_MARGINS = [0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.4, 0.5]
+
+
+def collect_steps(dataset_path, segments, model):
+    """Per-prefix answers of every clip: [{'label', 'steps'}]"""
+    clips = []
+    for emotion in EMOTION_LABELS:
+        emotion_path = os.path.join(dataset_path, emotion)
+        if not os.path.isdir(emotion_path):
+            print(f"⚠️ Warning: {emotion_path} not found, skipping...")
+            continue
+        files = sorted(f for f in os.listdir(emotion_path) if f.lower().endswith(AUDIO_EXTENSIONS))
+        print(f"  {emotion}: {len(files)} files")
+        for file in files:
+            path = os.path.join(emotion_path, file)
+            try:
+                # An unreachable margin scores every prefix
+                result = predict_progressive(path, model, seconds=segments, margin=float('inf'))
+            except Exception as e:
+                print(f"Error processing {path}: {e}")
+                continue
+            clips.append({
+                'label': emotion,
+                'steps': result['progressive']['steps'],
+            })
+    return clips
+
+
+def replay(clips, margin):
+    """Outcome of the early-exit rule at one margin"""
+    correct = agree = early = 0
+    seconds = []
+    for clip in clips:
+        steps = clip['steps']
+        exit_step = next((s for s in steps if s['margin'] >= margin), steps[-1])
+        correct += exit_step['primaryEmotion'] == clip['label']
+        agree += exit_step['primaryEmotion'] == steps[-1]['primaryEmotion']
+        early += exit_step is not steps[-1]
+        seconds.append(exit_step['seconds'])
+    n = len(clips)
+    return {
+        'margin': margin,
+        'accuracy': round(correct / n, 4),
+        'agreement': round(agree / n, 4),
+        'early_exit_rate': round(early / n, 4),
+        'mean_seconds': round(float(np.mean(seconds)), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate progressive inference margins')
+    parser.add_argument('--dataset', required=True, help='Labelled validation set (one folder per rasa)')
+    parser.add_argument('--segments', default=','.join(f'{s:g}' for s in PROGRESSIVE_SEGMENTS),
+                        help='Comma-separated prefix lengths in seconds')
+    parser.add_argument('--margins', default=','.join(str(m) for m in DEFAULT_MARGINS),
+                        help='Comma-separated margins to evaluate')
+    parser.add_argument('--tolerance', type=float, default=0.005,
+                        help='Largest acceptable accuracy loss vs. the full clip')
+    parser.add_argument('--backend', help='Backend to evaluate (default: the service default)')
+    parser.add_argument('--output', help='Save the report as JSON')
+    args = parser.parse_args()
+
+    segments = [float(s) for s in args.segments.split(',')]
+    margins = [float(m) for m in args.margins.split(',')]
+
+    model = get_backend(args.backend)
+    print(f"📂 Scoring {args.dataset} at {segments} s with the {model.tier} backend...")
+    clips = collect_steps(args.dataset, segments, model)
+    if not clips:
+        raise SystemExit("❌ No clips could be scored")
+
+    full = replay(clips, float('inf'))
+    rows = [replay(clips, m) for m in margins]
+    eligible = [r for r in rows if r['accuracy'] >= full['accuracy'] - args.tolerance]
+    recommended = min(eligible, key=lambda r: r['mean_seconds']) if eligible else None
+
+    print(f"\n📊 {len(clips)} clips - full clip: accuracy {full['accuracy']:.1%}, "
+          f"{full['mean_seconds']:.1f} s analysed on average")
+    print(f"   {'margin':>6}  {'accuracy':>8}  {'agreement':>9}  {'early exit':>10}  {'mean s':>6}")
+    for r in rows:
+        marker = '  ◀' if r is recommended else ''
+        print(f"   {r['margin']:>6.2f}  {r['accuracy']:>8.1%}  {r['agreement']:>9.1%}  "
+              f"{r['early_exit_rate']:>10.1%}  {r['mean_seconds']:>6.1f}{marker}")
+    if recommended:
+        print(f"\n✅ PROGRESSIVE_MARGIN={recommended['margin']:g} analyses "
+              f"{recommended['mean_seconds'] / full['mean_seconds']:.0%} of the audio "
+              f"within {args.tolerance:.1%} accuracy")
+    else:
+        print(f"\n⚠️ No margin stays within {args.tolerance:.1%} accuracy; keep progressive inference off")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'dataset': args.dataset,
+                'backend': model.tier,
+                'segments': segments,
+                'clips': len(clips),
+                'full': full,
+                'margins': rows,
+                'recommended': recommended,
+            }, f, indent=2)
+        print(f"💾 Report saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
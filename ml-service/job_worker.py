@@ -0,0 +1,160 @@
+"""
+Worker process for the asynchronous job API
+
+Pulls jobs from the SQLite-backed queue (app/services/job_queue.py),
+analyses each uploaded file with predict_emotion, reports progress after
+every file and POSTs the finished job to its callback URL.
+
+Usage:
+    python job_worker.py                 # one worker, runs until stopped
+    python job_worker.py --workers 4     # four worker processes
+    python job_worker.py --drain         # exit once the queue is empty
+"""
+
+import os
+import json
+import time
+import signal
+import socket
+import shutil
+import argparse
+import threading
+import multiprocessing
+import urllib.request
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.services.job_queue import JobQueue, JOB_LEASE_SECONDS, JOB_CALLBACK_URL, FAILED, callback_allowed
+
+JOB_POLL_SECONDS = float(os.getenv('JOB_POLL_SECONDS', 2))
+JOB_KEEP_FILES = os.getenv('JOB_KEEP_FILES', 'false').lower() == 'true'
+
+_stopping = threading.Event()
+
+
+def send_callback(url, job, attempts=3):
+    """POST the finished job as JSON; returns a short status string"""
+    body = json.dumps({k: v for k, v in job.items() if k != 'items'} | {
+        'items': [{k: v for k, v in item.items() if k != 'path'} for item in job['items']]
+    }).encode()
+    for attempt in range(attempts):
+        try:
+            request = urllib.request.Request(url, data=body, method='POST',
+                                             headers={'Content-Type': 'application/json'})
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return f'delivered ({response.status})'
+        except Exception as e:
+            error = str(e)
+            time.sleep(2 ** attempt)
+    return f'failed: {error}'
+
+
+def process_job(queue, job, worker_id):
+    """Analyse the pending files of a claimed job; raises if any file fails"""
+    from app.services.prediction_service import predict_emotion
+
+    print(f"📦 [{worker_id}] Job {job['jobId']}: {len(job['items'])} pending of {job['progress']['total']}")
+    lease_renewed = time.time()
+
+    for item in job['items']:
+        if _stopping.is_set():
+            raise InterruptedError("Worker shutting down")
+
+        # Keep the lease alive on long jobs so no other worker steals it
+        if time.time() - lease_renewed > JOB_LEASE_SECONDS / 3:
+            if not queue.heartbeat(job['jobId'], worker_id):
+                raise RuntimeError("Lost job lease")
+            lease_renewed = time.time()
+
+        try:
+            result = predict_emotion(item['path'])
+        except Exception as e:
+            queue.fail_item(job['jobId'], item['index'], str(e))
+            raise
+        queue.complete_item(job['jobId'], item['index'], result)
+        print(f"   ✅ [{worker_id}] {item['filename']}: {result['primaryEmotion']}")
+
+
+def finish_job(queue, job_id):
+    """Send the callback and clean up stored uploads of a finished job"""
+    job = queue.get_job(job_id)
+    url = job['callbackUrl'] or JOB_CALLBACK_URL
+    if url and not callback_allowed(url):
+        # Queued before the allowlist changed; never POST to unlisted hosts
+        print(f"   ⚠️ Callback host of job {job_id} is not allowed - skipping it")
+        queue.set_callback_status(job_id, 'skipped: host not allowed')
+        url = None
+    if url:
+        status = send_callback(url, job)
+        queue.set_callback_status(job_id, status)
+        print(f"   📨 Callback {url}: {status}")
+    if not JOB_KEEP_FILES:
+        shutil.rmtree(os.path.join(queue.storage_dir, job_id), ignore_errors=True)
+
+
+def run_worker(drain=False):
+    """Claim and process jobs until stopped (or until the queue is empty with drain=True)"""
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    queue = JobQueue()
+    signal.signal(signal.SIGTERM, lambda *_: _stopping.set())
+    print(f"👷 Worker {worker_id} polling {queue.db_path}")
+
+    while not _stopping.is_set():
+        job = queue.claim(worker_id)
+        if job is None:
+            if drain:
+                break
+            _stopping.wait(JOB_POLL_SECONDS)
+            continue
+        if job['status'] == FAILED:
+            # Its worker died on the final attempt: report and clean up
+            print(f"❌ [{worker_id}] Job {job['jobId']} failed: {job['error']}")
+            finish_job(queue, job['jobId'])
+            continue
+
+        try:
+            process_job(queue, job, worker_id)
+        except InterruptedError:
+            queue.release(job['jobId'], worker_id)
+            print(f"↩️ [{worker_id}] Released job {job['jobId']}")
+            break
+        except Exception as e:
+            retry = queue.fail(job['jobId'], str(e), worker_id)
+            if retry is None:
+                print(f"⚠️ [{worker_id}] Job {job['jobId']} failed after its lease expired - left to its new owner")
+                continue
+            print(f"❌ [{worker_id}] Job {job['jobId']} failed: {e} ({'will retry' if retry else 'giving up'})")
+            if not retry:
+                finish_job(queue, job['jobId'])
+            continue
+
+        # The lease can expire during one long analysis: another worker owns the job then
+        if not queue.complete(job['jobId'], worker_id):
+            print(f"⚠️ [{worker_id}] Lost the lease on job {job['jobId']} - left to its new owner")
+            continue
+        print(f"🎉 [{worker_id}] Job {job['jobId']} completed")
+        finish_job(queue, job['jobId'])
+
+    print(f"👋 Worker {worker_id} stopped")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Process queued Navarasa analysis jobs')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes')
+    parser.add_argument('--drain', action='store_true',
+                        help='Exit when no runnable job is left')
+
+    args = parser.parse_args()
+
+    if args.workers == 1:
+        run_worker(args.drain)
+    else:
+        processes = [multiprocessing.Process(target=run_worker, args=(args.drain,))
+                     for _ in range(args.workers)]
+        for process in processes:
+            process.start()
+        signal.signal(signal.SIGTERM, lambda *_: [p.terminate() for p in processes])
+        for process in processes:
+            process.join()
@@ -0,0 +1,434 @@
+"""
+Load-testing harness for the Navarasa ML Service
+
+Sends synthetic audio uploads to /predict and reports throughput, latency
+percentiles, error rate and the server-side stage timings returned in the
+Server-Timing header. Results are saved as JSON so runs with different
+worker / pool / batching settings can be compared between releases.
+
+Usage:
+    # Start app.main:app in-process on a free port, 4 concurrent clients for 60 s
+    python loadtest.py --concurrency 4 --duration 60
+
+    # Open-loop Poisson arrivals at 2 req/s against a running server
+    python loadtest.py --url http://localhost:8000 --rate 2 --duration 120
+
+    # Compare two saved runs
+    python loadtest.py --compare loadtest_results/a.json loadtest_results/b.json
+"""
+
+import os
+import io
+import json
+import time
+import wave
+import socket
+import random
+import argparse
+import threading
+import http.client
+from urllib.parse import urlparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+SAMPLE_RATE = 22050
+
+# Settings worth recording next to each run
+RECORDED_ENV = [
+    'INFERENCE_WORKERS', 'INFERENCE_QUEUE_LIMIT', 'DEFAULT_DEADLINE_MS',
+    'SCHEDULER_WORKERS', 'SCHEDULER_CLIENT_CONCURRENCY', 'SCHEDULER_CLIENT_WEIGHTS',
+    'WEB_CONCURRENCY', 'OMP_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS',
+]
+
+
+def synthesize_wav(seconds, seed):
+    """
+    Generate a WAV file with a few random tones, a pulse and noise
+
+    Returns:
+        WAV file contents as bytes
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    y = np.zeros_like(t)
+    for _ in range(rng.integers(2, 6)):
+        y += rng.uniform(0.05, 0.3) * np.sin(2 * np.pi * rng.uniform(80, 2000) * t)
+    bpm = rng.uniform(60, 180)
+    y *= 0.6 + 0.4 * (np.sin(2 * np.pi * bpm / 60 * t) > 0)
+    y += rng.uniform(0.001, 0.05) * rng.standard_normal(len(t))
+    y = np.clip(y / max(np.abs(y).max(), 1e-6), -1, 1)
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes((y * 32767 * 0.8).astype(np.int16).tobytes())
+    return buffer.getvalue()
+
+
+class PayloadMix:
+    """
+    Supplies upload bodies with a configurable mix of clip lengths and a
+    target fraction of exact duplicates of earlier uploads. Duplicates are
+    drawn from a random sample of at most `max_kept` earlier uploads, so a
+    long run does not hold every clip in memory.
+    """
+
+    def __init__(self, sizes, duplicate_rate, seed=0, max_kept=64):
+        self.sizes = sizes
+        self.duplicate_rate = duplicate_rate
+        self.rng = random.Random(seed)
+        self.max_kept = max_kept
+        self.sent = []
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def next(self):
+        with self.lock:
+            if self.sent and self.rng.random() < self.duplicate_rate:
+                return self.rng.choice(self.sent)
+            seconds = self.rng.choice(self.sizes)
+            seed = self.rng.getrandbits(32)
+            name = f"synthetic_{seed}_{seconds}s.wav"
+        payload = (name, synthesize_wav(seconds, seed))
+        with self.lock:
+            # Reservoir sampling: every upload is equally likely to be kept
+            self.count += 1
+            if len(self.sent) < self.max_kept:
+                self.sent.append(payload)
+            else:
+                slot = self.rng.randrange(self.count)
+                if slot < self.max_kept:
+                    self.sent[slot] = payload
+        return payload
+
+
+def encode_multipart(filename, content):
+    """Build a multipart/form-data body with a single 'file' field"""
+    boundary = f"navarasa{random.getrandbits(64):x}"
+    head = (f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f"Content-Type: audio/wav\r\n\r\n").encode()
+    tail = f"\r\n--{boundary}--\r\n".encode()
+    return head + content + tail, f"multipart/form-data; boundary={boundary}"
+
+
+def parse_server_timing(header):
+    """Parse 'decode;dur=12.3, mel;dur=4.5' into {'decode': 12.3, 'mel': 4.5}"""
+    stages = {}
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        if params.startswith('dur='):
+            try:
+                stages[name] = float(params[4:])
+            except ValueError:
+                pass
+    return stages
+
+
+class Client:
+    """One keep-alive HTTP connection per thread"""
+
+    _local = threading.local()
+
+    def __init__(self, base_url, path, headers, timeout):
+        parsed = urlparse(base_url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.path = path
+        self.headers = headers
+        self.timeout = timeout
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def send(self, filename, content):
+        body, content_type = encode_multipart(filename, content)
+        headers = {**self.headers, 'Content-Type': content_type}
+        reused = getattr(self._local, 'conn', None) is not None
+        conn = self._connection()
+        try:
+            conn.request('POST', self.path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            return response.status, response.getheader('Server-Timing')
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            self._local.conn = None
+            if not reused:
+                raise
+            # The server closed an idle keep-alive connection; retry once on a new one
+            return self.send(filename, content)
+        except Exception:
+            conn.close()
+            self._local.conn = None
+            raise
+
+
+def run_closed_loop(client, mix, concurrency, duration, max_requests):
+    """Each of `concurrency` clients sends its next request as soon as the last one finishes"""
+    samples = []
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+    issued = [0]
+
+    def worker():
+        while time.perf_counter() < stop_at:
+            with lock:
+                if max_requests and issued[0] >= max_requests:
+                    return
+                issued[0] += 1
+            filename, content = mix.next()
+            samples.append(timed_request(client, filename, content, time.perf_counter()))
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def run_open_loop(client, mix, rate, duration, max_requests, max_inflight):
+    """
+    Poisson arrivals at `rate` requests/second regardless of response times.
+    Latency is measured from the scheduled arrival, so queueing delay on an
+    overloaded server is not hidden (no coordinated omission).
+    """
+    samples = []
+    rng = random.Random(1)
+    start = time.perf_counter()
+    futures = []
+
+    with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+        scheduled = start
+        count = 0
+        while scheduled - start < duration and (not max_requests or count < max_requests):
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            # Payloads are synthesized in the pool task, so a slow one never holds up later arrivals
+            futures.append(pool.submit(send_next, client, mix, scheduled))
+            count += 1
+            scheduled += rng.expovariate(rate)
+        for future in futures:
+            samples.append(future.result())
+    return samples
+
+
+def send_next(client, mix, scheduled):
+    """Synthesize the next payload and send it, scheduled as of when the payload was ready"""
+    started = time.perf_counter()
+    filename, content = mix.next()
+    # Synthesis is client-side work, not server latency
+    return timed_request(client, filename, content, scheduled + (time.perf_counter() - started))
+
+
+def timed_request(client, filename, content, scheduled):
+    """Send one upload; returns a sample dict with latency, status and stages"""
+    sent = time.perf_counter()
+    try:
+        status, timing = client.send(filename, content)
+        error = None
+    except Exception as e:
+        status, timing, error = None, None, str(e)
+    done = time.perf_counter()
+    return {
+        'latency_ms': (done - scheduled) * 1000,
+        'service_ms': (done - sent) * 1000,
+        'status': status,
+        'error': error,
+        'bytes': len(content),
+        'stages': parse_server_timing(timing),
+        'finished': done,
+    }
+
+
+def summarize(values):
+    if not values:
+        return {'count': 0}
+    values = np.asarray(values, dtype=float)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'count': int(len(values)),
+        'mean': round(float(values.mean()), 2),
+        'p50': round(float(p50), 2),
+        'p95': round(float(p95), 2),
+        'p99': round(float(p99), 2),
+        'max': round(float(values.max()), 2),
+    }
+
+
+def build_report(samples, wall_seconds, config):
+    ok = [s for s in samples if s['status'] is not None and s['status'] < 400]
+    statuses = {}
+    for s in samples:
+        key = str(s['status']) if s['status'] is not None else 'connection_error'
+        statuses[key] = statuses.get(key, 0) + 1
+
+    stage_names = sorted({name for s in ok for name in s['stages']})
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': config,
+        'environment': {key: os.getenv(key) for key in RECORDED_ENV if os.getenv(key)},
+        'requests': len(samples),
+        'wall_seconds': round(wall_seconds, 3),
+        'rps': round(len(ok) / wall_seconds, 3) if wall_seconds else 0,
+        'error_rate': round(1 - len(ok) / len(samples), 4) if samples else 0,
+        'status_counts': statuses,
+        'latency_ms': summarize([s['latency_ms'] for s in ok]),
+        'service_time_ms': summarize([s['service_ms'] for s in ok]),
+        'server_stages_ms': {
+            name: summarize([s['stages'][name] for s in ok if name in s['stages']])
+            for name in stage_names
+        },
+    }
+
+
+def print_report(report):
+    latency = report['latency_ms']
+    print(f"\n📊 {report['requests']} requests in {report['wall_seconds']:.1f}s")
+    print(f"   Throughput: {report['rps']:.2f} req/s")
+    print(f"   Error rate: {report['error_rate']:.2%}  {report['status_counts']}")
+    if latency['count']:
+        print(f"   Latency ms: p50={latency['p50']:.0f}  p95={latency['p95']:.0f}  "
+              f"p99={latency['p99']:.0f}  max={latency['max']:.0f}")
+    if report['server_stages_ms']:
+        print("   Server stages (p50 / p95 ms):")
+        for name, summary in report['server_stages_ms'].items():
+            print(f"     {name:<12} {summary['p50']:>9.1f} / {summary['p95']:.1f}")
+
+
+def compare_reports(paths):
+    """Print the headline numbers of several saved runs side by side"""
+    reports = [json.load(open(p)) for p in paths]
+    rows = [
+        ('rps', lambda r: r['rps']),
+        ('error_rate', lambda r: r['error_rate']),
+        ('p50 ms', lambda r: r['latency_ms'].get('p50')),
+        ('p95 ms', lambda r: r['latency_ms'].get('p95')),
+        ('p99 ms', lambda r: r['latency_ms'].get('p99')),
+    ]
+    stages = sorted({name for r in reports for name in r['server_stages_ms']})
+    for name in stages:
+        rows.append((f'{name} p50', lambda r, n=name: r['server_stages_ms'].get(n, {}).get('p50')))
+
+    print(f"{'':<16}" + ''.join(f"{os.path.basename(p)[:22]:>24}" for p in paths))
+    for label, get in rows:
+        print(f"{label:<16}" + ''.join(f"{str(get(r)):>24}" for r in reports))
+
+
+def start_in_process_server():
+    """Run app.main:app with uvicorn on a free local port in a daemon thread"""
+    import uvicorn
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+
+    config = uvicorn.Config('app.main:app', host='127.0.0.1', port=port, log_level='warning')
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("In-process server failed to start")
+        time.sleep(0.1)
+    print(f"🚀 In-process server listening on 127.0.0.1:{port}")
+    return f"http://127.0.0.1:{port}", server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the Navarasa ML Service')
+    parser.add_argument('--url', type=str, default=None,
+                        help='Base URL of a running service (default: start app.main:app in-process)')
+    parser.add_argument('--path', type=str, default='/predict',
+                        help='Endpoint to exercise')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Closed-loop concurrent clients')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='Open-loop arrival rate in requests/second (overrides --concurrency)')
+    parser.add_argument('--max-inflight', type=int, default=256,
+                        help='Open-loop cap on outstanding requests')
+    parser.add_argument('--duration', type=float, default=60,
+                        help='Test duration in seconds')
+    parser.add_argument('--requests', type=int, default=0,
+                        help='Stop after this many requests (0 = duration only)')
+    parser.add_argument('--sizes', type=str, default='5,15,30',
+                        help='Comma-separated clip lengths in seconds to mix')
+    parser.add_argument('--duplicate-rate', type=float, default=0.2,
+                        help='Fraction of uploads that repeat an earlier file')
+    parser.add_argument('--header', action='append', default=[],
+                        help='Extra request header, e.g. --header "X-Deadline-Ms: 800"')
+    parser.add_argument('--timeout', type=float, default=300,
+                        help='Per-request timeout in seconds')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='Requests sent before measuring (loads models)')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Where to save the JSON report (default: loadtest_results/<timestamp>.json)')
+    parser.add_argument('--compare', nargs='+', default=None,
+                        help='Compare saved JSON reports instead of running a test')
+
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_reports(args.compare)
+        return
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        base_url, server = start_in_process_server()
+
+    headers = dict(h.split(':', 1) for h in args.header)
+    headers = {k.strip(): v.strip() for k, v in headers.items()}
+    client = Client(base_url, args.path, headers, args.timeout)
+    mix = PayloadMix([float(s) for s in args.sizes.split(',')], args.duplicate_rate)
+
+    for i in range(args.warmup):
+        print(f"🔥 Warm-up request {i + 1}/{args.warmup}...")
+        name, content = mix.next()
+        client.send(name, content)
+
+    config = {
+        'url': base_url,
+        'path': args.path,
+        'mode': 'open' if args.rate else 'closed',
+        'concurrency': None if args.rate else args.concurrency,
+        'rate': args.rate,
+        'duration': args.duration,
+        'sizes': args.sizes,
+        'duplicate_rate': args.duplicate_rate,
+        'headers': headers,
+        'in_process': server is not None,
+    }
+    print(f"🎯 Running {config['mode']}-loop test: {json.dumps(config)}")
+
+    start = time.perf_counter()
+    if args.rate:
+        samples = run_open_loop(client, mix, args.rate, args.duration, args.requests, args.max_inflight)
+    else:
+        samples = run_closed_loop(client, mix, args.concurrency, args.duration, args.requests)
+    wall = max((s['finished'] for s in samples), default=start) - start
+
+    report = build_report(samples, wall, config)
+    print_report(report)
+
+    output = args.output or os.path.join(
+        'loadtest_results', datetime.now().strftime('%Y%m%d_%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Report saved to: {output}")
+
+    if server is not None:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
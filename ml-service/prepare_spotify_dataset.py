@@ -322,3 +322,5 @@ if __name__ == "__main__":
     print(f"   2. Get Spotify API credentials")
     print(f"   3. Run download script to get audio files")
     print(f"   4. Train model: python train_model.py --dataset dataset")
+    print(f"   (or steps 3-4 in one pipeline: python build_dataset.py --csv-dir {args.output} --output features")
+    print(f"    then python train_model.py --dataset features)")
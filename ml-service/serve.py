@@ -0,0 +1,34 @@
+"""
+Start the ML service with the tuned runtime profile
+
+Applies the CPU tuning profile (app/services/autotune.py) before anything
+creates a thread pool, then runs the profile's number of uvicorn workers
+under the supervisor (app/services/supervisor.py), which replaces workers
+that outgrow WORKER_MAX_RSS_MB / WORKER_MAX_REQUESTS without dropping
+capacity. Worker processes inherit the thread settings through the
+environment.
+
+Usage:
+    python serve.py
+    python -m app.services.autotune calibrate --audio sample.wav   # create the profile first
+"""
+
+import os
+import sys
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.services.autotune import apply_profile
+
+if __name__ == "__main__":
+    profile = apply_profile()
+    from app.services.supervisor import Supervisor
+
+    workers = int(os.getenv('WEB_CONCURRENCY', 1))
+    if profile:
+        print(f"⚙️ Runtime profile ({profile['source']}): {profile['cpus']} CPUs, "
+              f"{workers} workers x {profile['threads']} threads"
+              + (f", batch {profile['batchSize']}" if profile['batchSize'] else ""))
+    sys.exit(Supervisor("app.main:app", workers=workers, host=os.getenv('HOST', '0.0.0.0'),
+                        port=int(os.getenv('PORT', 8000))).run())
@@ -0,0 +1,84 @@
+"""
+Feed an audio file to the /ws/analyze streaming endpoint
+
+Decodes the file, sends it as 16-bit PCM chunks (in real time by default,
+like a microphone or player would) and prints the rolling estimates.
+
+Usage:
+    python stream_client.py song.wav
+    python stream_client.py song.wav --fast --chunk-ms 250
+    python stream_client.py song.wav --url ws://localhost:8000/ws/analyze
+"""
+
+import json
+import time
+import asyncio
+import argparse
+import numpy as np
+import soundfile as sf
+import websockets
+
+
+async def stream_file(path, url, chunk_ms=100, realtime=True):
+    audio, sample_rate = sf.read(path, dtype='int16', always_2d=True)
+    channels = audio.shape[1]
+    chunk_frames = max(1, int(sample_rate * chunk_ms / 1000))
+    estimates = []
+    sent = 0
+
+    async with websockets.connect(url, max_size=None) as ws:
+        async def receive():
+            try:
+                await handle_messages()
+            except websockets.ConnectionClosedError as e:
+                print(f"🔌 Connection closed by server: {e}")
+
+        async def handle_messages():
+            async for message in ws:
+                event = json.loads(message)
+                if event['type'] == 'estimate':
+                    estimates.append(event)
+                    top = sorted(event['emotions'].items(), key=lambda x: x[1], reverse=True)[:3]
+                    print(f"⏱️ {event['seconds']:6.1f}s  {event['primaryEmotion']:<10} "
+                          f"({event['confidence']:.1%})  " + ', '.join(f"{e} {p:.2f}" for e, p in top))
+                elif event['type'] == 'error':
+                    print(f"❌ {event['detail']}")
+                else:
+                    print(f"🔌 {event}")
+
+        receiver = asyncio.create_task(receive())
+        start = time.perf_counter()
+        try:
+            await ws.send(json.dumps({'sampleRate': sample_rate, 'channels': channels, 'format': 's16le'}))
+            for offset in range(0, len(audio), chunk_frames):
+                chunk = audio[offset:offset + chunk_frames]
+                await ws.send(np.ascontiguousarray(chunk).astype('<i2').tobytes())
+                sent += len(chunk)
+                if realtime:
+                    # Pace sending to the audio clock
+                    delay = (offset + len(chunk)) / sample_rate - (time.perf_counter() - start)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+            await ws.send(json.dumps({'type': 'end'}))
+        except websockets.ConnectionClosed:
+            pass
+        await receiver
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ Streamed {sent / sample_rate:.1f}s of audio in {elapsed:.1f}s, "
+          f"{len(estimates)} estimate(s)")
+    return estimates
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Stream an audio file to /ws/analyze')
+    parser.add_argument('path', help='Audio file (WAV/FLAC/OGG/MP3 via soundfile)')
+    parser.add_argument('--url', default='ws://localhost:8000/ws/analyze',
+                        help='Streaming endpoint')
+    parser.add_argument('--chunk-ms', type=int, default=100,
+                        help='Audio per message in milliseconds')
+    parser.add_argument('--fast', action='store_true',
+                        help='Send as fast as possible instead of in real time')
+
+    args = parser.parse_args()
+    asyncio.run(stream_file(args.path, args.url, args.chunk_ms, realtime=not args.fast))
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+# Tests import the service the way the scripts do (app.services..., bulk_analyze)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SAMPLE_RATE = 22050
+
+
+def synth_clip(seconds=4.0, freq=440.0, seed=0, sr=SAMPLE_RATE):
+    """Tone with a beat-like envelope plus a little noise"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    envelope = 0.6 + 0.4 * (np.sin(2 * np.pi * 2 * t) > 0)
+    y = 0.3 * envelope * np.sin(2 * np.pi * freq * t) + 0.02 * rng.standard_normal(len(t))
+    return y.astype(np.float32)
+
+
+@pytest.fixture
+def wav_file(tmp_path):
+    path = tmp_path / 'clip.wav'
+    sf.write(path, synth_clip(), SAMPLE_RATE)
+    return str(path)
@@ -0,0 +1,123 @@
+import csv
+import io
+import json
+import os
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+import build_dataset
+from conftest import SAMPLE_RATE, synth_clip
+
+
+class SpotifyStub(BaseHTTPRequestHandler):
+    """Token endpoint, /tracks/{id} and preview bytes, with a 429 and a 500 track"""
+
+    hits = None
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.reply(200, json.dumps({'access_token': 'stub-token'}).encode())
+
+    def do_GET(self):
+        self.hits.append(self.path)
+        kind, _, track_id = self.path.strip('/').partition('/')
+        if kind == 'preview':
+            buffer = io.BytesIO()
+            sf.write(buffer, synth_clip(seconds=1.0, seed=len(track_id)), SAMPLE_RATE, format='WAV')
+            return self.reply(200, buffer.getvalue())
+        if self.headers.get('Authorization') != 'Bearer stub-token':
+            return self.reply(401)
+        if track_id == 'broken':
+            return self.reply(500)
+        if track_id == 'busy' and self.hits.count(self.path) == 1:
+            # Retry-After as an HTTP date (already passed, so no wait)
+            return self.reply(429, headers={'Retry-After': formatdate(usegmt=True)})
+        preview = None if track_id == 'silent' else f'http://127.0.0.1:{self.server.server_port}/preview/{track_id}'
+        self.reply(200, json.dumps({'preview_url': preview}).encode())
+
+
+@pytest.fixture
+def stub_server():
+    SpotifyStub.hits = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SpotifyStub)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}', SpotifyStub.hits
+    server.shutdown()
+
+
+def write_csv(path, track_ids):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['track_id'])
+        writer.writeheader()
+        writer.writerows({'track_id': t} for t in track_ids)
+
+
+def test_retry_after_accepts_seconds_and_http_dates():
+    assert build_dataset.retry_after_seconds('3', 1) == 3.0
+    assert build_dataset.retry_after_seconds('Wed, 21 Oct 2015 07:28:00 GMT', 1) == 0.0
+    assert build_dataset.retry_after_seconds(formatdate(build_dataset.time.time() + 60, usegmt=True), 1) > 50
+    assert build_dataset.retry_after_seconds('soon', 4) == 4
+    assert build_dataset.retry_after_seconds(None, 2) == 2
+
+
+def test_build_end_to_end_and_resume(tmp_path, stub_server, monkeypatch):
+    base_url, hits = stub_server
+    monkeypatch.setenv('SPOTIFY_CLIENT_ID', 'id')
+    monkeypatch.setenv('SPOTIFY_CLIENT_SECRET', 'secret')
+    # One retry keeps the always-500 track to a single 1 s backoff
+    monkeypatch.setattr(build_dataset, 'FETCH_RETRIES', 1)
+
+    csv_dir = tmp_path / 'csv'
+    csv_dir.mkdir()
+    emotions = build_dataset.EMOTION_LABELS[:2]
+    write_csv(csv_dir / f'{emotions[0]}_songs.csv', ['a1', 'a2', 'busy', 'broken'])
+    write_csv(csv_dir / f'{emotions[1]}_songs.csv', ['b1', 'silent'])
+    output = str(tmp_path / 'features')
+
+    def run():
+        build_dataset.build(str(csv_dir), output, fetchers=2, workers=1, shard_size=2,
+                            api_url=base_url, token_url=f'{base_url}/token')
+
+    run()
+
+    shards = sorted(name for name in os.listdir(output) if name.endswith('.npz'))
+    track_ids, labels = [], []
+    for name in shards:
+        with np.load(os.path.join(output, name)) as shard:
+            assert shard['X'].shape[1:] == (128, 1291)
+            track_ids.extend(shard['track_ids'].tolist())
+            labels.extend(shard['y'].tolist())
+    assert sorted(track_ids) == sorted([f'{emotions[0]}/a1', f'{emotions[0]}/a2',
+                                        f'{emotions[0]}/busy', f'{emotions[1]}/b1'])
+    assert labels == [key.split('/')[0] for key in track_ids]
+
+    with open(os.path.join(output, '_checkpoint.jsonl')) as f:
+        failed = {}
+        for line in f:
+            failed.update(json.loads(line)['failed'])
+    assert set(failed) == {f'{emotions[0]}/broken', f'{emotions[1]}/silent'}
+    assert failed[f'{emotions[1]}/silent'] == 'no preview'
+    assert hits.count('/tracks/busy') == 2
+
+    # Finished and failed tracks are skipped on the next run
+    hits.clear()
+    run()
+    assert hits == []
+    assert sorted(name for name in os.listdir(output) if name.endswith('.npz')) == shards
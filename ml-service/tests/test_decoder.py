@@ -0,0 +1,64 @@
+import io
+import shutil
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from app.services import metrics
+from app.services.decoder import decode, decode_bytes, iter_decode, metric_format, slice_prefixes
+from conftest import SAMPLE_RATE, synth_clip
+
+
+def decode_metrics():
+    return {name for name in metrics.snapshot() if name.startswith('decode.')}
+
+
+def test_metric_format_is_bounded():
+    assert metric_format('.FLAC') == 'flac'
+    assert metric_format('mp3') == 'mp3'
+    assert metric_format('.x' * 50) == 'other'
+    assert metric_format('') == 'other'
+
+
+def test_client_extensions_do_not_become_metric_names(wav_file, tmp_path):
+    odd = tmp_path / 'clip.a1b2c3d4'
+    shutil.copyfile(wav_file, odd)
+    y, sr = decode(str(odd), sr=SAMPLE_RATE)
+    assert sr == SAMPLE_RATE and len(y)
+
+    buffer = io.BytesIO()
+    sf.write(buffer, synth_clip(seconds=0.5), SAMPLE_RATE, format='WAV')
+    decode_bytes(buffer.getvalue(), sr=SAMPLE_RATE, fmt='../../whatever')
+
+    names = decode_metrics()
+    assert not any('a1b2c3d4' in name or 'whatever' in name for name in names)
+    assert any(name.startswith('decode.other.') for name in names)
+
+
+def write_clip(path, seconds, sr):
+    sf.write(path, synth_clip(seconds=seconds, sr=sr), sr)
+    return str(path)
+
+
+def prefix_seconds(segments, sr=SAMPLE_RATE):
+    return [round(len(y) / sr, 2) for y in segments]
+
+
+@pytest.mark.parametrize('clip_seconds, expected', [
+    (10.0, [5.0, 10.0]),            # ends exactly on a boundary
+    (12.0, [5.0, 10.0, 12.0]),      # ends between boundaries
+    (3.0, [3.0]),                   # shorter than the first boundary
+    (30.0, [5.0, 10.0, 20.0, 30.0]),
+])
+@pytest.mark.parametrize('native_sr', [SAMPLE_RATE, 44100])
+def test_iter_decode_yields_each_prefix_once(tmp_path, clip_seconds, expected, native_sr):
+    path = write_clip(tmp_path / 'clip.wav', clip_seconds, native_sr)
+    assert prefix_seconds(iter_decode(path, SAMPLE_RATE, [5, 10, 20, 30])) == expected
+
+
+def test_slice_prefixes_stops_at_the_end_of_the_clip():
+    y = np.zeros(10 * SAMPLE_RATE, dtype=np.float32)
+    assert prefix_seconds(slice_prefixes(y, SAMPLE_RATE, [5, 10, 20, 30])) == [5.0, 10.0]
+    assert prefix_seconds(slice_prefixes(y[:7 * SAMPLE_RATE], SAMPLE_RATE, [5, 10, 20])) == [5.0, 7.0]
+    assert prefix_seconds(slice_prefixes(y[:0], SAMPLE_RATE, [5, 10])) == [0.0]
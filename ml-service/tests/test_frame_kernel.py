@@ -0,0 +1,64 @@
+import librosa
+import numpy as np
+import pytest
+
+from app.services import frame_kernel
+from app.services.frame_kernel import frame_features, frame_signal, stft_magnitude
+from conftest import SAMPLE_RATE, synth_clip
+
+# float32 framing/FFT against librosa's float32 STFT
+RTOL = 1e-4
+
+
+def librosa_reference(y, sr):
+    kwargs = {'n_fft': frame_kernel.N_FFT, 'hop_length': frame_kernel.HOP_LENGTH}
+    S = np.abs(librosa.stft(y, **kwargs))
+    chroma = librosa.feature.chroma_stft(S=S ** 2, sr=sr)
+    return {
+        'rms': librosa.feature.rms(y=y, frame_length=frame_kernel.N_FFT, hop_length=frame_kernel.HOP_LENGTH),
+        'zcr': librosa.feature.zero_crossing_rate(y, frame_length=frame_kernel.N_FFT,
+                                                  hop_length=frame_kernel.HOP_LENGTH),
+        'spectral_centroid': librosa.feature.spectral_centroid(S=S, sr=sr),
+        'spectral_rolloff': librosa.feature.spectral_rolloff(S=S, sr=sr, roll_percent=frame_kernel.ROLL_PERCENT),
+        'chroma': (chroma.mean(axis=1), chroma.std(axis=1)),
+    }
+
+
+@pytest.fixture(params=['numpy', 'numba'])
+def kernel_path(request, monkeypatch):
+    if request.param == 'numba' and frame_kernel._frame_stats_numba is None:
+        pytest.skip('numba is not installed')
+    monkeypatch.setattr(frame_kernel, 'FRAME_KERNEL_NUMBA', request.param == 'numba')
+    return request.param
+
+
+def test_frame_features_match_librosa(kernel_path):
+    y = synth_clip(seconds=3.0, seed=1)
+    # Start and end mid-swing so the padding at both ends matters
+    y = y[100:-77] - 0.05
+    frames = frame_signal(y)
+    features = frame_features(frames, stft_magnitude(frames), sr=SAMPLE_RATE)
+    expected = librosa_reference(y, SAMPLE_RATE)
+
+    for name in ('rms', 'spectral_centroid', 'spectral_rolloff'):
+        values = expected[name][0]
+        assert features[name] == pytest.approx((values.mean(), values.std()), rel=RTOL), name
+
+    # librosa pads zcr frames with edge values, the kernel with zeros: each of
+    # the (at most 2 + 2) frames overlapping the padding can differ by one
+    # crossing (1 / N_FFT), which bounds the change of the mean by 4 / N_FFT / n
+    # and of the std by sqrt(4) / N_FFT / sqrt(n)
+    zcr = expected['zcr'][0]
+    step = 1 / frame_kernel.N_FFT
+    assert features['zcr'][0] == pytest.approx(zcr.mean(), abs=4 * step / len(zcr))
+    assert features['zcr'][1] == pytest.approx(zcr.std(), abs=2 * step / np.sqrt(len(zcr)))
+
+    means, stds = features['chroma']
+    assert np.allclose(means, expected['chroma'][0], rtol=RTOL, atol=1e-6)
+    assert np.allclose(stds, expected['chroma'][1], rtol=RTOL, atol=1e-6)
+
+
+def test_time_domain_only(kernel_path):
+    frames = frame_signal(synth_clip(seconds=1.0))
+    features = frame_features(frames, sr=SAMPLE_RATE)
+    assert set(features) == {'rms', 'zcr'}
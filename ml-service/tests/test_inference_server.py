@@ -0,0 +1,117 @@
+import threading
+import time
+import uuid
+from collections import deque
+from multiprocessing import Pipe, shared_memory
+from multiprocessing.connection import Listener
+
+import numpy as np
+import pytest
+
+from app.services import inference_server
+from app.services.inference_server import InferenceClientPool, InferenceServer
+
+AUTHKEY = b'test-secret'
+INPUT_SHAPE = (4,)
+
+
+class FakeModel:
+    """Embedding = the input, probabilities = its softmax; slow enough for calls to overlap"""
+
+    def __init__(self):
+        self.batches = []
+
+    def predict(self, inputs, verbose=0):
+        self.batches.append(len(inputs))
+        time.sleep(0.05)
+        exp = np.exp(inputs)
+        return inputs, exp / exp.sum(axis=1, keepdims=True)
+
+
+def fake_server(slots):
+    """InferenceServer wired to FakeModel instead of loading the CNN"""
+    server = InferenceServer.__new__(InferenceServer)
+    server.preprocessing = 'librosa'
+    server.model = FakeModel()
+    server.input_shape = INPUT_SHAPE
+    server.input_size = 4
+    server.slot_size = server.input_size + inference_server.OUTPUT_SIZE
+    server.classes = ['a', 'b', 'c', 'd']
+    server.embedding_dim = 4
+    server.shm = shared_memory.SharedMemory(name=f'navarasa_test_{uuid.uuid4().hex[:8]}', create=True,
+                                            size=slots * server.slot_size * 4)
+    server.buffer = np.ndarray((slots, server.slot_size), dtype=np.float32, buffer=server.shm.buf)
+    server.listener = Listener(('127.0.0.1', 0), authkey=AUTHKEY)
+    server.address = server.listener.address
+    server.free_slots = deque(range(slots))
+    server.clients = {}
+    server.lock = threading.Lock()
+    server.wake_reader, server.wake_writer = Pipe(duplex=False)
+    server.running = True
+    return server
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(inference_server, 'INFERENCE_SERVER_AUTHKEY', AUTHKEY)
+    server = fake_server(slots=3)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.close()
+
+
+def test_pool_runs_concurrent_requests_on_separate_slots(server):
+    host, port = server.address
+    pool = InferenceClientPool(f'{host}:{port}', size=3)
+    inputs = np.random.default_rng(0).normal(size=(6, 4)).astype(np.float32)
+    results = [None] * len(inputs)
+
+    def call(i):
+        results[i] = pool.predict(inputs[i])
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(inputs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert pool.open == 3
+    assert max(server.model.batches) > 1
+    for x, (probabilities, embedding) in zip(inputs, results):
+        assert np.allclose(embedding, x)
+        assert probabilities.argmax() == x.argmax()
+    pool.close()
+
+
+def test_pool_settles_for_fewer_connections_when_server_is_full(server):
+    host, port = server.address
+    pool = InferenceClientPool(f'{host}:{port}', size=5)
+    threads = [threading.Thread(target=pool.predict, args=(np.zeros(4, dtype=np.float32),)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert pool.open == pool.size == 3
+    pool.close()
+
+
+def test_server_and_client_require_an_authkey(monkeypatch):
+    monkeypatch.setattr(inference_server, 'INFERENCE_SERVER_AUTHKEY', b'')
+    with pytest.raises(RuntimeError, match='INFERENCE_SERVER_AUTHKEY'):
+        InferenceServer()
+    with pytest.raises(RuntimeError, match='INFERENCE_SERVER_AUTHKEY'):
+        inference_server.InferenceClient()
+
+
+def test_new_connection_is_served_without_waiting_for_the_poll_timeout(server):
+    host, port = server.address
+    # An idle connection keeps serve_forever waiting on the existing set
+    pool = InferenceClientPool(f'{host}:{port}', size=1)
+    time.sleep(0.1)
+    client = inference_server.InferenceClient(f'{host}:{port}')
+    start = time.perf_counter()
+    client.predict(np.zeros(4, dtype=np.float32))
+    # The fake model takes 50 ms; the old loop could add up to 500 ms
+    assert time.perf_counter() - start < 0.3
+    client.close()
+    pool.close()
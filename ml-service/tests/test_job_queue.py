@@ -0,0 +1,174 @@
+import os
+import time
+
+import pytest
+
+from app.services.job_queue import JobQueue, QUEUED, RUNNING, COMPLETED, FAILED
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(db_path=str(tmp_path / 'jobs.db'), storage_dir=str(tmp_path / 'uploads'))
+
+
+def expire_lease(queue, job_id):
+    with queue._transaction() as conn:
+        conn.execute('UPDATE jobs SET lease_until = ? WHERE id = ?', (time.time() - 1, job_id))
+
+
+def status(queue, job_id):
+    return queue.get_job(job_id)['status']
+
+
+def test_claim_complete(queue):
+    job_id = queue.create_job([('a.wav', b'a'), ('b.wav', b'b')])
+    job = queue.claim('w1')
+    assert job['jobId'] == job_id and job['status'] == RUNNING
+    assert [i['filename'] for i in job['items']] == ['a.wav', 'b.wav']
+
+    queue.complete_item(job_id, 0, {'primaryEmotion': 'hasya'})
+    assert [i['index'] for i in queue.get_job(job_id, pending_only=True)['items']] == [1]
+    assert queue.complete(job_id, 'w1') is True
+    assert status(queue, job_id) == COMPLETED
+    assert queue.claim('w2') is None
+
+
+def test_priority_order(queue):
+    low = queue.create_job([('a.wav', b'a')], priority=0)
+    high = queue.create_job([('b.wav', b'b')], priority=5)
+    assert queue.claim('w1')['jobId'] == high
+    assert queue.claim('w2')['jobId'] == low
+
+
+def test_expired_lease_is_reclaimed_and_old_owner_cannot_finish(queue):
+    job_id = queue.create_job([('a.wav', b'a')])
+    queue.claim('w1')
+    expire_lease(queue, job_id)
+
+    job = queue.claim('w2')
+    assert job['jobId'] == job_id and job['attempts'] == 2
+
+    # The first worker comes back from a long analysis
+    assert queue.heartbeat(job_id, 'w1') is False
+    assert queue.complete(job_id, 'w1') is False
+    assert queue.fail(job_id, 'boom', 'w1') is None
+    job = queue.get_job(job_id)
+    assert job['status'] == RUNNING and job['error'] is None
+
+    assert queue.heartbeat(job_id, 'w2') is True
+    assert queue.complete(job_id, 'w2') is True
+    assert status(queue, job_id) == COMPLETED
+
+
+def test_fail_backs_off_then_gives_up(queue):
+    job_id = queue.create_job([('a.wav', b'a')], max_attempts=2)
+    queue.claim('w1')
+    assert queue.fail(job_id, 'first', 'w1') is True
+    assert status(queue, job_id) == QUEUED
+    # Not runnable until the backoff has passed
+    assert queue.claim('w1') is None
+
+    with queue._transaction() as conn:
+        conn.execute('UPDATE jobs SET next_attempt_at = 0 WHERE id = ?', (job_id,))
+    queue.claim('w1')
+    assert queue.fail(job_id, 'second', 'w1') is False
+    job = queue.get_job(job_id)
+    assert job['status'] == FAILED and job['error'] == 'second'
+
+
+def test_release_does_not_count_the_attempt(queue):
+    job_id = queue.create_job([('a.wav', b'a')])
+    queue.claim('w1')
+    queue.release(job_id, 'w2')     # not the owner: ignored
+    assert status(queue, job_id) == RUNNING
+    queue.release(job_id, 'w1')
+    assert queue.claim('w2')['attempts'] == 1
+
+
+def test_lease_expired_on_final_attempt_is_returned_failed(queue):
+    job_id = queue.create_job([('a.wav', b'a')], max_attempts=1)
+    queue.claim('w1')
+    expire_lease(queue, job_id)
+
+    job = queue.claim('w2')
+    assert job['jobId'] == job_id
+    assert job['status'] == FAILED
+    assert 'w1' in job['error']
+    assert queue.claim('w2') is None
+
+
+def test_worker_cleans_up_job_failed_by_lease_expiry(queue, monkeypatch):
+    import job_worker
+
+    job_id = queue.create_job([('a.wav', b'a')], max_attempts=1)
+    queue.claim('dead-worker')
+    expire_lease(queue, job_id)
+    assert os.path.isdir(os.path.join(queue.storage_dir, job_id))
+
+    monkeypatch.setattr(job_worker, 'JobQueue', lambda: queue)
+    monkeypatch.setattr(job_worker, 'JOB_KEEP_FILES', False)
+    monkeypatch.setattr(job_worker.signal, 'signal', lambda *args: None)
+    job_worker.run_worker(drain=True)
+
+    assert status(queue, job_id) == FAILED
+    assert not os.path.exists(os.path.join(queue.storage_dir, job_id))
+
+
+@pytest.fixture
+def api(queue, monkeypatch):
+    from fastapi.testclient import TestClient
+    from app import main
+    from app.services import job_queue
+
+    monkeypatch.setattr(main, 'get_job_queue', lambda: queue)
+    monkeypatch.setattr(main, 'ADMIN_TOKEN', 'admin-secret')
+    monkeypatch.setattr(job_queue, 'JOB_CALLBACK_HOSTS', 'hooks.example.com')
+    return TestClient(main.app)
+
+
+def post_job(api, files=1, headers=None, size=4, **form):
+    uploads = [('files', (f'{i}.wav', b'x' * size, 'audio/wav')) for i in range(files)]
+    return api.post('/jobs', files=uploads, data=form, headers=headers or {})
+
+
+def test_callback_urls_limited_to_allowed_hosts(api, queue):
+    for url in ['http://169.254.169.254/latest/meta-data', 'http://localhost:8000/admin',
+                'https://hooks.example.com.evil.net/x', 'ftp://hooks.example.com/x']:
+        assert post_job(api, callback_url=url).status_code == 400, url
+
+    response = post_job(api, callback_url='https://hooks.example.com/done')
+    assert response.status_code == 202
+    job_id = response.json()['jobId']
+    assert queue.get_job(job_id)['callbackUrl'] == 'https://hooks.example.com/done'
+    assert 'callbackUrl' not in api.get(f'/jobs/{job_id}').json()
+
+
+def test_priority_clamped_and_raising_needs_admin(api, queue, monkeypatch):
+    from app import main
+    monkeypatch.setattr(main, 'JOB_MAX_PRIORITY', 5)
+    assert post_job(api, priority=100).status_code == 403
+
+    low = post_job(api, priority=-100).json()['jobId']
+    high = post_job(api, priority=100, headers={'X-Admin-Token': 'admin-secret'}).json()['jobId']
+    assert queue.get_job(low)['priority'] == -5
+    assert queue.get_job(high)['priority'] == 5
+
+
+def test_upload_count_and_size_capped(api, monkeypatch):
+    from app import main
+    monkeypatch.setattr(main, 'JOB_MAX_FILES', 2)
+    monkeypatch.setattr(main, 'JOB_MAX_UPLOAD_MB', 1)
+    assert post_job(api, files=3).status_code == 413
+    assert post_job(api, files=2, size=600 * 1024).status_code == 413
+    assert post_job(api, files=2, size=400 * 1024).status_code == 202
+
+
+def test_worker_skips_callbacks_to_unlisted_hosts(queue, monkeypatch):
+    import job_worker
+
+    sent = []
+    monkeypatch.setattr(job_worker, 'send_callback', lambda url, job: sent.append(url) or 'delivered')
+    job_id = queue.create_job([('a.wav', b'a')], callback_url='http://10.0.0.1/hook')
+    job_worker.finish_job(queue, job_id)
+    assert sent == []
+    assert queue.get_job(job_id)['callbackStatus'].startswith('skipped')
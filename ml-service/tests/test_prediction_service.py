@@ -0,0 +1,49 @@
+import time
+
+from app.services import prediction_service
+from app.services.audio_processor import FEATURE_FIELDS, create_feature_vector
+from app.services.backends import Backend
+
+
+class AllFieldsBackend(Backend):
+    """Stands in for the summary model: needs every feature field"""
+    tier = 'all_fields'
+    accepts_waveform = True
+
+    def __init__(self):
+        self.seen = None
+
+    def feature_fields(self):
+        return None
+
+    def predict(self, audio_path, return_embedding=False, y=None, audio_features=None, summary=True):
+        self.seen = audio_features
+        create_feature_vector(audio_features)   # raises KeyError on a partial dict
+        return prediction_service.predict_with_rules(audio_features)
+
+
+def test_model_fields_merges_extra_fields():
+    class Three(Backend):
+        pass
+
+    assert prediction_service.model_fields(AllFieldsBackend()) is None
+    fields = prediction_service.model_fields(Three(), prediction_service.RULE_BASED_FIELDS)
+    assert fields[:len(prediction_service.RULE_BASED_FIELDS)] == prediction_service.RULE_BASED_FIELDS
+    assert set(Three().feature_fields()) <= set(fields)
+
+
+def test_deadline_path_passes_all_fields_to_full_feature_backend(wav_file):
+    backend = AllFieldsBackend()
+    result = prediction_service.predict_within_deadline(wav_file, time.perf_counter() + 60, backend)
+    assert result['tier'] == 'all_fields'
+    assert result['degraded'] is False
+    assert set(backend.seen) == set(FEATURE_FIELDS)
+
+
+def test_shared_decode_path_passes_all_fields(wav_file):
+    from app.services.audio_processor import load_audio, LazyFeatures
+
+    y, sr = load_audio(wav_file)
+    backend = AllFieldsBackend()
+    prediction_service.run_prediction(wav_file, backend, y=y, lazy=LazyFeatures(y, sr))
+    assert set(backend.seen) == set(FEATURE_FIELDS)
@@ -0,0 +1,61 @@
+import contextvars
+import pstats
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services import profiling
+from app.services.scheduler import FairScheduler
+
+
+def scheduled_work():
+    return sum(i * i for i in range(10000))
+
+
+def pooled_work():
+    return sorted(range(1000), reverse=True)[0]
+
+
+def profiled_functions(path):
+    return {name for _, _, name in pstats.Stats(path).stats}
+
+
+def test_cprofile_mode_includes_work_on_other_threads(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+    fair = FairScheduler(workers=1)
+    pool = ThreadPoolExecutor(max_workers=1)
+
+    def run():
+        # Same hand-off as predict_within_deadline's inference pool
+        context = contextvars.copy_context()
+        pool.submit(context.run, profiling.in_request_profile, pooled_work).result()
+        return scheduled_work()
+
+    with profiling.RequestProfile('req-1', mode='cprofile') as profile:
+        fair.submit('a', lambda: profiling.in_request_profile(run)).result(timeout=5)
+
+    assert {'run', 'scheduled_work', 'pooled_work'} <= profiled_functions(profile.path)
+
+
+def test_work_outside_a_profiled_request_is_not_profiled():
+    assert profiling.in_request_profile(scheduled_work) == scheduled_work()
+    assert profiling._current_profile.get() is None
+
+
+def test_reused_request_id_does_not_overwrite_a_stored_profile(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+    from app import main
+
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(profiling, 'PROFILE_TOKEN', 'profile-secret')
+    monkeypatch.setattr(main, 'ADMIN_TOKEN', 'admin-secret')
+    api = TestClient(main.app)
+    headers = {'X-Request-ID': 'req-1', 'X-Profile': 'profile-secret'}
+
+    first = api.get('/', headers=headers).headers['X-Profile-Id']
+    second = api.get('/', headers=headers).headers['X-Profile-Id']
+
+    assert first != second and first.startswith('req-1.')
+    listed = api.get('/admin/profiles', headers={'X-Admin-Token': 'admin-secret'}).json()['profiles']
+    assert {p['profileId'] for p in listed} == {first, second}
+    assert {p['requestId'] for p in listed} == {'req-1'}
+    assert api.get(f'/admin/profiles/{first}', headers={'X-Admin-Token': 'admin-secret'}).status_code == 200
+    assert api.get(f'/admin/profiles/{first}', headers={'X-Admin-Token': 'admin-secreT'}).status_code == 403
@@ -0,0 +1,47 @@
+import numpy as np
+
+import train_model
+
+
+def labelled(n_per_class, classes=('hasya', 'karuna', 'veera'), seed=0):
+    rng = np.random.default_rng(seed)
+    y = np.repeat(np.array(classes), n_per_class)
+    # Each sample's first value is its index, so sets of samples can be compared
+    X = rng.normal(size=(len(y), 4, 3)).astype(np.float32)
+    X[:, 0, 0] = np.arange(len(y))
+    return X, y
+
+
+def ids(X):
+    return set(X[:, 0, 0].astype(int).tolist())
+
+
+def test_check_partition_is_kept_apart_across_rounds(tmp_path):
+    path = str(tmp_path / 'replay.npz')
+    X, y = labelled(20)
+    X_old, y_old, X_check, y_check = train_model.split_check(X, y)
+    assert not ids(X_old) & ids(X_check)
+    assert set(y_check) == set(y)
+
+    train_model.save_replay_buffer(path, X_old, y_old, X_check, y_check)
+    X_old, y_old, X_loaded, y_loaded = train_model.load_replay_buffer(path)
+    assert ids(X_loaded) == ids(X_check)
+    assert list(y_loaded) == list(y_check)
+
+    # A later round adds new samples; the check partition is written back unchanged
+    X_new, y_new = labelled(5, seed=1)
+    X_new[:, 0, 0] += 1000
+    train_model.save_replay_buffer(path, np.concatenate([X_old, X_new]), np.concatenate([y_old, y_new]),
+                                   X_loaded, y_loaded, per_class=10)
+    X_old, y_old, X_again, _ = train_model.load_replay_buffer(path)
+    assert ids(X_again) == ids(X_check)
+    assert not ids(X_old) & ids(X_check)
+    assert np.bincount(np.unique(y_old, return_inverse=True)[1]).max() <= 10
+
+
+def test_buffers_without_check_partition_load(tmp_path):
+    path = str(tmp_path / 'legacy.npz')
+    X, y = labelled(4)
+    np.savez(path, X=X.astype(np.float16), y=y)
+    X_old, y_old, X_check, y_check = train_model.load_replay_buffer(path)
+    assert len(X_old) == len(y) and X_check is None and y_check is None
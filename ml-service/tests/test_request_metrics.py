@@ -0,0 +1,23 @@
+from fastapi.testclient import TestClient
+
+import loadtest
+from app.main import app
+from app.services import metrics
+
+
+def test_request_metrics_keyed_by_route():
+    client = TestClient(app)
+    client.get('/health')
+    for i in range(3):
+        assert client.get(f'/no/such/path/{i}').status_code == 404
+    names = set(metrics.snapshot())
+    assert 'request./health' in names
+    assert metrics.snapshot()['request.unmatched']['total'] >= 3
+    assert not any(name.startswith('request./no/') for name in names)
+
+
+def test_payload_mix_keeps_bounded_sample():
+    mix = loadtest.PayloadMix([0.05], duplicate_rate=0.5, max_kept=4)
+    payloads = [mix.next() for _ in range(40)]
+    assert len(mix.sent) == 4
+    assert len({name for name, _ in payloads}) < len(payloads)
@@ -0,0 +1,121 @@
+import threading
+import time
+
+import pytest
+
+from app.services import metrics, scheduler
+from app.services.scheduler import FairScheduler, QueueFull
+
+
+def blocked_scheduler(**kwargs):
+    """Scheduler whose workers are all busy until the returned event is set"""
+    gate = threading.Event()
+    fair = FairScheduler(**kwargs)
+    started = [fair.submit(f'gate-{i}', gate.wait) for i in range(len(fair.threads))]
+    deadline = time.time() + 5
+    while not all(f.running() for f in started):
+        assert time.time() < deadline
+        time.sleep(0.01)
+    return fair, gate
+
+
+def test_weighted_deficit_round_robin_order():
+    fair, gate = blocked_scheduler(workers=1, client_concurrency=10, weights={'a': 3.0, 'b': 1.0})
+    order = []
+    futures = [fair.submit(client, lambda c=client: order.append(c))
+               for client in ['a'] * 6 + ['b'] * 6]
+    gate.set()
+    for future in futures:
+        future.result(timeout=5)
+    assert order[:8] == ['a', 'a', 'a', 'b', 'a', 'a', 'a', 'b']
+    assert order[8:] == ['b'] * 4
+
+
+def test_client_concurrency_cap_applies_while_others_wait():
+    # No worker threads: drive _pick by hand
+    fair = FairScheduler(workers=0, client_concurrency=1, weights={})
+    for client in ['a', 'a', 'a', 'b']:
+        fair.submit(client, lambda: None)
+
+    first = fair._pick()
+    fair.running['a'] = 1
+    # 'a' is at its cap while 'b' waits
+    second = fair._pick()
+    fair.running['b'] = 1
+    # 'b' has nothing queued any more, so 'a' may use another worker
+    third = fair._pick()
+    assert [first.client, second.client, third.client] == ['a', 'b', 'a']
+
+
+def test_lone_client_uses_every_worker():
+    fair = FairScheduler(workers=2, client_concurrency=1, weights={})
+    release = threading.Event()
+    started = [threading.Event(), threading.Event()]
+
+    def work(i):
+        started[i].set()
+        release.wait(5)
+
+    futures = [fair.submit('solo', lambda i=i: work(i)) for i in range(2)]
+    try:
+        assert all(event.wait(2) for event in started)
+        assert fair.stats()['clients']['solo']['running'] == 2
+    finally:
+        release.set()
+    for future in futures:
+        future.result(timeout=5)
+
+
+def test_queue_limit_per_client():
+    fair, gate = blocked_scheduler(workers=1, queue_limit=2, weights={})
+    fair.submit('a', lambda: None)
+    fair.submit('a', lambda: None)
+    with pytest.raises(QueueFull):
+        fair.submit('a', lambda: None)
+    # Other clients are unaffected
+    fair.submit('b', lambda: None).cancel()
+    gate.set()
+
+
+def test_exceptions_reach_the_future():
+    fair = FairScheduler(workers=1, weights={})
+
+    def boom():
+        raise ValueError('bad audio')
+
+    with pytest.raises(ValueError, match='bad audio'):
+        fair.submit('a', boom).result(timeout=5)
+
+
+def test_served_counters_and_metrics_are_bounded(monkeypatch):
+    monkeypatch.setattr(scheduler, 'SCHEDULER_MAX_TRACKED_CLIENTS', 3)
+    fair = FairScheduler(workers=1, weights={'known': 1.0})
+    for i in range(6):
+        fair.submit(f'rotating-{i}', lambda: None).result(timeout=5)
+    fair.submit('known', lambda: None).result(timeout=5)
+    # served is updated just after the result is set
+    deadline = time.time() + 5
+    while 'known' not in fair.served:
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+    assert list(fair.served) == ['rotating-4', 'rotating-5', 'known']
+    names = set(metrics.snapshot())
+    assert 'queue_wait.other' in names and 'queue_wait.known' in names
+    assert not any(n.startswith('queue_wait.rotating') for n in names)
+
+
+def test_client_id_only_trusts_configured_ids(monkeypatch):
+    from starlette.requests import Request
+    import app.main as main
+
+    monkeypatch.setattr(main, 'TRUSTED_CLIENT_IDS', {'frontend'})
+
+    def request(headers):
+        return Request({'type': 'http', 'headers': [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+                        'client': ('10.0.0.7', 1234)})
+
+    assert main.client_id(request({'X-Client-ID': 'frontend'})) == 'frontend'
+    assert main.client_id(request({'X-Client-ID': 'random-123'})) == '10.0.0.7'
+    key_id = main.client_id(request({'X-Client-ID': 'random-123', 'X-API-Key': 'secret'}))
+    assert key_id.startswith('key-') and 'secret' not in key_id
@@ -0,0 +1,27 @@
+import pytest
+from fastapi import HTTPException
+
+from app import main
+
+
+@pytest.fixture
+def shared_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'SHARED_VOLUME_ROOT', str(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.parametrize('name', ['a.wav', 'b.flac', 'c.ogg', 'd.MP3', 'e.m4a', 'f.opus'])
+def test_audio_extensions_accepted(shared_root, name):
+    (shared_root / name).write_bytes(b'audio')
+    assert main.resolve_shared_path(name) == str(shared_root / name)
+
+
+@pytest.mark.parametrize('name, status', [('notes.txt', 400), ('noext', 400), ('missing.wav', 404),
+                                          ('../outside.wav', 403)])
+def test_rejected_paths(shared_root, name, status):
+    for existing in ('notes.txt', 'noext'):
+        (shared_root / existing).write_bytes(b'x')
+    (shared_root.parent / 'outside.wav').write_bytes(b'x')
+    with pytest.raises(HTTPException) as error:
+        main.resolve_shared_path(name)
+    assert error.value.status_code == status
@@ -0,0 +1,67 @@
+import threading
+
+import numpy as np
+
+from app.services import similarity_index
+from app.services.similarity_index import EmbeddingIndex
+
+
+def random_vectors(n, dim, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+
+
+def test_instances_sharing_a_directory_see_each_others_rows(tmp_path):
+    a = EmbeddingIndex(str(tmp_path), dim=8)
+    b = EmbeddingIndex(str(tmp_path), dim=8)
+    vectors = random_vectors(2, 8)
+
+    assert a.add('first', vectors[0]) == 0
+    assert b.add('second', vectors[1]) == 1
+
+    hits = a.search(vectors[1], k=1)
+    assert hits[0]['trackId'] == 'second'
+    assert hits[0]['score'] == 1.0
+    assert np.allclose(b.get_vector('first'), similarity_index._normalize(vectors[0]))
+
+
+def test_concurrent_writers_get_distinct_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(similarity_index, 'INITIAL_CAPACITY', 2)
+    writers = [EmbeddingIndex(str(tmp_path), dim=8) for _ in range(4)]
+    vectors = random_vectors(40, 8, seed=1)
+
+    def add_all(index, offset):
+        for i in range(offset, len(vectors), len(writers)):
+            index.add(f'track-{i}', vectors[i], {'n': i})
+
+    threads = [threading.Thread(target=add_all, args=(index, i)) for i, index in enumerate(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    reopened = EmbeddingIndex(str(tmp_path), dim=8)
+    assert len(reopened) == len(vectors)
+    for i, vector in enumerate(vectors):
+        assert np.allclose(reopened.get_vector(f'track-{i}'), similarity_index._normalize(vector))
+        assert reopened.search(vector, k=1)[0]['n'] == i
+
+
+def test_ivfpq_built_by_another_instance_is_picked_up(tmp_path):
+    reader = EmbeddingIndex(str(tmp_path), dim=8)
+    builder = EmbeddingIndex(str(tmp_path), dim=8)
+    vectors = random_vectors(60, 8, seed=2)
+    for i, vector in enumerate(vectors[:40]):
+        builder.add(f'track-{i}', vector)
+
+    assert reader.search(vectors[0], k=1)[0]['trackId'] == 'track-0'
+    assert reader._ivfpq is None
+
+    builder.build_ivfpq(n_lists=4, n_subvectors=4, n_centroids=8, iterations=5)
+    assert reader.search(vectors[0], k=1, mode='ivfpq')[0]['trackId'] == 'track-0'
+    assert int(reader._ivfpq['n_indexed']) == 40
+
+    for i, vector in enumerate(vectors[40:], start=40):
+        builder.add(f'track-{i}', vector)
+    builder.build_ivfpq(n_lists=4, n_subvectors=4, n_centroids=8, iterations=5)
+    assert reader.search(vectors[50], k=1, mode='ivfpq')[0]['trackId'] == 'track-50'
+    assert int(reader._ivfpq['n_indexed']) == 60
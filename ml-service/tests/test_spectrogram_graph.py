@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from app.services.cnn_classifier import extract_features_for_prediction, waveform_input
+from conftest import synth_clip
+
+tf = pytest.importorskip('tensorflow')
+from app.services.spectrogram_graph import MelSpectrogram, N_SAMPLES
+
+# Normalized log-mel values are O(1); float32 STFT / dB round-off reaches ~2e-5
+# in the quietest bins, a masking or padding mistake shifts whole frames by O(1)
+ATOL = 1e-4
+
+
+@pytest.mark.parametrize('seconds', [30.0, 7.0, 31.0, 0.5])
+def test_mel_spectrogram_matches_librosa(seconds):
+    y = synth_clip(seconds=seconds, seed=3)
+    # Shorter clips exercise the frame masking and zero padding, longer ones the crop
+    expected = extract_features_for_prediction(None, y=y[:N_SAMPLES])
+
+    actual = MelSpectrogram()(tf.constant(waveform_input(None, y=y)[np.newaxis])).numpy()[0]
+
+    assert actual.shape == expected.shape
+    np.testing.assert_allclose(actual, expected, atol=ATOL)
+
+
+def test_clips_in_one_batch_do_not_affect_each_other():
+    clips = [synth_clip(seconds=seconds, seed=i) for i, seconds in enumerate((30.0, 2.0, 11.0))]
+    batch = np.stack([waveform_input(None, y=y) for y in clips])
+
+    together = MelSpectrogram()(tf.constant(batch)).numpy()
+
+    for i, y in enumerate(clips):
+        np.testing.assert_allclose(together[i], extract_features_for_prediction(None, y=y), atol=ATOL)
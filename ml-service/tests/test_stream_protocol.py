@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app import main
+from app.services import streaming
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # The protocol errors are raised before the CNN is ever called
+    monkeypatch.setattr(main.backends, 'is_available', lambda name: True)
+    monkeypatch.setattr(main.backends, 'get_backend', lambda name: None)
+    return TestClient(main.app)
+
+
+@pytest.mark.parametrize('message, detail', [
+    ('[1, 2]', 'JSON objects'),
+    ('"end"', 'JSON objects'),
+    ('{"sampleRate": 0}', 'sampleRate'),
+    ('{"sampleRate": -44100}', 'sampleRate'),
+    ('{"sampleRate": [44100]}', 'integers'),
+    ('{"channels": 0}', 'channels'),
+    ('{"channels": "two"}', 'integers'),
+    ('{"format": ["f32le"]}', 'Unsupported format'),
+    ('not json', 'Expecting value'),
+])
+def test_invalid_control_messages_are_protocol_errors(client, message, detail):
+    with client.websocket_connect('/ws/analyze') as ws:
+        ws.send_text(message)
+        reply = ws.receive_json()
+        assert reply['type'] == 'error'
+        assert detail in reply['detail']
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+        assert closed.value.code == 1003
+    assert streaming.active_streams() == 0
+
+
+def test_valid_format_is_acknowledged(client):
+    with client.websocket_connect('/ws/analyze') as ws:
+        ws.send_text('{"sampleRate": 44100, "channels": 2, "format": "s16le"}')
+        assert ws.receive_json()['type'] == 'ready'
+        ws.send_text('{"type": "end"}')
+
+
+def test_graph_inference_server_is_rejected_on_connect(client, monkeypatch):
+    from app.services import cnn_classifier
+    monkeypatch.setattr(cnn_classifier, 'spectrogram_input_supported', lambda: False)
+    with client.websocket_connect('/ws/analyze') as ws:
+        reply = ws.receive_json()
+        assert reply['type'] == 'error' and 'waveforms' in reply['detail']
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+        assert closed.value.code == 1011
+    assert streaming.active_streams() == 0
+
+
+def test_scoring_errors_get_an_error_frame(client, monkeypatch):
+    from app.services import cnn_classifier
+
+    def fail(features):
+        raise RuntimeError("Inference server error: boom")
+
+    monkeypatch.setattr(cnn_classifier, 'classify_spectrogram', fail)
+    with client.websocket_connect('/ws/analyze') as ws:
+        ws.send_text('{"format": "f32le"}')
+        assert ws.receive_json()['type'] == 'ready'
+        ws.send_bytes(np.zeros(streaming.SAMPLE_RATE, dtype='<f4').tobytes())
+        ws.send_text('{"type": "end"}')
+        reply = ws.receive_json()
+        assert reply == {'type': 'error', 'detail': 'Inference server error: boom'}
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+        assert closed.value.code == 1011
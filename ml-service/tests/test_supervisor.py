@@ -0,0 +1,101 @@
+from app.services import supervisor
+from app.services.supervisor import Supervisor, Worker
+
+
+class FakeProcess:
+    pids = iter(range(1000, 2000))
+
+    def __init__(self):
+        self.pid = next(self.pids)
+        self.exitcode = None
+
+    def is_alive(self):
+        return self.exitcode is None
+
+    def join(self, timeout=None):
+        pass
+
+    def kill(self):
+        self.exitcode = -9
+
+
+class FakeConn:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSupervisor(Supervisor):
+    def _spawn(self, slot, preload=None, replaces=None):
+        worker = Worker(FakeProcess(), FakeConn(), slot, replaces)
+        self.workers.append(worker)
+        return worker
+
+
+def crash(worker):
+    worker.process.exitcode = 1
+
+
+def test_workers_failing_to_start_back_off_then_give_up(monkeypatch):
+    monkeypatch.setattr(supervisor, 'WORKER_RESTART_BACKOFF_SECONDS', 1)
+    monkeypatch.setattr(supervisor, 'WORKER_RESTART_BACKOFF_MAX_SECONDS', 3)
+    monkeypatch.setattr(supervisor, 'WORKER_MAX_START_FAILURES', 4)
+    clock = [100.0]
+    monkeypatch.setattr(supervisor.time, 'monotonic', lambda: clock[0])
+    sup = FakeSupervisor('app.main:app')
+    sup._spawn(0)
+
+    for delay in (1, 2, 3):
+        crash(sup.workers[0])
+        sup._reap()
+        assert sup.workers == [] and sup.pending[0] == clock[0] + delay
+        clock[0] += delay - 0.1
+        sup._reap()
+        assert sup.workers == []
+        clock[0] += 0.1
+        sup._reap()
+        assert len(sup.workers) == 1
+
+    crash(sup.workers[0])
+    sup._reap()
+    assert sup.should_exit and sup.exit_code == 1
+    assert sup.workers == [] and not sup.pending
+
+
+def test_ready_worker_resets_the_backoff(monkeypatch):
+    sup = FakeSupervisor('app.main:app')
+    worker = sup._spawn(0)
+    crash(worker)
+    sup._reap()
+    assert sup.start_failures[0] == 1
+
+    sup.pending[0] = 0
+    sup._reap()
+    sup._handle(sup.workers[0], 'ready', {'pid': sup.workers[0].process.pid, 'rssMb': 100})
+    assert 0 not in sup.start_failures
+
+    # A crash after start-up is replaced straight away
+    crash(sup.workers[0])
+    sup._reap()
+    assert len(sup.workers) == 1 and sup.workers[0].state == 'starting'
+
+
+def test_failing_replacements_stop_recycling_without_stopping_the_old_worker(monkeypatch):
+    monkeypatch.setattr(supervisor, 'WORKER_RESTART_BACKOFF_SECONDS', 0)
+    monkeypatch.setattr(supervisor, 'WORKER_MAX_START_FAILURES', 2)
+    sup = FakeSupervisor('app.main:app')
+    old = sup._spawn(0)
+    sup._handle(old, 'ready', {'pid': old.process.pid, 'rssMb': 100})
+    recycle = {'pid': old.process.pid, 'reason': 'rss', 'requests': 10, 'loaded': []}
+
+    for _ in range(2):
+        sup._handle(old, 'recycle', recycle)
+        assert old.replacement is not None
+        crash(old.replacement)
+        sup._reap()
+        assert old.replacement is None
+
+    sup._handle(old, 'recycle', recycle)
+    assert old.replacement is None
+    assert sup.workers == [old] and old.state == 'ready' and not sup.should_exit
@@ -14,9 +14,15 @@ dataset/
 └── bibhatsa/   (disgust songs)
 
 Each folder should contain MP3/WAV files
+
+Data-parallel training on several processes (MultiWorkerMirroredStrategy):
+    python train_model.py --dataset dataset --workers 4                 # one host
+    python train_model.py --dataset dataset --cluster cluster.json --task-index 0   # per host
 """
 
 import os
+import json
+import time
 import numpy as np
 import librosa
 from sklearn.model_selection import train_test_split
@@ -36,14 +42,20 @@ DURATION = 30  # seconds
 N_MFCC = 40
 N_MELS = 128
 
-def extract_features_for_training(file_path, duration=30):
+# Replay buffer for finetune(): replayed samples and fixed check samples per rasa
+REPLAY_PER_CLASS = 200
+CHECK_PER_CLASS = 50
+
+def extract_features_for_training(file_path, duration=30, y=None):
     """
     Extract audio features for training
     Returns mel spectrogram
     """
     try:
-        # Load audio
-        y, sr = librosa.load(file_path, sr=SAMPLE_RATE, duration=duration, mono=True)
+        # Load audio (unless the caller already decoded it at SAMPLE_RATE)
+        sr = SAMPLE_RATE
+        if y is None:
+            y, sr = librosa.load(file_path, sr=SAMPLE_RATE, duration=duration, mono=True)
         
         # Extract mel spectrogram
         mel_spec = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=N_MELS, fmax=8000)
@@ -68,15 +80,92 @@ def extract_features_for_training(file_path, duration=30):
         print(f"Error processing {file_path}: {e}")
         return None
 
-def load_dataset(dataset_path):
+def _shard_entries(shard_dir):
+    """Complete, non-empty shards listed in a build_dataset.py checkpoint"""
+    entries = []
+    with open(os.path.join(shard_dir, '_checkpoint.jsonl')) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry['paths']:
+                entries.append(entry)
+    return entries
+
+def load_feature_shards(shard_dir, shard=None):
     """
-    Load dataset from folder structure
+    Mel spectrograms and labels from build_dataset.py shards
+    
+    With shard=(index, count) only every count-th shard file starting at
+    index is read (one worker's part of the data)
     """
+    entries = _shard_entries(shard_dir)
+    if shard is not None and shard[1] <= len(entries):
+        entries = entries[shard[0]::shard[1]]
+        shard = None
+    
+    X, y = [], []
+    for entry in entries:
+        with np.load(os.path.join(shard_dir, entry['part'])) as data:
+            X.append(data['X'].astype(np.float32))
+            y.append(data['y'])
+    if not X:
+        return np.array([]), np.array([])
+    X, y = np.concatenate(X), np.concatenate(y)
+    if shard is not None:
+        # Fewer files than workers: split the samples instead
+        X, y = X[shard[0]::shard[1]], y[shard[0]::shard[1]]
+    return X, y
+
+def count_samples(dataset_path):
+    """Number of samples in a dataset without loading it (files, or shard entries)"""
+    if os.path.exists(os.path.join(dataset_path, '_checkpoint.jsonl')):
+        return sum(len(entry['paths']) for entry in _shard_entries(dataset_path))
+    return sum(
+        len([f for f in os.listdir(os.path.join(dataset_path, emotion))
+             if f.endswith(('.mp3', '.wav', '.flac', '.ogg'))])
+        for emotion in EMOTIONS if os.path.exists(os.path.join(dataset_path, emotion))
+    )
+
+def load_dataset(dataset_path, dedupe=False, waveforms=False, shard=None):
+    """
+    Load dataset from folder structure, or from the feature shards of
+    build_dataset.py (already mel spectrograms, nothing is decoded)
+    
+    With dedupe=True every file is fingerprinted first and files matching
+    an already loaded one (re-encodes, trims - also across rasa folders)
+    are skipped, so copies cannot end up on both sides of the split.
+    
+    With waveforms=True samples are packed waveforms
+    (cnn_classifier.waveform_input) for in-graph preprocessing instead of
+    mel spectrograms.
+    
+    With shard=(index, count) only every count-th file (or shard file) is
+    loaded, so each training worker decodes its own part of the dataset.
+    """
+    if os.path.exists(os.path.join(dataset_path, '_checkpoint.jsonl')):
+        if waveforms:
+            raise ValueError("Feature shards hold mel spectrograms - train them without graph preprocessing")
+        print(f"📂 Loading feature shards from {dataset_path}...")
+        X, y = load_feature_shards(dataset_path, shard=shard)
+        print(f"✅ Loaded {len(X)} samples total")
+        return X, y
+    
     X = []  # Features
     y = []  # Labels
     
     print("📂 Loading dataset...")
     
+    if dedupe:
+        from app.services.fingerprint import FingerprintIndex, compute_fingerprint
+        seen = FingerprintIndex(':memory:')
+        duplicates = 0
+    
+    if waveforms:
+        from app.services.cnn_classifier import waveform_input
+    
+    position = -1  # index over all files, for shard selection
     for emotion in EMOTIONS:
         emotion_path = os.path.join(dataset_path, emotion)
         
@@ -84,14 +173,43 @@ def load_dataset(dataset_path):
             print(f"⚠️ Warning: {emotion_path} not found, skipping...")
             continue
         
-        files = [f for f in os.listdir(emotion_path) 
-                if f.endswith(('.mp3', '.wav', '.flac', '.ogg'))]
+        # Sorted: every worker must see the same order to pick disjoint shards
+        files = sorted(f for f in os.listdir(emotion_path) 
+                       if f.endswith(('.mp3', '.wav', '.flac', '.ogg')))
         
         print(f"  {emotion}: Processing {len(files)} files...")
         
         for i, file in enumerate(files):
             file_path = os.path.join(emotion_path, file)
-            features = extract_features_for_training(file_path)
+            
+            position += 1
+            if shard is not None and position % shard[1] != shard[0]:
+                continue
+            
+            audio = None
+            if dedupe:
+                try:
+                    audio, _ = librosa.load(file_path, sr=SAMPLE_RATE, duration=DURATION, mono=True)
+                except Exception as e:
+                    print(f"Error processing {file_path}: {e}")
+                    continue
+                fingerprint = compute_fingerprint(np.abs(librosa.stft(audio)))
+                match = seen.match(fingerprint)
+                if match is not None:
+                    duplicates += 1
+                    print(f"    ♻️ Skipping {emotion}/{file}: duplicate of {match['trackId']} "
+                          f"(score {match['score']:.2f})")
+                    continue
+                seen.add(fingerprint, label=emotion, track_id=f"{emotion}/{file}")
+            
+            if waveforms:
+                try:
+                    features = waveform_input(file_path, y=audio)
+                except Exception as e:
+                    print(f"Error processing {file_path}: {e}")
+                    features = None
+            else:
+                features = extract_features_for_training(file_path, y=audio)
             
             if features is not None:
                 X.append(features)
@@ -101,6 +219,8 @@ def load_dataset(dataset_path):
                 print(f"    Processed {i + 1}/{len(files)} files")
     
     print(f"✅ Loaded {len(X)} samples total")
+    if dedupe:
+        print(f"♻️ Dropped {duplicates} near-duplicate files")
     
     return np.array(X), np.array(y)
 
@@ -154,14 +274,262 @@ def build_cnn_model(input_shape, num_classes):
     
     return model
 
-def train(dataset_path, model_save_path='models/navarasa_cnn.h5'):
+def build_student_model(input_shape, num_classes):
+    """
+    Build the lightweight student CNN for knowledge distillation
+    
+    Takes the same 128 x 1291 spectrogram as the teacher but pools it to
+    64 mels x ~323 frames in-graph, then uses depthwise-separable
+    convolutions - under a tenth of the teacher's parameters and a small
+    fraction of its FLOPs.
+    The classifier ends in a separate softmax layer so the distiller can
+    read the logits.
+    """
+    model = keras.Sequential([
+        layers.Input(shape=input_shape),
+        layers.Reshape((*input_shape, 1)),
+        
+        # Downsample: halve the mel axis, quarter the time axis
+        layers.AveragePooling2D((2, 4)),
+        
+        # Stem
+        layers.Conv2D(16, (3, 3), activation='relu', padding='same'),
+        layers.BatchNormalization(),
+        layers.MaxPooling2D((2, 2)),
+        
+        # Separable blocks
+        layers.SeparableConv2D(32, (3, 3), activation='relu', padding='same'),
+        layers.BatchNormalization(),
+        layers.MaxPooling2D((2, 2)),
+        
+        layers.SeparableConv2D(64, (3, 3), activation='relu', padding='same'),
+        layers.BatchNormalization(),
+        layers.MaxPooling2D((2, 2)),
+        
+        layers.SeparableConv2D(128, (3, 3), activation='relu', padding='same'),
+        layers.BatchNormalization(),
+        
+        layers.GlobalAveragePooling2D(),
+        layers.Dropout(0.3),
+        
+        # 256-d like the teacher's embedding layer (similarity index dimension)
+        layers.Dense(256, activation='relu'),
+        layers.Dropout(0.3),
+        
+        layers.Dense(num_classes, name='logits'),
+        layers.Activation('softmax'),
+    ])
+    
+    return model
+
+class Distiller(keras.Model):
+    """
+    Trains a student on a mix of the hard labels and the teacher's soft
+    targets at temperature T (Hinton et al.):
+        loss = alpha * CE(labels, student) + (1 - alpha) * T^2 * KL(teacher_T || student_T)
+    """
+    
+    def __init__(self, student, teacher, temperature=4.0, alpha=0.3):
+        super().__init__()
+        self.student = student
+        self.teacher = teacher
+        self.teacher.trainable = False
+        self.temperature = temperature
+        self.alpha = alpha
+        self.student_logits = keras.Model(student.inputs, student.get_layer('logits').output)
+        self.loss_tracker = keras.metrics.Mean(name='loss')
+        self.accuracy = keras.metrics.CategoricalAccuracy(name='accuracy')
+    
+    @property
+    def metrics(self):
+        return [self.loss_tracker, self.accuracy]
+    
+    def distillation_loss(self, x, y, training):
+        # The teacher only exposes probabilities; log(p) / T is its
+        # temperature-scaled logits up to a constant, which softmax ignores
+        teacher_probs = self.teacher(x, training=False)
+        soft_targets = tf.nn.softmax(tf.math.log(teacher_probs + 1e-8) / self.temperature)
+        
+        logits = self.student_logits(x, training=training)
+        hard_loss = keras.losses.categorical_crossentropy(y, tf.nn.softmax(logits))
+        soft_loss = keras.losses.kl_divergence(soft_targets, tf.nn.softmax(logits / self.temperature))
+        loss = self.alpha * hard_loss + (1 - self.alpha) * self.temperature ** 2 * soft_loss
+        return tf.reduce_mean(loss), logits
+    
+    def train_step(self, data):
+        x, y = data
+        with tf.GradientTape() as tape:
+            loss, logits = self.distillation_loss(x, y, training=True)
+        gradients = tape.gradient(loss, self.student.trainable_variables)
+        self.optimizer.apply_gradients(zip(gradients, self.student.trainable_variables))
+        self.loss_tracker.update_state(loss)
+        self.accuracy.update_state(y, logits)
+        return {m.name: m.result() for m in self.metrics}
+    
+    def test_step(self, data):
+        x, y = data
+        loss, logits = self.distillation_loss(x, y, training=False)
+        self.loss_tracker.update_state(loss)
+        self.accuracy.update_state(y, logits)
+        return {m.name: m.result() for m in self.metrics}
+    
+    def call(self, x, training=False):
+        return self.student(x, training=training)
+
+def measure_latency(model, sample, runs=30):
+    """Median / p95 single-clip predict latency in milliseconds"""
+    batch = np.expand_dims(sample, axis=0)
+    model.predict(batch, verbose=0)  # warm-up (graph tracing)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        model.predict(batch, verbose=0)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'p50_ms': round(float(np.percentile(timings, 50)), 2),
+        'p95_ms': round(float(np.percentile(timings, 95)), 2),
+    }
+
+def distill(dataset_path, teacher_path='models/navarasa_cnn.h5',
+            student_save_path='models/navarasa_cnn_student.h5',
+            temperature=4.0, alpha=0.3, dedupe=False):
+    """
+    Knowledge distillation: train the student on the teacher's soft targets
+    and write a latency / size / accuracy report next to the student model
+    """
+    print("🚀 Starting distillation pipeline...")
+    
+    print(f"📥 Loading teacher from {teacher_path}...")
+    teacher = keras.models.load_model(teacher_path)
+    with open(teacher_path.replace('.h5', '_encoder.pkl'), 'rb') as f:
+        label_encoder = pickle.load(f)
+    
+    X, y = load_dataset(dataset_path, dedupe=dedupe)
+    
+    if len(X) == 0:
+        print("❌ No data loaded. Check your dataset path.")
+        return
+    
+    # Reuse the teacher's label order so both models share one encoder
+    y_encoded = label_encoder.transform(y)
+    y_onehot = keras.utils.to_categorical(y_encoded, num_classes=len(label_encoder.classes_))
+    
+    # Same split as train() so the teacher is evaluated on unseen clips
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y_onehot, test_size=0.2, random_state=42, stratify=y_encoded
+    )
+    
+    print("🏗️ Building student model...")
+    student = build_student_model(input_shape=X_train[0].shape,
+                                  num_classes=len(label_encoder.classes_))
+    print(student.summary())
+    
+    distiller = Distiller(student, teacher, temperature=temperature, alpha=alpha)
+    distiller.compile(optimizer=keras.optimizers.Adam(learning_rate=0.001))
+    
+    callbacks = [
+        keras.callbacks.EarlyStopping(
+            monitor='val_loss',
+            patience=10,
+            restore_best_weights=True
+        ),
+        keras.callbacks.ReduceLROnPlateau(
+            monitor='val_loss',
+            factor=0.5,
+            patience=5,
+            min_lr=1e-7
+        ),
+    ]
+    
+    print(f"🎓 Distilling (T={temperature}, alpha={alpha})...")
+    history = distiller.fit(
+        X_train, y_train,
+        validation_data=(X_test, y_test),
+        epochs=50,
+        batch_size=32,
+        callbacks=callbacks,
+        verbose=1
+    )
+    
+    # Compare student and teacher on the held-out split
+    print("📈 Evaluating student against teacher...")
+    teacher_pred = teacher.predict(X_test, verbose=0).argmax(axis=1)
+    student_pred = student.predict(X_test, verbose=0).argmax(axis=1)
+    labels = y_test.argmax(axis=1)
+    
+    report = {
+        'teacher': {
+            'path': teacher_path,
+            'parameters': int(teacher.count_params()),
+            'accuracy': round(float(np.mean(teacher_pred == labels)), 4),
+            'latency': measure_latency(teacher, X_test[0]),
+        },
+        'student': {
+            'path': student_save_path,
+            'parameters': int(student.count_params()),
+            'accuracy': round(float(np.mean(student_pred == labels)), 4),
+            'latency': measure_latency(student, X_test[0]),
+        },
+        'agreement': round(float(np.mean(student_pred == teacher_pred)), 4),
+        'temperature': temperature,
+        'alpha': alpha,
+        'test_samples': int(len(X_test)),
+    }
+    report['parameter_ratio'] = round(report['student']['parameters'] / report['teacher']['parameters'], 4)
+    report['speedup'] = round(report['teacher']['latency']['p50_ms'] / report['student']['latency']['p50_ms'], 2)
+    
+    print(f"   Teacher: {report['teacher']['parameters']:,} params, "
+          f"{report['teacher']['accuracy'] * 100:.2f}% acc, {report['teacher']['latency']['p50_ms']} ms")
+    print(f"   Student: {report['student']['parameters']:,} params, "
+          f"{report['student']['accuracy'] * 100:.2f}% acc, {report['student']['latency']['p50_ms']} ms")
+    print(f"   Agreement with teacher: {report['agreement'] * 100:.2f}%, speedup {report['speedup']}x")
+    
+    # Save the plain student (loadable without the Distiller class)
+    student.save(student_save_path)
+    encoder_path = student_save_path.replace('.h5', '_encoder.pkl')
+    with open(encoder_path, 'wb') as f:
+        pickle.dump(label_encoder, f)
+    report_path = student_save_path.replace('.h5', '_report.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    
+    print(f"💾 Student saved to: {student_save_path}")
+    print(f"💾 Encoder saved to: {encoder_path}")
+    print(f"💾 Report saved to: {report_path}")
+    
+    return student, history, report
+
+class InnerModelCheckpoint(keras.callbacks.ModelCheckpoint):
+    """
+    ModelCheckpoint that saves the mel-input CNN inside a waveform model,
+    so the checkpoint loads like one from a mel-trained run
+    """
+    
+    def __init__(self, inner_model, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.inner_model = inner_model
+    
+    def set_model(self, model):
+        self.model = self.inner_model
+
+def train(dataset_path, model_save_path='models/navarasa_cnn.h5', dedupe=False,
+          graph_preprocessing=False, replay_cache=None, epochs=50):
     """
     Main training function
+    
+    With graph_preprocessing=True the model is trained on raw waveforms
+    with the mel spectrogram computed in-graph (spectrogram_graph.py), so
+    each batch runs STFT + CNN in one call. The saved model is the same
+    mel-input CNN either way.
+    
+    With replay_cache set, a per-rasa sample of the training spectrograms
+    is kept as the replay buffer for later finetune() runs, together with
+    a sample of the test split as its fixed regression-check partition.
     """
     print("🚀 Starting training pipeline...")
     
     # Load dataset
-    X, y = load_dataset(dataset_path)
+    X, y = load_dataset(dataset_path, dedupe=dedupe, waveforms=graph_preprocessing)
     
     if len(X) == 0:
         print("❌ No data loaded. Check your dataset path.")
@@ -175,8 +543,8 @@ def train(dataset_path, model_save_path='models/navarasa_cnn.h5'):
     y_onehot = keras.utils.to_categorical(y_encoded, num_classes=len(EMOTIONS))
     
     # Split dataset
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y_onehot, test_size=0.2, random_state=42, stratify=y_encoded
+    X_train, X_test, y_train, y_test, labels_train, labels_test = train_test_split(
+        X, y_onehot, y, test_size=0.2, random_state=42, stratify=y_encoded
     )
     
     print(f"📊 Dataset split:")
@@ -185,7 +553,15 @@ def train(dataset_path, model_save_path='models/navarasa_cnn.h5'):
     
     # Build model
     print("🏗️ Building CNN model...")
-    model = build_cnn_model(input_shape=X_train[0].shape, num_classes=len(EMOTIONS))
+    if graph_preprocessing:
+        from app.services.spectrogram_graph import build_waveform_model
+        
+        cnn = build_cnn_model(input_shape=(N_MELS, int(SAMPLE_RATE / 512 * DURATION)),
+                              num_classes=len(EMOTIONS))
+        model = build_waveform_model(cnn)
+    else:
+        model = build_cnn_model(input_shape=X_train[0].shape, num_classes=len(EMOTIONS))
+        cnn = model
     
     # Compile model
     model.compile(
@@ -209,7 +585,8 @@ def train(dataset_path, model_save_path='models/navarasa_cnn.h5'):
             patience=5,
             min_lr=1e-7
         ),
-        keras.callbacks.ModelCheckpoint(
+        InnerModelCheckpoint(
+            cnn,
             model_save_path,
             monitor='val_accuracy',
             save_best_only=True,
@@ -222,7 +599,7 @@ def train(dataset_path, model_save_path='models/navarasa_cnn.h5'):
     history = model.fit(
         X_train, y_train,
         validation_data=(X_test, y_test),
-        epochs=50,
+        epochs=epochs,
         batch_size=32,
         callbacks=callbacks,
         verbose=1
@@ -241,8 +618,474 @@ def train(dataset_path, model_save_path='models/navarasa_cnn.h5'):
     print(f"💾 Model saved to: {model_save_path}")
     print(f"💾 Encoder saved to: {encoder_path}")
     
+    if replay_cache:
+        # Replay only training samples; the check partition comes from the test split
+        replay_idx = replay_sample(labels_train, REPLAY_PER_CLASS)
+        check_idx = replay_sample(labels_test, CHECK_PER_CLASS)
+        X_replay, X_check = X_train[replay_idx], X_test[check_idx]
+        if graph_preprocessing:
+            # The buffer holds mel spectrograms: convert the packed waveforms
+            # (samples, then the real length) once here
+            X_replay, X_check = (np.stack([extract_features_for_training(None, y=w[:int(w[-1])]) for w in batch])
+                                 for batch in (X_replay, X_check))
+        save_replay_buffer(replay_cache, X_replay, labels_train[replay_idx], X_check, labels_test[check_idx])
+    
+    return model, history
+
+class ThroughputLogger(keras.callbacks.Callback):
+    """Samples per second this worker processed in each epoch"""
+    
+    def __init__(self, batch_size, worker):
+        super().__init__()
+        self.batch_size = batch_size
+        self.worker = worker
+    
+    def on_epoch_begin(self, epoch, logs=None):
+        self.start = time.perf_counter()
+        self.steps = 0
+    
+    def on_train_batch_end(self, batch, logs=None):
+        self.steps += 1
+    
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = time.perf_counter() - self.start
+        samples = self.steps * self.batch_size
+        print(f"⏱️ [worker {self.worker}] epoch {epoch + 1}: {samples} samples in {elapsed:.1f}s "
+              f"({samples / elapsed:.1f} samples/s, {elapsed / max(1, self.steps) * 1000:.0f} ms/step)",
+              flush=True)
+
+def load_cluster(cluster):
+    """Worker addresses from a cluster spec: JSON file or string, {"worker": ["host:port", ...]}"""
+    if os.path.exists(cluster):
+        with open(cluster) as f:
+            cluster = f.read()
+    spec = json.loads(cluster)
+    if not spec.get('worker'):
+        raise ValueError('Cluster spec needs a "worker" list of host:port addresses')
+    return {'worker': spec['worker']}
+
+def train_distributed(dataset_path, cluster, task_index, model_save_path='models/navarasa_cnn.h5',
+                      batch_size=32, epochs=50):
+    """
+    Data-parallel training with MultiWorkerMirroredStrategy: one process
+    per worker (this one is cluster['worker'][task_index]), each holding a
+    full model replica; gradients are all-reduced across workers every
+    step, so the global batch is batch_size x workers.
+    
+    Input is sharded by worker: each one only decodes (or reads, for
+    feature shards) its own part of the dataset and splits it 80/20 into
+    training and validation data. Step counts come from the total dataset
+    size, so every worker runs the same number of steps.
+    
+    Worker 0 is the chief: it prints the model summary and saves the model
+    and encoder (same files as train()).
+    """
+    workers = len(cluster['worker'])
+    is_chief = task_index == 0
+    
+    # Must be set before the strategy (and any other TF op) is created
+    os.environ['TF_CONFIG'] = json.dumps({'cluster': cluster, 'task': {'type': 'worker', 'index': task_index}})
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    
+    print(f"🚀 [worker {task_index}] Starting distributed training "
+          f"({workers} workers, global batch {batch_size * workers})...")
+    
+    total = count_samples(dataset_path)
+    X, y = load_dataset(dataset_path, shard=(task_index, workers))
+    if len(X) == 0:
+        raise RuntimeError(f"Worker {task_index} loaded no data - check the dataset path")
+    
+    # Same label order on every worker (classes absent from a shard included)
+    label_encoder = LabelEncoder().fit(EMOTIONS)
+    y_onehot = keras.utils.to_categorical(label_encoder.transform(y), num_classes=len(EMOTIONS))
+    
+    # Stratified like train() unless the shard is too small for it
+    _, counts = np.unique(y, return_counts=True)
+    stratify = counts.min() >= 2 and np.ceil(len(y) * 0.2) >= len(counts)
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y_onehot, test_size=0.2, random_state=42, stratify=y if stratify else None
+    )
+    print(f"📊 [worker {task_index}] {len(X_train)} training / {len(X_test)} validation samples "
+          f"of {total} in the dataset")
+    
+    # Workers feed their own shard: no automatic re-sharding. Repeated, so
+    # no worker runs out before the agreed number of steps
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+    train_data = (tf.data.Dataset.from_tensor_slices((X_train, y_train))
+                  .shuffle(len(X_train), seed=42 + task_index).repeat()
+                  .batch(batch_size).prefetch(tf.data.AUTOTUNE).with_options(options))
+    test_data = (tf.data.Dataset.from_tensor_slices((X_test, y_test))
+                 .repeat().batch(batch_size).with_options(options))
+    global_batch = batch_size * workers
+    steps_per_epoch = max(1, int(total * 0.8) // global_batch)
+    validation_steps = max(1, int(np.ceil(total * 0.2 / global_batch)))
+    
+    with strategy.scope():
+        model = build_cnn_model(input_shape=X_train[0].shape, num_classes=len(EMOTIONS))
+        model.compile(
+            optimizer=keras.optimizers.Adam(learning_rate=0.0001),
+            loss='categorical_crossentropy',
+            metrics=['accuracy']
+        )
+    if is_chief:
+        print(model.summary())
+    
+    # Validation metrics are all-reduced, so every worker stops at the same epoch
+    callbacks = [
+        keras.callbacks.EarlyStopping(
+            monitor='val_loss',
+            patience=10,
+            restore_best_weights=True
+        ),
+        keras.callbacks.ReduceLROnPlateau(
+            monitor='val_loss',
+            factor=0.5,
+            patience=5,
+            min_lr=1e-7
+        ),
+        ThroughputLogger(batch_size, task_index),
+    ]
+    
+    print(f"🎓 [worker {task_index}] Training model...")
+    history = model.fit(
+        train_data,
+        validation_data=test_data,
+        epochs=epochs,
+        steps_per_epoch=steps_per_epoch,
+        validation_steps=validation_steps,
+        callbacks=callbacks,
+        verbose=2 if is_chief else 0
+    )
+    
+    test_loss, test_accuracy = model.evaluate(test_data, steps=validation_steps, verbose=0)
+    print(f"✅ [worker {task_index}] Validation accuracy: {test_accuracy * 100:.2f}%")
+    
+    # Saving reads the replicated variables collectively, so every worker
+    # saves; only the chief's copy is kept
+    if not is_chief:
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            model.save(os.path.join(tmp_dir, os.path.basename(model_save_path)))
+        return model, history
+    
+    model.save(model_save_path)
+    encoder_path = model_save_path.replace('.h5', '_encoder.pkl')
+    with open(encoder_path, 'wb') as f:
+        pickle.dump(label_encoder, f)
+    print(f"💾 Model saved to: {model_save_path}")
+    print(f"💾 Encoder saved to: {encoder_path}")
+    
     return model, history
 
+def launch_local_workers(count, argv):
+    """
+    Run count training workers on this host: a localhost cluster spec on
+    free ports, one train_model.py process per worker (argv plus
+    --cluster / --task-index), each with its share of the CPUs. Output is
+    prefixed with the worker index; if one worker fails the others are
+    stopped. Returns the exit code.
+    """
+    import socket
+    import subprocess
+    import sys
+    import threading
+    from app.services.autotune import available_cpus, THREAD_ENV_VARS
+    
+    ports = []
+    sockets = []
+    for _ in range(count):
+        sock = socket.socket()
+        sock.bind(('localhost', 0))
+        sockets.append(sock)
+        ports.append(sock.getsockname()[1])
+    for sock in sockets:
+        sock.close()
+    cluster = json.dumps({'worker': [f'localhost:{port}' for port in ports]})
+    
+    env = dict(os.environ)
+    threads_per_worker = str(max(1, available_cpus() // count))
+    for name in THREAD_ENV_VARS:
+        env.setdefault(name, threads_per_worker)
+    env.setdefault('TF_NUM_INTEROP_THREADS', '2')
+    
+    print(f"🚀 Launching {count} local workers ({threads_per_worker} threads each): {cluster}")
+    processes = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), *argv,
+                          '--cluster', cluster, '--task-index', str(index)],
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env, text=True)
+        for index in range(count)
+    ]
+    
+    def relay(index, process):
+        for line in process.stdout:
+            print(f"[{index}] {line}", end='', flush=True)
+    
+    relays = [threading.Thread(target=relay, args=(i, p), daemon=True) for i, p in enumerate(processes)]
+    for thread in relays:
+        thread.start()
+    
+    exit_code = 0
+    try:
+        while any(p.poll() is None for p in processes):
+            failed = [p for p in processes if p.returncode not in (None, 0)]
+            if failed:
+                # A lost worker blocks the collectives of the others
+                print(f"❌ A worker exited with code {failed[0].returncode} - stopping the others")
+                exit_code = failed[0].returncode
+                break
+            time.sleep(0.5)
+    finally:
+        for p in processes:
+            if p.poll() is None:
+                p.terminate()
+        for p in processes:
+            p.wait()
+        for thread in relays:
+            thread.join(timeout=5)
+    return exit_code or next((p.returncode for p in processes if p.returncode), 0)
+
+def replay_sample(y, per_class, seed=42):
+    """Sorted indices of a random sample of up to per_class samples of each rasa"""
+    rng = np.random.default_rng(seed)
+    keep = []
+    for emotion in np.unique(y):
+        idx = np.flatnonzero(y == emotion)
+        keep += list(rng.permutation(idx)[:per_class])
+    return np.sort(np.array(keep, dtype=int))
+
+def split_check(X, y, seed=42):
+    """
+    Carve the regression-check partition out of old samples that have none
+    yet: (X_replay, y_replay, X_check, y_check)
+    """
+    X_replay, X_check, y_replay, y_check = train_test_split(
+        X, y, test_size=0.2, random_state=seed, stratify=y
+    )
+    check = replay_sample(y_check, CHECK_PER_CLASS, seed)
+    return X_replay, y_replay, X_check[check], y_check[check]
+
+def save_replay_buffer(cache_path, X, y, X_check, y_check, per_class=REPLAY_PER_CLASS, seed=42):
+    """
+    Keep up to per_class spectrograms of each rasa (random sample) as the
+    replay buffer for fine-tuning, plus the regression-check partition,
+    which is stored as given and never replayed. Stored as float16 (half
+    the size; the spectrograms are normalized, so the precision loss does
+    not matter)
+    """
+    keep = replay_sample(y, per_class, seed)
+    
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    tmp_path = cache_path + '.tmp.npz'
+    np.savez(tmp_path, X=X[keep].astype(np.float16), y=y[keep],
+             X_check=X_check.astype(np.float16), y_check=y_check)
+    os.replace(tmp_path, cache_path)
+    print(f"💾 Replay buffer: {len(keep)} samples (+ {len(X_check)} check samples) saved to {cache_path}")
+
+def load_replay_buffer(cache_path):
+    """
+    Returns:
+        (X, y, X_check, y_check); the check arrays are None for buffers
+        written before the check partition was stored separately
+    """
+    with np.load(cache_path) as data:
+        if 'X_check' not in data:
+            return data['X'].astype(np.float32), data['y'], None, None
+        return (data['X'].astype(np.float32), data['y'],
+                data['X_check'].astype(np.float32), data['y_check'])
+
+def class_accuracy(model, X, labels, label_encoder):
+    """Overall and per-rasa accuracy of a model"""
+    predicted = label_encoder.inverse_transform(model.predict(X, verbose=0).argmax(axis=1))
+    per_class = {
+        emotion: round(float(np.mean(predicted[labels == emotion] == emotion)), 4)
+        for emotion in np.unique(labels)
+    }
+    return round(float(np.mean(predicted == labels)), 4), per_class
+
+def freeze_backbone(model):
+    """Make the convolutional blocks untrainable; only the dense head learns"""
+    for layer in model.layers:
+        if isinstance(layer, layers.GlobalAveragePooling2D):
+            break
+        layer.trainable = False
+
+def finetune(dataset_path, base_model_path='models/navarasa_cnn.h5', replay_cache=None,
+             replay_dataset=None, output_path=None, replay_ratio=4, frozen_backbone=False,
+             epochs=10, learning_rate=None, max_regression=0.02, promote=False, dedupe=False):
+    """
+    Warm-start fine-tuning on newly labelled tracks
+    
+    Starts from the current model instead of random weights and trains for
+    a few epochs on the new tracks (dataset_path, same folder layout as
+    train()) mixed with replay_ratio old samples per new one, drawn from the
+    replay buffer (replay_cache) so the model does not forget what it knew.
+    The buffer is written by train(replay_cache=...), or built once from
+    replay_dataset when missing. It carries a fixed check partition that
+    is never trained on and stays the same across rounds: base and
+    fine-tuned models are both scored on it, and the new model is
+    rejected if its accuracy on the old data - overall or for any rasa -
+    drops by more than max_regression.
+    
+    With frozen_backbone=True only the dense head is trained (faster,
+    safest for a handful of samples).
+    
+    The result is written as a new versioned model next to the base one
+    (navarasa_cnn-ft<timestamp>.h5, with its encoder and a report); with
+    promote=True an accepted model also replaces the base model, which
+    the service then reports as a new model version.
+    """
+    print("🚀 Starting fine-tuning pipeline...")
+    start = time.perf_counter()
+    
+    if output_path is None:
+        output_path = base_model_path.replace('.h5', f"-ft{time.strftime('%Y%m%d-%H%M%S')}.h5")
+    
+    print(f"📥 Loading base model from {base_model_path}...")
+    model = keras.models.load_model(base_model_path)
+    with open(base_model_path.replace('.h5', '_encoder.pkl'), 'rb') as f:
+        label_encoder = pickle.load(f)
+    
+    # Replay buffer of old samples and its fixed check partition
+    if replay_cache and os.path.exists(replay_cache):
+        X_old, y_old, X_check, y_check = load_replay_buffer(replay_cache)
+        if X_check is None:
+            print("🔒 Replay buffer has no check partition - setting one aside for good")
+            X_old, y_old, X_check, y_check = split_check(X_old, y_old)
+            save_replay_buffer(replay_cache, X_old, y_old, X_check, y_check)
+    elif replay_dataset:
+        print(f"📂 No replay buffer yet - building it from {replay_dataset}")
+        X_old, y_old, X_check, y_check = split_check(*load_dataset(replay_dataset, dedupe=dedupe))
+        if replay_cache:
+            save_replay_buffer(replay_cache, X_old, y_old, X_check, y_check)
+            X_old, y_old, X_check, y_check = load_replay_buffer(replay_cache)
+    else:
+        print("❌ Fine-tuning needs a replay buffer (--replay-cache) or the old dataset (--replay-dataset)")
+        return
+    print(f"🔁 Replay buffer: {len(X_old)} samples, {len(X_check)} check samples")
+    
+    X_new, y_new = load_dataset(dataset_path, dedupe=dedupe)
+    if len(X_new) == 0:
+        print("❌ No new samples loaded. Check your dataset path.")
+        return
+    
+    unknown = sorted(set(y_new) - set(label_encoder.classes_))
+    if unknown:
+        print(f"❌ Labels unknown to the base model: {', '.join(unknown)} - retrain from scratch instead")
+        return
+    
+    # The check partition is held out of the buffer, so replay can draw from all of it
+    rng = np.random.default_rng(42)
+    replay_count = min(len(X_old), replay_ratio * len(X_new))
+    replay_idx = rng.choice(len(X_old), size=replay_count, replace=False)
+    X_train = np.concatenate([X_new, X_old[replay_idx]])
+    y_train = np.concatenate([y_new, y_old[replay_idx]])
+    y_onehot = keras.utils.to_categorical(label_encoder.transform(y_train),
+                                          num_classes=model.output_shape[-1])
+    
+    print(f"📊 Fine-tuning set:")
+    print(f"   New samples: {len(X_new)}")
+    print(f"   Replayed samples: {replay_count}")
+    print(f"   Regression check samples: {len(X_check)}")
+    
+    base_accuracy, base_per_class = class_accuracy(model, X_check, y_check, label_encoder)
+    
+    if frozen_backbone:
+        freeze_backbone(model)
+    if learning_rate is None:
+        # A tenth of train()'s rate for the whole network; the head alone can move faster
+        learning_rate = 1e-4 if frozen_backbone else 1e-5
+    model.compile(
+        optimizer=keras.optimizers.Adam(learning_rate=learning_rate),
+        loss='categorical_crossentropy',
+        metrics=['accuracy']
+    )
+    print(f"   Trainable parameters: {sum(int(np.prod(w.shape)) for w in model.trainable_weights):,}")
+    
+    callbacks = [
+        keras.callbacks.EarlyStopping(
+            monitor='loss',
+            patience=3,
+            restore_best_weights=True
+        ),
+    ]
+    
+    print(f"🎓 Fine-tuning ({'frozen backbone' if frozen_backbone else 'all layers'}, lr={learning_rate})...")
+    history = model.fit(
+        X_train, y_onehot,
+        epochs=epochs,
+        batch_size=32,
+        shuffle=True,
+        callbacks=callbacks,
+        verbose=1
+    )
+    
+    # Regression check on the held-out old samples
+    print("📈 Checking old-data accuracy...")
+    accuracy, per_class = class_accuracy(model, X_check, y_check, label_encoder)
+    new_accuracy, _ = class_accuracy(model, X_new, y_new, label_encoder)
+    regressions = {
+        emotion: round(base_per_class[emotion] - per_class[emotion], 4)
+        for emotion in base_per_class
+        if base_per_class[emotion] - per_class[emotion] > max_regression
+    }
+    accepted = base_accuracy - accuracy <= max_regression and not regressions
+    
+    for emotion in base_per_class:
+        print(f"   {emotion:<10} {base_per_class[emotion] * 100:6.2f}% -> {per_class[emotion] * 100:6.2f}%")
+    print(f"   Old data: {base_accuracy * 100:.2f}% -> {accuracy * 100:.2f}%")
+    print(f"   New samples (trained on): {new_accuracy * 100:.2f}%")
+    
+    report = {
+        'base_model': base_model_path,
+        'model': output_path,
+        'new_samples': int(len(X_new)),
+        'replayed_samples': int(replay_count),
+        'check_samples': int(len(X_check)),
+        'frozen_backbone': frozen_backbone,
+        'learning_rate': learning_rate,
+        'epochs': len(history.history['loss']),
+        'old_accuracy': {'before': base_accuracy, 'after': accuracy},
+        'old_accuracy_per_rasa': {'before': base_per_class, 'after': per_class},
+        'new_sample_accuracy': new_accuracy,
+        'max_regression': max_regression,
+        'regressions': regressions,
+        'accepted': accepted,
+        'seconds': round(time.perf_counter() - start, 1),
+    }
+    report_path = output_path.replace('.h5', '_report.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    
+    if not accepted:
+        print(f"❌ Rejected: old-data accuracy regressed by more than {max_regression * 100:.1f} points "
+              f"({', '.join(regressions) or 'overall'})")
+        print(f"💾 Report saved to: {report_path}")
+        return model, history, report
+    
+    # Save trainable again so the file loads like a train() model
+    for layer in model.layers:
+        layer.trainable = True
+    model.save(output_path)
+    with open(output_path.replace('.h5', '_encoder.pkl'), 'wb') as f:
+        pickle.dump(label_encoder, f)
+    print(f"💾 Model saved to: {output_path}")
+    print(f"💾 Report saved to: {report_path}")
+    
+    if promote:
+        import shutil
+        shutil.copyfile(output_path, base_model_path + '.tmp')
+        os.replace(base_model_path + '.tmp', base_model_path)
+        print(f"✅ Promoted to {base_model_path}")
+    
+    # The new samples join the replay buffer for the next round; the check partition stays as is
+    if replay_cache:
+        save_replay_buffer(replay_cache, np.concatenate([X_old, X_new]), np.concatenate([y_old, y_new]),
+                           X_check, y_check)
+    
+    print(f"⏱️ Fine-tuned in {report['seconds']:.0f}s")
+    return model, history, report
+
 if __name__ == "__main__":
     import argparse
     
@@ -251,11 +1094,84 @@ if __name__ == "__main__":
                        help='Path to dataset folder')
     parser.add_argument('--output', type=str, default='models/navarasa_cnn.h5',
                        help='Path to save trained model')
+    parser.add_argument('--dedupe', action='store_true',
+                       help='Drop near-duplicate tracks (audio fingerprint match)')
+    parser.add_argument('--graph-preprocessing', action='store_true',
+                       help='Train on waveforms with the mel spectrogram computed in-graph')
+    parser.add_argument('--distill', action='store_true',
+                       help='Train the lightweight student from a trained teacher')
+    parser.add_argument('--teacher', type=str, default='models/navarasa_cnn.h5',
+                       help='Teacher model for --distill')
+    parser.add_argument('--temperature', type=float, default=4.0,
+                       help='Softmax temperature for --distill')
+    parser.add_argument('--alpha', type=float, default=0.3,
+                       help='Weight of the hard-label loss for --distill')
+    parser.add_argument('--finetune', action='store_true',
+                       help='Fine-tune the current model on the new tracks in --dataset')
+    parser.add_argument('--base-model', type=str, default='models/navarasa_cnn.h5',
+                       help='Model to start from for --finetune')
+    parser.add_argument('--replay-cache', type=str,
+                       help='Replay buffer of old spectrograms (written by training, read by --finetune)')
+    parser.add_argument('--replay-dataset', type=str,
+                       help='Old dataset to build the replay buffer from when it does not exist yet')
+    parser.add_argument('--replay-ratio', type=int, default=4,
+                       help='Old samples replayed per new sample for --finetune')
+    parser.add_argument('--freeze-backbone', action='store_true',
+                       help='Only train the dense head for --finetune')
+    parser.add_argument('--epochs', type=int,
+                       help='Maximum epochs (default: 50, 10 for --finetune)')
+    parser.add_argument('--batch-size', type=int, default=32,
+                       help='Batch size per worker for distributed training')
+    parser.add_argument('--workers', type=int,
+                       help='Train data-parallel with this many worker processes on this host')
+    parser.add_argument('--cluster', type=str,
+                       help='Cluster spec (JSON file or string, {"worker": ["host:port", ...]}) '
+                            'for distributed training across hosts; run once per worker')
+    parser.add_argument('--task-index', type=int, default=0,
+                       help='This worker\'s index in --cluster')
+    parser.add_argument('--learning-rate', type=float,
+                       help='Learning rate for --finetune (default: 1e-5, 1e-4 with --freeze-backbone)')
+    parser.add_argument('--max-regression', type=float, default=0.02,
+                       help='Largest accepted drop in old-data accuracy for --finetune')
+    parser.add_argument('--promote', action='store_true',
+                       help='Replace the base model with an accepted fine-tuned one')
     
     args = parser.parse_args()
     
+    if args.distill and args.output == parser.get_default('output'):
+        args.output = 'models/navarasa_cnn_student.h5'
+    if args.finetune and args.output == parser.get_default('output'):
+        # Versioned name next to the base model
+        args.output = None
+    
     # Create models directory
-    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    os.makedirs(os.path.dirname(args.output or args.base_model), exist_ok=True)
+    
+    if args.workers and not args.cluster:
+        # Re-run this command once per worker with a localhost cluster spec
+        import sys
+        argv = [a for a in sys.argv[1:] if not a.startswith('--workers=')]
+        if '--workers' in argv:
+            i = argv.index('--workers')
+            del argv[i:i + 2]
+        raise SystemExit(launch_local_workers(args.workers, argv))
     
-    # Train
-    train(args.dataset, args.output)
+    if args.cluster:
+        if args.finetune or args.distill or args.graph_preprocessing or args.dedupe:
+            parser.error('distributed training supports plain training only')
+        train_distributed(args.dataset, load_cluster(args.cluster), args.task_index, args.output,
+                          batch_size=args.batch_size, epochs=args.epochs or 50)
+    elif args.finetune:
+        finetune(args.dataset, args.base_model, replay_cache=args.replay_cache,
+                 replay_dataset=args.replay_dataset, output_path=args.output,
+                 replay_ratio=args.replay_ratio, frozen_backbone=args.freeze_backbone,
+                 epochs=args.epochs or 10, learning_rate=args.learning_rate,
+                 max_regression=args.max_regression, promote=args.promote, dedupe=args.dedupe)
+    elif args.distill:
+        distill(args.dataset, args.teacher, args.output,
+                temperature=args.temperature, alpha=args.alpha, dedupe=args.dedupe)
+    else:
+        # Train
+        train(args.dataset, args.output, dedupe=args.dedupe,
+              graph_preprocessing=args.graph_preprocessing, replay_cache=args.replay_cache,
+              epochs=args.epochs or 50)